@@ -1,7 +1,6 @@
-import os
 import time
 import json
-import re
+import argparse
 import multiprocessing as mp
 import shutil
 import sys
@@ -11,12 +10,21 @@ sys.path.append(str(Path(__file__).parent))
 
 from anidownloader_config.defaults import (
     DEFAULT_SERIES_JSON_PATH, 
+    DEFAULT_SERIES_DB_PATH,
     DEFAULT_OUTPUT_DIR, 
-    DEFAULT_LOG_FILE
+    DEFAULT_LOG_FILE,
+    DEFAULT_RELEASE_SCHEDULE_PATH,
+    ensure_default_dirs,
+    worker_processes
 )
 from anidownloader_config.app_config_manager import AppConfigManager
-from anidownloader_core.planning_service import plan_single_series
-from anidownloader_core.media_processor import process_series_task
+from anidownloader_core.planning_service import PlanningExecutors, construct_final_filename
+from anidownloader_core.lease_store import LeaseStore, describe_holder
+from anidownloader_core.release_schedule import ReleaseScheduler
+from anidownloader_core.metrics import MetricsSink
+from anidownloader_core.profiling import PROFILE_CPROFILE, PROFILE_SAMPLING, profile_settings, profile_section
+# media_processor viene importato in main() solo se ci sono episodi da elaborare:
+# nel caso più frequente (nessun nuovo episodio) la CLI non ne paga il costo.
 
 JSON_FILE_PATH = DEFAULT_SERIES_JSON_PATH
 OUTPUT_DIR = DEFAULT_OUTPUT_DIR 
@@ -29,8 +37,13 @@ def check_dependencies():
         sys.exit(1)
     print("✅ Dipendenze di sistema trovate.")
 
-def load_series_data():
+def load_series_data(backend="json", db_path=None):
     try:
+        if backend == "sqlite":
+            from anidownloader_core.sqlite_series_repository import SQLiteSeriesRepository
+            repository = SQLiteSeriesRepository(db_path or DEFAULT_SERIES_DB_PATH, json_import_path=JSON_FILE_PATH)
+            try: return repository.load_series_data()
+            finally: repository.close()
         JSON_FILE_PATH.parent.mkdir(parents=True, exist_ok=True)
         with open(JSON_FILE_PATH, 'r', encoding='utf-8') as f:
             return json.load(f)
@@ -41,33 +54,97 @@ def load_series_data():
         print(f"ERRORE: Impossibile caricare '{JSON_FILE_PATH}': {e}")
         sys.exit(1)
 
-def display_status(status_dict, tasks_names, start_time):
-    print("\033c", end="")
-    elapsed = time.time() - start_time
-    print(f"--- Stato Attività (Tempo: {elapsed:.0f}s) ---")
-    for name in tasks_names:
-        print(f"- {name:<35} : {status_dict.get(name, '...')}")
-    print("\nLavori in corso...")
+def update_eta(eta, progress_dict, last_progress):
+    # Solo gli eventi nuovi aggiornano il modello: una copia del dizionario condiviso per ciclo
+    for name, data in progress_dict.copy().items():
+        if last_progress.get(name) != data:
+            last_progress[name] = data
+            eta.update(name, data)
+
+def record_metrics(planned_tasks, results, start_time, textfile_path=None, history_detail_days=None):
+    # Le metriche non devono mai far fallire un'esecuzione
+    try:
+        MetricsSink(LOG_FILE.parent, textfile_path, history_detail_days=history_detail_days).record_run(planned_tasks, results, start_time, mode="cli")
+    except Exception as e:
+        print(f"ATTENZIONE: Impossibile salvare le metriche: {e}")
+
+def report_profile(profile):
+    if not profile or not Path(profile["dir"]).exists(): return
+    from anidownloader_core.profiling import write_report
+    print(f"\n📊 Report di profilazione: {write_report(Path(profile['dir']))}")
 
 class CLIStatusUpdater:
-    def __init__(self, status_dict):
+    def __init__(self, status_dict, progress_dict=None):
         self._status_dict = status_dict
+        self._progress_dict = progress_dict
     def update_progress(self, series_name: str, message: str):
         self._status_dict[series_name] = message
     def report_error(self, series_name: str, error_message: str):
         self._status_dict[series_name] = f"❌ Errore: {error_message}"
+    def report_progress(self, series_name: str, data: dict):
+        if self._progress_dict is not None: self._progress_dict[series_name] = data
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="AniDownloader CLI: scarica e converte i nuovi episodi delle serie configurate.")
+    subparsers = parser.add_subparsers(dest="command")
+    parser.add_argument("--all", action="store_true", help="Controlla tutte le serie, ignorando la pianificazione adattiva.")
+    parser.add_argument("--profile", nargs="?", const=PROFILE_CPROFILE, choices=[PROFILE_CPROFILE, PROFILE_SAMPLING],
+                        help="Profila pianificazione, orchestrazione e worker (predefinito: cprofile; 'sampling' ha un costo trascurabile).")
+    subparsers.add_parser("run", help="Esegue un singolo controllo e termina (comportamento predefinito).")
+    subparsers.add_parser("daemon", help="Resta in esecuzione e controlla periodicamente le serie.")
+    history_parser = subparsers.add_parser("history", help="Mostra lo storico degli episodi elaborati.")
+    history_parser.add_argument("--series", help="Filtra per serie (prefisso del nome, senza distinzione tra maiuscole e minuscole).")
+    history_parser.add_argument("--slowest", action="store_true", help="Ordina per durata totale invece che per data.")
+    history_parser.add_argument("--since", help="Solo gli episodi recenti: es. 7d, 12h, 2w oppure AAAA-MM-GG.")
+    history_parser.add_argument("--limit", type=int, default=20, help="Numero massimo di righe.")
+    history_parser.add_argument("--json", action="store_true", help="Output in formato JSON.")
+    history_parser.add_argument("--sources", action="store_true", help="Mostra il tasso di successo di ogni fonte (servizio e host di download).")
+    history_parser.add_argument("--compact", action="store_true", help="Compatta subito lo storico (riassunto dei dati vecchi e vacuum).")
+    return parser.parse_args()
+
+def show_history(args):
+    from anidownloader_core.metrics import HISTORY_DB_NAME
+    from anidownloader_core.run_history import RunHistory, print_history, print_source_stats
+    history = RunHistory(LOG_FILE.parent / HISTORY_DB_NAME)
+    try:
+        if args.compact:
+            history.compact(); print("Storico compattato.")
+        if args.sources:
+            print_source_stats(history, as_json=args.json); return
+        print_history(history, series=args.series, since=args.since, slowest=args.slowest, limit=args.limit, as_json=args.json)
+    finally:
+        history.close()
+
+def run_daemon():
+    check_dependencies()
+    ensure_default_dirs()
+    from anidownloader_core.daemon import AniDownloaderDaemon
+    AniDownloaderDaemon(series_json_path=JSON_FILE_PATH).run()
 
-def main():
+def main(check_all=False, profile_mode=None):
     check_dependencies()
+    ensure_default_dirs()
     
     # --- MODIFICA CHIAVE: Uso corretto di AppConfigManager ---
     print("Caricamento configurazione applicazione...")
+    series_backend, series_db_path, adaptive_schedule, metrics_textfile_path, encoder = "json", None, False, None, None
+    config_profile_mode, history_detail_days, app_config = None, None, {}
     try:
         # 1. Crea un'istanza. Il costruttore carica automaticamente il file.
         config_manager = AppConfigManager()
+        if config_manager.load_warning():
+            print(f"ATTENZIONE: {config_manager.load_warning()}")
         # 2. Usa il metodo 'get' per leggere l'impostazione.
         convert_to_h265 = config_manager.get('convert_to_h265', False)
         print(f"ℹ️ Conversione H.265: {'Abilitata' if convert_to_h265 else 'Disabilitata'}")
+        series_backend = config_manager.get('series_backend', 'json')
+        series_db_path = Path(config_manager.get('series_db_path', str(DEFAULT_SERIES_DB_PATH)))
+        adaptive_schedule = config_manager.get('adaptive_schedule', True)
+        metrics_textfile_path = config_manager.get('metrics_textfile_path') or None
+        encoder = config_manager.get('encoder')
+        config_profile_mode = config_manager.get('profile_mode')
+        history_detail_days = config_manager.get('history_detail_days')
+        app_config = config_manager.get_all()
     except Exception as e:
         # Aggiungiamo un traceback per un debug più facile in caso di errori imprevisti
         import traceback
@@ -76,95 +153,147 @@ def main():
         convert_to_h265 = False
     # --- FINE MODIFICA ---
 
-    series_list = load_series_data()
+    series_list = load_series_data(series_backend, series_db_path)
     if not series_list:
         print("Nessuna serie configurata. Uscita."); return
 
-    start_time = time.time()
+    scheduler = ReleaseScheduler(DEFAULT_RELEASE_SCHEDULE_PATH)
+    if adaptive_schedule and not check_all:
+        due_series = scheduler.due_series(series_list)
+        print(f"ℹ️ Pianificazione adattiva: {len(due_series)}/{len(series_list)} serie da controllare ora.")
+        series_list = due_series
+        if not series_list:
+            print("✅ Nessuna serie da controllare in questo momento."); return
 
-    print("Pianificazione attività in corso...")
-    with mp.Pool(mp.cpu_count()) as pool:
-        planned_tasks = pool.map(plan_single_series, series_list)
+    profile = profile_settings(profile_mode or config_profile_mode, LOG_FILE.parent / "profiles")
+    # Ogni esecuzione elabora solo le serie e gli episodi di cui ha il lease (altre istanze, altre macchine)
+    leases = LeaseStore.from_config(app_config, kind="cli").start()
+    if leases.shared: print(f"ℹ️ Coordinamento multi-nodo: {len(leases.live_nodes())} nodi attivi ({leases.path})")
+    try:
+        start_time = time.time()
+        holder = leases.acquire_run_lock()
+        if holder is not None:
+            # Senza terminale (timer systemd) si lascia il lavoro all'esecuzione già attiva
+            if not sys.stdout.isatty():
+                print(f"⏭️ Esecuzione saltata: è già in corso un'altra esecuzione ({describe_holder(holder)})."); return
+            print(f"ℹ️ È in corso un'altra esecuzione ({describe_holder(holder)}): gli episodi già in lavorazione verranno saltati.")
 
-    to_process = [t for t in planned_tasks if t["action"] == "process"]
-    to_skip = [t for t in planned_tasks if t["action"] == "skip"]
+        print("Pianificazione attività in corso...")
+        with PlanningExecutors() as planning_executors:
+            planned_tasks = planning_executors.plan(series_list, profile, leases)
+        scheduler.record_plan_results(planned_tasks)
+        leases.claim_episodes(planned_tasks)
 
-    print("\n--- Piano di Esecuzione ---")
-    if to_process:
-        for t in to_process: print(f"📥 {t['series']['name']} - {t['reason']}")
-    else:
-        print("✅ Nessun nuovo episodio da scaricare.")
-
-    if to_skip:
-        print("\n🚫 Serie saltate:")
-        for t in to_skip: print(f"  - {t['series']['name']}: {t['reason']}")
-
-    if not to_process:
-        return
-
-    for task in to_process:
-        series = task["series"]
-        download_url = task["download_url"]
-        final_ep_number = task["final_ep_number"]
-        url_filename = download_url.split("/")[-1].split("?")[0]
-        filename_root = series.get("filename_root")
-        if not filename_root:
-            match = re.match(r'(.*?)_Ep_', url_filename, re.IGNORECASE)
-            filename_root = match.group(1) if match else os.path.splitext(url_filename)[0]
-        suffix_match = re.search(r'(_Ep_.*)', url_filename, re.IGNORECASE)
-        if suffix_match:
-            suffix = suffix_match.group(1)
-            correct_suffix = re.sub(r'(\d+)', f'{final_ep_number:02d}', suffix, 1)
-            task["final_filename"] = filename_root + correct_suffix
+        to_process = [t for t in planned_tasks if t["action"] == "process"]
+        to_skip = [t for t in planned_tasks if t["action"] == "skip"]
+
+        print("\n--- Piano di Esecuzione ---")
+        if to_process:
+            for t in to_process: print(f"📥 {t['series']['name']} - {t['reason']}")
         else:
-            task["final_filename"] = f"{filename_root}_Ep_{final_ep_number:02d}.mp4"
+            print("✅ Nessun nuovo episodio da scaricare.")
+
+        if to_skip:
+            print("\n🚫 Serie saltate:")
+            for t in to_skip: print(f"  - {t['series']['name']}: {t['reason']}")
+
+        if not to_process:
+            record_metrics(planned_tasks, [], start_time, metrics_textfile_path, history_detail_days)
+            return
+
+        from anidownloader_core.media_processor import process_series_task
+        from anidownloader_core.metrics import HISTORY_DB_NAME
+        from anidownloader_core.eta import EtaPriors, RunEta, download_host, encode_profile
+        from anidownloader_core.status_renderer import StatusRenderer
+        from anidownloader_core.process_registry import ProcessRegistry, format_shutdown_stats
+        from anidownloader_core.log_service import LogListener, new_task_id
+        from anidownloader_core.remote_encode import encode_targets
+
+        process_registry = ProcessRegistry.for_run(LOG_FILE.parent)
+        targets = encode_targets(app_config) if convert_to_h265 else None
+        if targets: print(f"ℹ️ Conversione distribuita: {targets['local_slots']} slot locali + {len(targets['remote'])} agenti remoti")
+        for task in to_process:
+            task["final_filename"] = construct_final_filename(task)
+            task["queued_at"] = time.time()
+            task["profile"] = profile
+            task["process_registry"] = process_registry.path
+            task["task_id"] = new_task_id()
+            task["encode_targets"] = targets
     
-    with mp.Manager() as manager:
-        status_dict = manager.dict({t['series']['name']: "In coda..." for t in to_process})
-        names = [t['series']['name'] for t in to_process]
+        with profile_section(profile, "orchestrate"), mp.Manager() as manager, LogListener(LOG_FILE, manager.Queue()) as log_listener:
+            for task in to_process: task["log_queue"] = log_listener.queue
+            status_dict = manager.dict({t['series']['name']: "In coda..." for t in to_process})
+            names = [t['series']['name'] for t in to_process]
         
-        cli_status_updater = CLIStatusUpdater(status_dict)
-        stop_event = manager.Event()
+            progress_dict = manager.dict()
+            cli_status_updater = CLIStatusUpdater(status_dict, progress_dict)
+            stop_event = manager.Event()
+
+            processes = worker_processes(app_config)
+            eta, last_progress = RunEta(EtaPriors.from_history(LOG_FILE.parent / HISTORY_DB_NAME), workers=processes), {}
+            for t in to_process:
+                eta.add_task(t['series']['name'], download_host(t['download_url']), encode_profile(encoder), convert_to_h265)
+            renderer = StatusRenderer(names)
         
-        results = []
-        with mp.Pool(mp.cpu_count()) as pool:
-            pool_args = [(task, OUTPUT_DIR, LOG_FILE, cli_status_updater, stop_event, convert_to_h265) for task in to_process]
-            async_results = pool.starmap_async(process_series_task, pool_args)
-
-            try:
-                while not async_results.ready():
-                    display_status(status_dict, names, start_time)
-                    time.sleep(1)
+            results = []
+            with mp.Pool(processes) as pool:
+                pool_args = [(task, OUTPUT_DIR, LOG_FILE, cli_status_updater, stop_event, convert_to_h265, encoder) for task in to_process]
+                async_results = pool.starmap_async(process_series_task, pool_args)
+
+                try:
+                    while not async_results.ready():
+                        update_eta(eta, progress_dict, last_progress)
+                        renderer.render(status_dict.copy(), start_time, eta)
+                        time.sleep(1)
                 
-                results = async_results.get()
+                    results = async_results.get()
                 
-                for r in results:
-                    if r and r.get("name"):
-                        if r.get("error"):
-                            status_dict[r['name']] = "❌ Errore"
-                        else:
-                            status_dict[r['name']] = "✅ Fatto"
-            except KeyboardInterrupt:
-                print("\nInterruzione richiesta dall'utente... Chiusura dei processi.")
-                stop_event.set()
-                pool.terminate()
-                pool.join()
-                print("Processi terminati.")
-                sys.exit(1)
-
-        display_status(status_dict, names, start_time)
-        end_time = time.time()
-
-        print("\n\n--- Resoconto Finale ---")
-        for r in results:
-            if r:
-                if r["error"]:
-                    print(f"❌ {r['name']:<30} | Errore: {r['error']}")
-                else:
-                    print(f"✅ {Path(r['episode']).name:<50} | DL: {r['download_time']:.2f}s | Conv: {r['conversion_time']:.2f}s")
-
-        print(f"\nTempo totale: {end_time - start_time:.2f} secondi")
+                    for r in results:
+                        if r and r.get("name"):
+                            if r.get("error"):
+                                status_dict[r['name']] = "❌ Errore"
+                            elif r.get("duplicate_of"):
+                                status_dict[r['name']] = "⏭️ Duplicato"
+                            else:
+                                status_dict[r['name']] = "✅ Fatto"
+                except KeyboardInterrupt:
+                    print("\nInterruzione richiesta dall'utente... Chiusura dei processi.")
+                    stop_event.set()
+                    # aria2c e ffmpeg girano in gruppi propri e non ricevono il Ctrl+C del terminale
+                    stats = process_registry.terminate_all()
+                    pool.terminate()
+                    pool.join()
+                    process_registry.close()
+                    print(f"Processi terminati: {format_shutdown_stats(stats)}.")
+                    sys.exit(1)
+
+            renderer.close(status_dict.copy(), start_time)
+            process_registry.close()
+            end_time = time.time()
+
+            print("\n\n--- Resoconto Finale ---")
+            for r in results:
+                if r:
+                    if r["error"]:
+                        print(f"❌ {r['name']:<30} | Errore: {r['error']}")
+                    elif r.get("duplicate_of"):
+                        print(f"⏭️ {r['name']:<30} | Già presente come {r['duplicate_of']}")
+                    else:
+                        print(f"✅ {Path(r['episode']).name:<50} | DL: {r['download_time']:.2f}s | Conv: {r['conversion_time']:.2f}s")
+
+            print(f"\nTempo totale: {end_time - start_time:.2f} secondi")
+            record_metrics(planned_tasks, results, start_time, metrics_textfile_path, history_detail_days)
+    finally:
+        leases.stop()
+        report_profile(profile)
+
 
 if __name__ == '__main__':
     mp.freeze_support()
-    main()
+    args = parse_args()
+    if args.command == "daemon":
+        run_daemon()
+    elif args.command == "history":
+        show_history(args)
+    else:
+        main(check_all=args.all, profile_mode=args.profile)
@@ -1,74 +1,100 @@
 import os
-import re
-import multiprocessing as mp
+import time
 import shutil
+from contextlib import ExitStack
 from pathlib import Path
 from queue import Empty
 from PyQt6.QtCore import QObject, pyqtSignal, QTimer
 
-from anidownloader_core.planning_service import plan_single_series
-from anidownloader_core.media_processor import process_series_task
+from anidownloader_core.planning_service import construct_final_filename
+from anidownloader_core.worker_bootstrap import QueueStatusUpdater, process_series_task
+from anidownloader_core.release_schedule import ReleaseScheduler
+from anidownloader_core.metrics import MetricsSink, HISTORY_DB_NAME
+from anidownloader_core.eta import EtaPriors, RunEta, download_host, encode_profile, format_duration
+from anidownloader_core.process_registry import ProcessRegistry, format_shutdown_stats
+from anidownloader_core.log_service import LogListener, new_task_id
+from anidownloader_core.lease_store import LeaseStore, describe_holder
+from anidownloader_core.profiling import PROFILE_SAMPLING, profile_settings, profile_section
+from anidownloader_config.defaults import DEFAULT_RELEASE_SCHEDULE_PATH
+from core.worker_pools import WorkerPools
 
 try:
     import psutil
 except ImportError:
     psutil = None
 
+# Attesa massima perché i worker si liberino dopo uno stop, prima di scartare il Pool
+POOL_STOP_TIMEOUT = 10
+
 class DownloadSignals(QObject):
     progress = pyqtSignal(str, str)
     error = pyqtSignal(str, str)
     finished = pyqtSignal(str, str, float, float)
     task_skipped = pyqtSignal(str, str)
     overall_status = pyqtSignal(str)
+    throughput = pyqtSignal(str) # Banda, fps di conversione e fine stimata, per la barra di stato
 
 class DownloadWorker(QObject):
-    def __init__(self, series_list, json_file_path: Path, log_file_path: Path, output_dir: Path, convert_to_h265: bool):
+    def __init__(self, series_list, json_file_path: Path, log_file_path: Path, output_dir: Path, convert_to_h265: bool, encoder: dict = None, profile_mode: str = None,
+                 pools: WorkerPools = None, encode_targets: dict = None, leases: LeaseStore = None,
+                 metrics_textfile_path: str = None, history_detail_days: int = None):
         super().__init__()
+        # Senza pool condivisi dalla finestra se ne crea uno solo per questa esecuzione
+        self._owns_pools = pools is None
+        self._pools = pools or WorkerPools()
         self._json_file_path = json_file_path
         self._log_file_path = log_file_path
         self._output_dir = output_dir
         self._convert_to_h265 = convert_to_h265
+        self._encoder = encoder
+        self._encode_targets = encode_targets # Agenti di conversione remota (vedi anidownloader_core/remote_encode.py)
+        self._leases = leases # Lease condivisi con le altre esecuzioni e gli altri nodi (vedi anidownloader_core/lease_store.py)
+        self._metrics_textfile_path = metrics_textfile_path or None # Stesse impostazioni delle metriche di CLI e demone
+        self._history_detail_days = history_detail_days
+        self._profile = profile_settings(profile_mode, Path(log_file_path).parent / "profiles")
+        self._profile_stack = ExitStack() # Sezioni di profilazione aperte tra una chiamata del timer e l'altra
         self._signals = DownloadSignals()
         self._is_running = True
-        self._pool = self._manager = self._queue = self._stop_event = self._timer = None
+        self._stop_requested_at = None
+        self._pool = self._queue = self._stop_event = self._timer = None
+        self._log_listener = None
+        self._planning_executors = None
+        self._process_registry = ProcessRegistry.for_run(Path(log_file_path).parent)
         self._active_tasks = []
         self._active_tasks_info = []
+        self._planned_tasks = []
+        self._run_started_at = None
+        self._eta = None
         self._series_list = series_list
         self._state = "idle"
 
-    def _construct_final_filename(self, task):
-        series = task["series"]; download_url = task["download_url"]; final_ep_number = task["final_ep_number"]
-        url_filename = download_url.split("/")[-1].split("?")[0]
-        filename_root = series.get("filename_root")
-        if not filename_root:
-            match = re.match(r'(.*?)_Ep_', url_filename, re.IGNORECASE)
-            filename_root = match.group(1) if match else os.path.splitext(url_filename)[0]
-        suffix_match = re.search(r'(_Ep_.*)', url_filename, re.IGNORECASE)
-        if suffix_match:
-            suffix = suffix_match.group(1)
-            correct_suffix = re.sub(r'(\d+)', f'{final_ep_number:02d}', suffix, 1)
-            return filename_root + correct_suffix
-        return f"{filename_root}_Ep_{final_ep_number:02d}.mp4"
-
     def request_stop(self):
+        self._stop_requested_at = time.monotonic() # La latenza di spegnimento si misura dalla richiesta
         self._is_running = False
         if self._stop_event: self._stop_event.set()
 
     def _safe_shutdown(self):
+        shutdown_start = self._stop_requested_at or time.monotonic()
         if self._timer: self._timer.stop()
         for task_info in self._active_tasks_info:
             self._signals.progress.emit(task_info['name'], "❌ Interrotto")
         self._signals.overall_status.emit("Interruzione forzata dei processi...")
+        if self._planning_executors:
+            self._pools.discard_planning(); self._planning_executors = None
+        # Solo i gruppi di processi avviati da questa esecuzione: gli altri ffmpeg/aria2c della macchina restano intatti
+        stats = self._process_registry.terminate_all()
         if self._pool:
-            self._pool.terminate(); self._pool.join()
-        if psutil:
-            for proc in psutil.process_iter(['name']):
-                try:
-                    if proc.name().lower() in ["ffmpeg", "aria2c", "ffmpeg.exe", "aria2c.exe"]:
-                        proc.kill()
-                except (psutil.NoSuchProcess, psutil.AccessDenied): pass
+            # Senza aria2c/ffmpeg i worker vedono l'evento di stop e tornano liberi: il Pool resta caldo.
+            # Se qualcuno non risponde entro il limite, il Pool viene scartato e ricreato alla prossima esecuzione.
+            self._active_tasks.wait(timeout=POOL_STOP_TIMEOUT)
+            if not self._active_tasks.ready(): self._pools.discard_pool()
+        late = self._process_registry.terminate_all(grace=1.0) # Avviati mentre il Pool veniva terminato
+        stats = {"groups": stats["groups"] + late["groups"], "killed": stats["killed"] + late["killed"], "seconds": time.monotonic() - shutdown_start}
+        self._process_registry.close()
         self._cleanup_temp_files()
-        self._signals.overall_status.emit("Interruzione completata.")
+        self._finish_profile()
+        self._signals.overall_status.emit(f"Interruzione completata: {format_shutdown_stats(stats)}.")
+        self._release_pools()
         if self.thread(): self.thread().quit()
 
     def _cleanup_temp_files(self):
@@ -92,9 +118,14 @@ class DownloadWorker(QObject):
             self._safe_shutdown(); return
 
         if self._state == "planning":
-            if self._active_tasks.ready():
-                planned_tasks = self._active_tasks.get()
-                self._pool.close(); self._pool.join() # Pulisci il pool di pianificazione
+            if all(future.done() for future in self._active_tasks):
+                planned_tasks = [future.result() for future in self._active_tasks]
+                self._planning_executors = None # Gli executor restano caldi per la prossima esecuzione
+                self._profile_stack.close()
+                # Anche i controlli manuali aiutano a imparare le finestre di uscita
+                try: ReleaseScheduler(DEFAULT_RELEASE_SCHEDULE_PATH).record_plan_results(planned_tasks)
+                except Exception as e: self._signals.error.emit("Scheduler", f"Impossibile aggiornare lo storico uscite: {e}")
+                if self._leases: self._leases.claim_episodes(planned_tasks)
                 self._start_downloading(planned_tasks)
             return # Non fare altro mentre pianifichi
         
@@ -103,14 +134,19 @@ class DownloadWorker(QObject):
                 while True: # Legge tutti i messaggi accumulati dalla coda
                     msg = self._queue.get_nowait()
                     signal_type, *args = msg
-                    if signal_type == 'progress': self._signals.progress.emit(*args)
+                    if signal_type == 'progress': self._signals.progress.emit(args[0], self._with_eta(*args))
+                    elif signal_type == 'eta': self._eta.update(*args)
                     elif signal_type == 'error': self._signals.error.emit(*args)
                     elif signal_type == 'finished': self._signals.finished.emit(*args)
             except Empty: pass
+            self._signals.throughput.emit(self._eta.summary())
 
             if self._active_tasks.ready():
                 if self._timer: self._timer.stop()
-                if self._pool: self._pool.close(); self._pool.join()
+                self._process_registry.close()
+                if self._active_tasks.successful(): self._record_metrics(self._active_tasks.get())
+                self._finish_profile()
+                self._release_pools()
                 if self._is_running: self._signals.overall_status.emit("Processo completato.")
                 if self.thread(): self.thread().quit()
 
@@ -122,9 +158,18 @@ class DownloadWorker(QObject):
         
     def _start_planning(self):
         self._state = "planning"
+        self._run_started_at = time.time()
         self._signals.overall_status.emit("Pianificazione attività...")
-        self._pool = mp.Pool(processes=mp.cpu_count())
-        self._active_tasks = self._pool.map_async(plan_single_series, self._series_list)
+        self._planning_executors = self._pools.planning_executors()
+        if self._leases:
+            self._leases.start()
+            holder = self._leases.acquire_run_lock()
+            # La GUI è avviata a mano: non salta l'esecuzione, ma lascia all'altra il lavoro che ha già preso
+            if holder is not None:
+                self._signals.overall_status.emit(f"È in corso un'altra esecuzione ({describe_holder(holder)}): gli episodi già in lavorazione verranno saltati.")
+        if self._profile and self._profile["mode"] == PROFILE_SAMPLING:
+            self._profile_stack.enter_context(profile_section(self._profile, "plan")) # Campiona tutti i thread di pianificazione
+        self._active_tasks = self._planning_executors.submit_all(self._series_list, self._profile, self._leases)
         
         self._timer = QTimer()
         self._timer.timeout.connect(self._check_status)
@@ -133,43 +178,72 @@ class DownloadWorker(QObject):
     def _start_downloading(self, planned_tasks):
         self._state = "downloading"
         if not self._is_running:
+            self._release_pools()
             if self.thread(): self.thread().quit(); return
 
+        self._planned_tasks = planned_tasks
         to_process = [t for t in planned_tasks if t["action"] == "process"]
         for t in [t for t in planned_tasks if t["action"] == "skip"]:
             self._signals.task_skipped.emit(t['series']['name'], t['reason'])
             
         if not to_process:
+            self._record_metrics([])
+            self._finish_profile()
+            self._release_pools()
             self._signals.overall_status.emit("✅ Nessun nuovo episodio da scaricare."); self.thread().quit(); return
         
         self._signals.overall_status.emit(f"Avvio di {len(to_process)} download...")
         for task in to_process:
-            task["final_filename"] = self._construct_final_filename(task)
+            task["final_filename"] = construct_final_filename(task)
+            task["queued_at"] = time.time()
+            task["profile"] = self._profile
+            task["process_registry"] = self._process_registry.path
+            task["task_id"] = new_task_id()
+            task["encode_targets"] = self._encode_targets
         self._active_tasks_info = [{"name": t["series"]["name"], "path": t["series"]["path"], "final_filename": t["final_filename"]} for t in to_process]
+        self._eta = RunEta(EtaPriors.from_history(Path(self._log_file_path).parent / HISTORY_DB_NAME), workers=self._pools.processes)
+        for t in to_process:
+            self._eta.add_task(t["series"]["name"], download_host(t["download_url"]), encode_profile(self._encoder), self._convert_to_h265)
         
-        self._manager = mp.Manager()
-        self._queue = self._manager.Queue()
-        self._stop_event = self._manager.Event()
-        
+        # Orchestrazione: le chiamate di _check_status girano in questo thread fino alla fine dei download
+        self._profile_stack.enter_context(profile_section(self._profile, "orchestrate"))
+        self._pool, self._queue, self._stop_event = self._pools.acquire()
+        self._log_listener = LogListener(self._log_file_path, self._pools.log_queue).start()
+        for task in to_process: task["log_queue"] = self._log_listener.queue
+        if not self._is_running: self._stop_event.set() # Stop richiesto mentre il Pool si stava avviando
         queue_updater = QueueStatusUpdater(self._queue)
         
-        self._pool = mp.Pool(processes=mp.cpu_count())
-        pool_args = [(task, self._output_dir, self._log_file_path, queue_updater, self._stop_event, self._convert_to_h265) for task in to_process]
+        pool_args = [(task, self._output_dir, self._log_file_path, queue_updater, self._stop_event, self._convert_to_h265, self._encoder) for task in to_process]
         self._active_tasks = self._pool.starmap_async(process_series_task, pool_args)
         # Non chiudere il pool qui, aspetta che i task finiscano in _check_status
 
+    def _release_pools(self):
+        if self._leases: self._leases.stop()
+        if self._log_listener: self._log_listener.stop(); self._log_listener = None
+        self._pool = self._queue = self._stop_event = None
+        if self._owns_pools: self._pools.shutdown()
+
+    def _with_eta(self, name: str, message: str) -> str:
+        task_eta = self._eta.task_eta(name)
+        return f"{message} (ETA {format_duration(task_eta)})" if task_eta is not None else message
+
+    def _record_metrics(self, results):
+        try: MetricsSink(Path(self._log_file_path).parent, self._metrics_textfile_path, history_detail_days=self._history_detail_days).record_run(self._planned_tasks, results, self._run_started_at, mode="gui")
+        except Exception as e: self._signals.error.emit("Metriche", f"Impossibile salvare le metriche: {e}")
+
+    def _finish_profile(self):
+        self._profile_stack.close()
+        if not self._profile or not Path(self._profile["dir"]).exists(): return
+        try:
+            from anidownloader_core.profiling import write_report
+            self._signals.overall_status.emit(f"📊 Report di profilazione: {write_report(Path(self._profile['dir']))}")
+        except Exception as e:
+            self._signals.error.emit("Profilazione", f"Impossibile creare il report: {e}")
+        self._profile = None
+
     def _check_dependencies(self):
-        if not psutil: self._signals.error.emit("DEPENDENCIES", "Manca 'psutil'. Installalo con: pip install psutil"); return False
+        # psutil è facoltativo: senza, i controlli sui processi orfani e sui lease si basano solo sulle scadenze
+        if not psutil: self._signals.overall_status.emit("⚠️ 'psutil' non installato: controlli sui processi ridotti (pip install psutil).")
         missing = [dep for dep in ["aria2c", "ffmpeg"] if not shutil.which(dep)]
         if missing: self._signals.error.emit("DEPENDENCIES", f"Mancanti: {', '.join(missing)}"); return False
         self._signals.overall_status.emit("✅ Dipendenze trovate."); return True
-
-# --- MODIFICA CHIAVE ---
-# Aggiunto il metodo mancante per comunicare il successo
-class QueueStatusUpdater:
-    def __init__(self, queue): self._queue = queue
-    def update_progress(self, name: str, msg: str): self._queue.put(('progress', name, msg))
-    def report_error(self, name: str, err_msg: str): self._queue.put(('error', name, err_msg))
-    def report_finished(self, name: str, path: str, dl_time: float, conv_time: float):
-        self._queue.put(('finished', name, path, dl_time, conv_time))
-# --- FINE MODIFICA ---
\ No newline at end of file
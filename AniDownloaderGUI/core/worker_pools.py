@@ -0,0 +1,90 @@
+import sys
+import threading
+import multiprocessing as mp
+
+from anidownloader_core.planning_service import PlanningExecutors
+
+BOOTSTRAP_MODULE = "anidownloader_core.worker_bootstrap"
+
+
+def _worker_context():
+    # Con fork ogni worker erediterebbe l'intero processo PyQt6 (memoria, thread, stato di Qt).
+    # forkserver parte da un processo pulito che ha importato solo il modulo di avvio; dove non
+    # esiste (Windows, eseguibili PyInstaller) si usa spawn.
+    if "forkserver" in mp.get_all_start_methods() and not getattr(sys, "frozen", False):
+        ctx = mp.get_context("forkserver")
+        ctx.set_forkserver_preload([BOOTSTRAP_MODULE])
+        return ctx
+    return mp.get_context("spawn")
+
+
+class WorkerPools:
+    """
+    Risorse di esecuzione della GUI, create una volta e riusate tra un download e l'altro:
+    gli executor di pianificazione (thread, con le istanze degli scraper e le loro sessioni in cache)
+    e, per l'elaborazione, Manager, code (stato e log), evento di stop e Pool di processi.
+    warm_up() può girare in background all'avvio della finestra; acquire() attende che sia finito.
+    Dopo un'interruzione forzata il componente terminato viene scartato e ricreato alla prossima richiesta.
+    """
+    def __init__(self, processes: int = None):
+        self._ctx = _worker_context()
+        self._processes = processes or mp.cpu_count()
+        self._lock = threading.Lock()
+        self._planning = self._manager = self._queue = self._log_queue = self._stop_event = self._pool = None
+
+    @property
+    def processes(self) -> int:
+        return self._processes
+
+    def warm_up(self):
+        with self._lock:
+            if self._planning is None:
+                self._planning = PlanningExecutors()
+            if self._manager is None:
+                self._manager = self._ctx.Manager()
+                self._queue = self._manager.Queue()
+                self._log_queue = self._manager.Queue()
+                self._stop_event = self._manager.Event()
+            if self._pool is None:
+                self._pool = self._ctx.Pool(processes=self._processes)
+
+    def warm_up_in_background(self):
+        threading.Thread(target=self.warm_up, daemon=True, name="warm-pools").start()
+
+    def planning_executors(self) -> PlanningExecutors:
+        self.warm_up()
+        return self._planning
+
+    def acquire(self):
+        """Restituisce (pool, coda, evento di stop) pronti per una nuova esecuzione."""
+        self.warm_up()
+        self._stop_event.clear()
+        while not self._queue.empty(): # Messaggi rimasti da un'esecuzione interrotta
+            self._queue.get_nowait()
+        return self._pool, self._queue, self._stop_event
+
+    @property
+    def stop_event(self):
+        return self._stop_event
+
+    @property
+    def log_queue(self):
+        """Coda dei record di log dei worker, letta da un LogListener per esecuzione."""
+        return self._log_queue
+
+    def discard_planning(self):
+        with self._lock:
+            if self._planning is not None:
+                self._planning.shutdown(wait=False, cancel_futures=True); self._planning = None
+
+    def discard_pool(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate(); self._pool.join(); self._pool = None
+
+    def shutdown(self):
+        self.discard_planning()
+        self.discard_pool()
+        with self._lock:
+            if self._manager is not None:
+                self._manager.shutdown(); self._manager = self._queue = self._log_queue = self._stop_event = None
@@ -3,14 +3,18 @@ from pathlib import Path
 from PyQt6.QtWidgets import (
     QMainWindow, QVBoxLayout, QHBoxLayout, QWidget,
     QPushButton, QTableWidget, QHeaderView, QFileDialog, QLabel,
-    QLineEdit, QMessageBox, QTextEdit, QStyle, QMenuBar, QSplitter, QTableWidgetItem, QApplication, QCheckBox
+    QLineEdit, QMessageBox, QTextEdit, QStyle, QMenuBar, QSplitter, QTableWidgetItem, QApplication, QCheckBox, QComboBox
 )
 from PyQt6.QtCore import QThread, Qt, QSettings, QByteArray
 from PyQt6.QtGui import QIcon, QFont, QColor, QAction
 from core.download_worker import DownloadWorker
-from anidownloader_core.series_repository import SeriesRepository
+from core.worker_pools import WorkerPools
+from anidownloader_core.remote_encode import encode_targets
+from anidownloader_core.lease_store import LeaseStore
+from anidownloader_core.series_repository import create_series_repository
 from anidownloader_config.app_config_manager import AppConfigManager
-from anidownloader_config.defaults import DEFAULT_CONFIG_DIR, DEFAULT_SERIES_JSON_PATH
+from anidownloader_config.defaults import DEFAULT_CONFIG_DIR, DEFAULT_SERIES_JSON_PATH, DEFAULT_SERIES_DB_PATH, ensure_default_dirs, worker_processes
+from anidownloader_core.profiling import PROFILE_OFF, PROFILE_CPROFILE, PROFILE_SAMPLING
 from utils.image_loader import load_poster_image
 from .widgets import StatusTableWidgetItem, StopConfirmationDialog
 from .series_manager import SeriesManagerDialog
@@ -27,9 +31,11 @@ class AniDownloaderGUI(QMainWindow):
         
         self.setWindowIcon(QIcon('assets/logo.png'))
         
+        ensure_default_dirs()
         self.app_config_manager = AppConfigManager()
+        if self.app_config_manager.load_warning():
+            QMessageBox.warning(None, "File di Configurazione Corrotto", self.app_config_manager.load_warning())
         
-        DEFAULT_CONFIG_DIR.mkdir(parents=True, exist_ok=True)
         qsettings_path = str(DEFAULT_CONFIG_DIR / "AniDownloader.conf")
         self.settings = QSettings(qsettings_path, QSettings.Format.IniFormat)
 
@@ -37,16 +43,24 @@ class AniDownloaderGUI(QMainWindow):
         self.output_dir = Path(self.app_config_manager.get("output_dir"))
         self.log_file_path = Path(self.app_config_manager.get("log_file_path"))
         
-        self.series_repository = SeriesRepository(self.json_file_path)
+        self.series_repository = self._create_series_repository()
         self._check_series_file()
 
         self._download_thread, self._download_worker = None, None
+        # Pool di pianificazione ed elaborazione avviati ora in background e riusati a ogni download
+        self._worker_pools = WorkerPools(worker_processes(self.app_config_manager.get_all()))
+        self._worker_pools.warm_up_in_background()
         self._series_data = []
+        self._series_by_name = {}
+        self._name_items = {}
         self._init_ui()
         self._load_series_data_into_table()
         self.restore_geometry_and_state()
 
     def _check_series_file(self):
+        # Con il backend SQLite il JSON serve solo all'importazione iniziale: se manca non si tocca nulla,
+        # perché save_series_data([]) svuoterebbe il database delle serie
+        if self.app_config_manager.get("series_backend", "json") != "json": return
         is_json_path_customized = self.app_config_manager.get("is_json_path_customized", False)
         if not self.json_file_path.exists():
             if is_json_path_customized:
@@ -56,9 +70,14 @@ class AniDownloaderGUI(QMainWindow):
             self.json_file_path = DEFAULT_SERIES_JSON_PATH
             self.app_config_manager.set("json_file_path", str(self.json_file_path))
             self.app_config_manager.set("is_json_path_customized", False)
-            self.series_repository = SeriesRepository(self.json_file_path)
+            self.series_repository = self._create_series_repository()
             self.series_repository.save_series_data([])
 
+    def _create_series_repository(self):
+        backend = self.app_config_manager.get("series_backend", "json")
+        db_path = Path(self.app_config_manager.get("series_db_path", str(DEFAULT_SERIES_DB_PATH)))
+        return create_series_repository(self.json_file_path, backend=backend, db_path=db_path)
+
     def _init_ui(self):
         self._create_menu_bar()
         self._create_main_layout()
@@ -91,7 +110,13 @@ class AniDownloaderGUI(QMainWindow):
     def _create_conversion_toggle(self):
         self.convert_h265_checkbox = QCheckBox("Abilita Conversione H.265 (HEVC)"); self.convert_h265_checkbox.clicked.connect(self._save_conversion_setting)
         initial_state = self.app_config_manager.get("convert_to_h265", False); self.convert_h265_checkbox.setChecked(initial_state)
-        conversion_layout = QHBoxLayout(); conversion_layout.addStretch(1); conversion_layout.addWidget(self.convert_h265_checkbox); conversion_layout.addStretch(1)
+        # Profilazione: "Campionamento" ha un costo trascurabile, cProfile è più preciso ma rallenta
+        self.profile_mode_combo = QComboBox()
+        for label, mode in (("Profilazione: disattivata", PROFILE_OFF), ("Profilazione: cProfile", PROFILE_CPROFILE), ("Profilazione: campionamento", PROFILE_SAMPLING)):
+            self.profile_mode_combo.addItem(label, mode)
+        self.profile_mode_combo.setCurrentIndex(max(0, self.profile_mode_combo.findData(self.app_config_manager.get("profile_mode", PROFILE_OFF))))
+        self.profile_mode_combo.currentIndexChanged.connect(lambda: self.app_config_manager.set("profile_mode", self.profile_mode_combo.currentData()))
+        conversion_layout = QHBoxLayout(); conversion_layout.addStretch(1); conversion_layout.addWidget(self.convert_h265_checkbox); conversion_layout.addWidget(self.profile_mode_combo); conversion_layout.addStretch(1)
         self.top_layout.addLayout(conversion_layout); self.top_layout.addSpacing(10)
 
     def _save_conversion_setting(self):
@@ -148,6 +173,7 @@ class AniDownloaderGUI(QMainWindow):
     def closeEvent(self, event):
         self.settings.setValue("geometry", self.saveGeometry())
         self.settings.setValue("splitter_sizes", self.main_splitter.saveState())
+        self._worker_pools.shutdown()
         super().closeEvent(event)
 
     def _reset_stop_warning_setting(self):
@@ -162,7 +188,7 @@ class AniDownloaderGUI(QMainWindow):
         if selected_file:
             self.json_file_path = Path(selected_file); self.json_path_input.setText(selected_file)
             self.app_config_manager.set("json_file_path", selected_file); self.app_config_manager.set("is_json_path_customized", True)
-            self.series_repository = SeriesRepository(self.json_file_path); self._load_series_data_into_table()
+            self.series_repository = self._create_series_repository(); self._load_series_data_into_table()
 
     def _browse_output_dir(self):
         selected_dir = QFileDialog.getExistingDirectory(self, "Seleziona Cartella Output", str(self.output_dir))
@@ -172,15 +198,18 @@ class AniDownloaderGUI(QMainWindow):
     def _load_series_data_into_table(self):
         try: self._series_data = self.series_repository.load_series_data()
         except Exception as e: QMessageBox.critical(self, "Errore Caricamento Serie", f"Impossibile caricare: {e}"); self._series_data = []
+        self._series_by_name = {s.get("name"): s for s in self._series_data}
         self._populate_table_main_gui(self._series_data)
         # Il reset dell'ordinamento è gestito da _reset_table_sort
 
     def _populate_table_main_gui(self, data_to_display):
         self.table_widget.setSortingEnabled(False) # Disabilita l'ordinamento durante il popolamento
         self.table_widget.setRowCount(0); self.table_widget.setRowCount(len(data_to_display))
+        self._name_items = {}
         for row, series in enumerate(data_to_display):
             name_item = QTableWidgetItem(series["name"]); status_item = StatusTableWidgetItem("In attesa", 3)
             self.table_widget.setItem(row, 0, name_item); self.table_widget.setItem(row, 1, status_item)
+            self._name_items[series["name"]] = name_item # L'item segue la riga anche dopo un ordinamento
         if data_to_display: self.table_widget.selectRow(0)
         else: self._on_series_selected()
         self.table_widget.setSortingEnabled(True)
@@ -197,7 +226,7 @@ class AniDownloaderGUI(QMainWindow):
         if row == -1: return
         item = self.table_widget.item(row, 0)
         if not item: return
-        series = next((s for s in self._series_data if s.get("name") == item.text()), None)
+        series = self._series_by_name.get(item.text())
         if series and series.get("path"): load_poster_image(self.image_label, series.get("path"))
         else: self.image_label.clear(); self.image_label.setText("Percorso non definito")
 
@@ -217,7 +246,14 @@ class AniDownloaderGUI(QMainWindow):
             json_file_path=self.json_file_path, 
             log_file_path=self.log_file_path, 
             output_dir=self.output_dir, 
-            convert_to_h265=convert_to_h265
+            convert_to_h265=convert_to_h265,
+            encoder=self.app_config_manager.get("encoder"),
+            profile_mode=self.profile_mode_combo.currentData(),
+            pools=self._worker_pools,
+            encode_targets=encode_targets(self.app_config_manager.get_all()),
+            leases=LeaseStore.from_config(self.app_config_manager.get_all(), kind="gui"),
+            metrics_textfile_path=self.app_config_manager.get("metrics_textfile_path"),
+            history_detail_days=self.app_config_manager.get("history_detail_days")
         )
         self._download_worker.moveToThread(self._download_thread)
 
@@ -228,6 +264,7 @@ class AniDownloaderGUI(QMainWindow):
         self._download_worker._signals.task_skipped.connect(self._handle_task_skipped)
         self._download_worker._signals.overall_status.connect(self.overall_status_label.setText)
         self._download_worker._signals.overall_status.connect(self.log_output.append)
+        self._download_worker._signals.throughput.connect(self.statusBar().showMessage)
         self._download_thread.finished.connect(self._on_download_finished)
         
         self.table_widget.sortByColumn(1, Qt.SortOrder.AscendingOrder)
@@ -259,24 +296,25 @@ class AniDownloaderGUI(QMainWindow):
         elif "errore" in status_lower: new_priority, color = 1, QColor("#F8D7DA")
         elif "interrotto" in status_lower: new_priority, color = 1, QColor("#F8D7DA")
         
-        for row in range(self.table_widget.rowCount()):
-            if self.table_widget.item(row, 0).text() == series_name:
-                # Controlla la priorità attuale prima di aggiornare
-                current_item = self.table_widget.item(row, 1)
-                old_priority = -1 # Valore di default se l'item non esiste o non ha priorità
-                if isinstance(current_item, StatusTableWidgetItem):
-                    old_priority = current_item.priority
-
-                # Aggiorna la riga
-                status_item = StatusTableWidgetItem(status_message, new_priority)
-                self.table_widget.setItem(row, 1, status_item)
-                for col in range(self.table_widget.columnCount()):
-                    self.table_widget.item(row, col).setBackground(color)
-                
-                # Se la priorità è cambiata, scatena un ri-ordinamento
-                if old_priority != new_priority:
-                    self.table_widget.sortItems(1, Qt.SortOrder.AscendingOrder)
-                break
+        name_item = self._name_items.get(series_name)
+        if name_item is None: return
+        row = name_item.row()
+
+        # Controlla la priorità attuale prima di aggiornare
+        current_item = self.table_widget.item(row, 1)
+        old_priority = -1 # Valore di default se l'item non esiste o non ha priorità
+        if isinstance(current_item, StatusTableWidgetItem):
+            old_priority = current_item.priority
+
+        # Aggiorna la riga
+        status_item = StatusTableWidgetItem(status_message, new_priority)
+        self.table_widget.setItem(row, 1, status_item)
+        for col in range(self.table_widget.columnCount()):
+            self.table_widget.item(row, col).setBackground(color)
+        
+        # Se la priorità è cambiata, scatena un ri-ordinamento
+        if old_priority != new_priority:
+            self.table_widget.sortItems(1, Qt.SortOrder.AscendingOrder)
         
     def _handle_worker_error(self, series_name, error_message):
         if series_name in ["GLOBAL", "DEPENDENCIES", "CONFIG"]:
@@ -309,10 +347,12 @@ class AniDownloaderGUI(QMainWindow):
         self.json_browse_button.setEnabled(not in_progress)
         self.output_browse_button.setEnabled(not in_progress)
         self.convert_h265_checkbox.setEnabled(not in_progress)
+        self.profile_mode_combo.setEnabled(not in_progress)
         self.reset_sort_button.setEnabled(not in_progress)
 
     def _on_download_finished(self):
         self._set_ui_state_for_download(False)
+        self.statusBar().clearMessage()
         if "Interruzione" not in self.overall_status_label.text():
              self.overall_status_label.setText("Processo completato.")
         if self._download_thread:
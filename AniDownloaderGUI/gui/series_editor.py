@@ -90,6 +90,13 @@ class SeriesEditorDialog(QDialog):
         form_layout.addRow("Continua numerazione:", continue_layout)
         form_layout.addRow("Episodi Passati:", self._passed_episodes_input)
 
+        self._completed_checkbox = QCheckBox()
+        self._completed_checkbox.setToolTip("Le serie concluse vengono controllate sempre più raramente.")
+        completed_layout = QHBoxLayout()
+        completed_layout.addWidget(self._completed_checkbox)
+        completed_layout.addStretch()
+        form_layout.addRow("Serie conclusa:", completed_layout)
+
         main_layout.addWidget(form_widget)
         main_layout.addStretch()
 
@@ -113,6 +120,7 @@ class SeriesEditorDialog(QDialog):
         self._filename_root_input.setText(self._series_data.get("filename_root", ""))
         self._continue_checkbox.setChecked(self._series_data.get("continue", False))
         self._passed_episodes_input.setValue(self._series_data.get("passed_episodes", 0))
+        self._completed_checkbox.setChecked(self._series_data.get("completed", False))
         
         service = self._series_data.get("service")
         if service == "animeW_scraper": self._rb_animeW.setChecked(True)
@@ -163,6 +171,10 @@ class SeriesEditorDialog(QDialog):
             else:
                 self._result_data["continue"] = False
                 self._result_data["passed_episodes"] = 0
+
+            if self._completed_checkbox.isChecked(): self._result_data["completed"] = True
+            # Le fonti alternative si modificano nel JSON: il dialogo le conserva così come sono
+            if self._series_data.get("sources"): self._result_data["sources"] = self._series_data["sources"]
             
             super().accept()
 
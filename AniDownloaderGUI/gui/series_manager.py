@@ -1,13 +1,17 @@
 import os
 import platform
 from PyQt6.QtWidgets import (
-    QDialog, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem,
+    QDialog, QVBoxLayout, QHBoxLayout, QTableView, QAbstractItemView,
     QHeaderView, QLabel, QLineEdit, QPushButton, QMessageBox, QApplication
 )
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QTimer
 from anidownloader_core.series_repository import SeriesRepository
 from utils.image_loader import load_poster_image
 from .series_editor import SeriesEditorDialog
+from .series_table_model import SeriesTableModel, SeriesFilterProxyModel
+
+# Attesa dopo l'ultimo tasto prima di applicare il filtro di ricerca
+SEARCH_DEBOUNCE_MS = 200
 
 class SeriesManagerDialog(QDialog):
     def __init__(self, series_repository: SeriesRepository, parent=None):
@@ -22,16 +26,33 @@ class SeriesManagerDialog(QDialog):
         self.setMinimumSize(700, 500)
         
         self._series_repository = series_repository
-        self._series_data = []
+        self._series_model = SeriesTableModel(parent=self)
+        self._proxy_model = SeriesFilterProxyModel(self)
+        self._proxy_model.setSourceModel(self._series_model)
         self._original_series_data = []
+        self._displayed_poster_path = None
         self._init_ui()
         self._load_series_data()
 
-    def _save_current_series_data(self):
+    def _save_current_series_data(self, changed_series=None, previous_name=None, removed_name=None):
+        """
+        Salva le modifiche. Se il repository supporta scritture per singola serie (backend SQLite)
+        viene scritta solo la riga cambiata, altrimenti l'intera lista come in passato.
+        Se il salvataggio viene rifiutato la tabella torna all'ultimo stato salvato.
+        """
         try:
-            self._series_repository.save_series_data(self._series_data)
-            self._original_series_data = [s.copy() for s in self._series_data]
+            if hasattr(self._series_repository, 'upsert_series') and (changed_series or removed_name):
+                if removed_name is not None:
+                    self._series_repository.delete_series(removed_name)
+                if changed_series:
+                    self._series_repository.upsert_series(changed_series, previous_name=previous_name)
+            else:
+                self._series_repository.save_series_data(self._series_model.series_data())
+            self._original_series_data = [s.copy() for s in self._series_model.series_data()]
         except Exception as e:
+            self._series_model.set_series_data([s.copy() for s in self._original_series_data])
+            self._displayed_poster_path = None
+            self._ensure_selection()
             QMessageBox.critical(self, "Errore Salvataggio Automatico", f"Impossibile salvare le modifiche automaticamente: {e}")
 
     def _init_ui(self):
@@ -42,28 +63,24 @@ class SeriesManagerDialog(QDialog):
 
     def _create_series_display_section(self):
         series_display_layout = QHBoxLayout()
-        self._table_widget = QTableWidget()
-        
-        self._table_widget.setColumnCount(5)
-        self._table_widget.setHorizontalHeaderLabels([
-            "Nome", "Percorso", "URL Pagina Serie",
-            "Continua", "Ep. Passati"
-        ])
+        self._table_view = QTableView()
+        self._table_view.setModel(self._proxy_model)
+        self._table_view.verticalHeader().setVisible(False)
         
-        header = self._table_widget.horizontalHeader()
+        header = self._table_view.horizontalHeader()
         header.setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch) # Nome
         header.setSectionResizeMode(1, QHeaderView.ResizeMode.Stretch) # Percorso
         header.setSectionResizeMode(2, QHeaderView.ResizeMode.Stretch) # URL Pagina Serie
         header.setSectionResizeMode(3, QHeaderView.ResizeMode.ResizeToContents) # Continua
         header.setSectionResizeMode(4, QHeaderView.ResizeMode.ResizeToContents) # Ep. Passati
     
-        self._table_widget.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
-        self._table_widget.setSelectionMode(QTableWidget.SelectionMode.SingleSelection)
-        self._table_widget.setSortingEnabled(True)
-        self._table_widget.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
-        self._table_widget.itemSelectionChanged.connect(self._on_series_selected)
-        self._table_widget.doubleClicked.connect(self._open_series_editor)
-        series_display_layout.addWidget(self._table_widget)
+        self._table_view.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self._table_view.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self._table_view.setSortingEnabled(True)
+        self._table_view.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self._table_view.selectionModel().selectionChanged.connect(self._on_series_selected)
+        self._table_view.doubleClicked.connect(self._open_series_editor)
+        series_display_layout.addWidget(self._table_view)
         
         self._image_label = QLabel("Seleziona una serie per vedere la locandina")
         self._image_label.setFixedSize(200, 300)
@@ -76,8 +93,12 @@ class SeriesManagerDialog(QDialog):
         control_layout = QHBoxLayout()
         control_layout.addWidget(QLabel("Cerca:"))
         self._search_input = QLineEdit()
-        self._search_input.setPlaceholderText("Cerca per nome...")
-        self._search_input.textChanged.connect(self._filter_series)
+        self._search_input.setPlaceholderText("Cerca per nome, percorso o URL...")
+        self._search_timer = QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self._search_timer.timeout.connect(self._filter_series)
+        self._search_input.textChanged.connect(self._search_timer.start)
         control_layout.addWidget(self._search_input)
         control_layout.addStretch(1)
         
@@ -110,68 +131,54 @@ class SeriesManagerDialog(QDialog):
         self.main_layout.addLayout(button_layout)
 
     def _reset_table_sort(self):
-        self._table_widget.setSortingEnabled(False)
-        self._filter_series()
-        self._table_widget.setSortingEnabled(True)
+        # Colonna -1: il proxy torna all'ordine originale del modello
+        self._table_view.horizontalHeader().setSortIndicator(-1, Qt.SortOrder.AscendingOrder)
+        self._proxy_model.sort(-1)
+
+    def _selected_source_row(self) -> int:
+        selected_rows = self._table_view.selectionModel().selectedRows()
+        if not selected_rows:
+            return -1
+        return self._proxy_model.mapToSource(selected_rows[0]).row()
 
-    def _on_series_selected(self):
-        selected_items = self._table_widget.selectedItems()
-        if not selected_items:
+    def _on_series_selected(self, *args):
+        row = self._selected_source_row()
+        if row == -1:
+            self._displayed_poster_path = None
             self._image_label.clear()
             self._image_label.setText("Nessuna serie selezionata")
             return
-            
-        row = self._table_widget.currentRow()
-        if row == -1: return
 
-        series_name_item = self._table_widget.item(row, 0)
-        if not series_name_item: return
+        series_path = self._series_model.series_at(row).get("path")
+        if series_path == self._displayed_poster_path:
+            return # Locandina già visualizzata, evita di ricaricarla dal disco
+        self._displayed_poster_path = series_path
 
-        series_name = series_name_item.text()
-        series = next((s for s in self._series_data if s.get("name") == series_name), None)
-
-        if series and series.get("path"):
-            load_poster_image(self._image_label, series.get("path"))
+        if series_path:
+            load_poster_image(self._image_label, series_path)
         else:
             self._image_label.clear()
             self._image_label.setText("Percorso non definito")
 
     def _load_series_data(self):
         try:
-            self._series_data = self._series_repository.load_series_data()
-            self._original_series_data = [s.copy() for s in self._series_data]
+            series_data = self._series_repository.load_series_data()
+            self._original_series_data = [s.copy() for s in series_data]
+            self._series_model.set_series_data(series_data)
             self._filter_series()
         except Exception as e:
             QMessageBox.critical(self, "Errore Caricamento", f"Impossibile caricare: {e}")
 
     def _filter_series(self):
-        search_text = self._search_input.text().lower()
-        filtered_data = [s for s in self._series_data if search_text in s.get("name", "").lower()]
-        self._populate_table(filtered_data)
-
-    def _populate_table(self, data):
-        self._table_widget.blockSignals(True)
-        self._table_widget.setRowCount(0)
-        self._table_widget.setRowCount(len(data))
-        for row, series in enumerate(data):
-            name_item = QTableWidgetItem(series.get("name", ""))
-            path_item = QTableWidgetItem(series.get("path", ""))
-            series_page_url_item = QTableWidgetItem(series.get("series_page_url", ""))
-            continue_item = QTableWidgetItem("Sì" if series.get("continue", False) else "No")
-            passed_episodes_item = QTableWidgetItem(str(series.get("passed_episodes", 0)))
-
-            continue_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-            passed_episodes_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-
-            self._table_widget.setItem(row, 0, name_item)
-            self._table_widget.setItem(row, 1, path_item)
-            self._table_widget.setItem(row, 2, series_page_url_item)
-            self._table_widget.setItem(row, 3, continue_item)
-            self._table_widget.setItem(row, 4, passed_episodes_item)
-        
-        self._table_widget.blockSignals(False)
-        if data:
-            self._table_widget.selectRow(0)
+        self._search_timer.stop()
+        self._proxy_model.set_query(self._search_input.text())
+        self._ensure_selection()
+
+    def _ensure_selection(self):
+        if self._table_view.selectionModel().hasSelection():
+            return
+        if self._proxy_model.rowCount() > 0:
+            self._table_view.selectRow(0)
         else:
             self._on_series_selected()
 
@@ -180,46 +187,44 @@ class SeriesManagerDialog(QDialog):
         if editor.exec():
             is_deleted, new_data = editor.get_data()
             if not is_deleted and new_data:
-                self._series_data.append(new_data)
-                self._filter_series()
-                self._save_current_series_data()
+                self._series_model.append_series(new_data)
+                self._ensure_selection()
+                self._save_current_series_data(changed_series=new_data)
 
-    def _open_series_editor(self):
-        selected_rows = self._table_widget.selectionModel().selectedRows()
-        if not selected_rows:
+    def _open_series_editor(self, *args):
+        row = self._selected_source_row()
+        if row == -1:
             QMessageBox.warning(self, "Nessuna Selezione", "Seleziona una serie da modificare."); return
         
-        selected_name = self._table_widget.item(selected_rows[0].row(), 0).text()
-        series_to_edit = next((s for s in self._series_data if s.get("name") == selected_name), None)
-        
-        if series_to_edit:
-            editor = SeriesEditorDialog(series_to_edit, is_new=False, parent=self)
-            if editor.exec():
-                is_deleted, modified_data = editor.get_data()
-                original_index = next((i for i, s in enumerate(self._series_data) if s["name"] == selected_name), -1)
-                if original_index == -1: return
-
-                if is_deleted:
-                    self._series_data.pop(original_index)
-                elif modified_data:
-                    self._series_data[original_index] = modified_data
-                self._filter_series()
-                self._save_current_series_data()
+        series_to_edit = self._series_model.series_at(row)
+        editor = SeriesEditorDialog(series_to_edit, is_new=False, parent=self)
+        if editor.exec():
+            is_deleted, modified_data = editor.get_data()
+            previous_name = series_to_edit.get("name")
+            if is_deleted:
+                self._series_model.remove_series(row)
+                self._ensure_selection()
+                self._save_current_series_data(removed_name=previous_name)
+            elif modified_data:
+                self._series_model.replace_series(row, modified_data)
+                self._displayed_poster_path = None
+                self._on_series_selected()
+                self._save_current_series_data(changed_series=modified_data, previous_name=previous_name)
 
     def _remove_selected_series(self):
-        selected_rows = self._table_widget.selectionModel().selectedRows()
-        if not selected_rows:
+        row = self._selected_source_row()
+        if row == -1:
             QMessageBox.warning(self, "Nessuna Selezione", "Seleziona una serie da rimuovere."); return
         
-        selected_name = self._table_widget.item(selected_rows[0].row(), 0).text()
+        selected_name = self._series_model.series_at(row).get("name", "")
         reply = QMessageBox.question(self, "Conferma Eliminazione", f"Sei sicuro di voler rimuovere '{selected_name}' dalla lista?",
                                      QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No)
         if reply == QMessageBox.StandardButton.Yes:
-            self._series_data = [s for s in self._series_data if s.get("name") != selected_name]
-            self._filter_series()
-            self._save_current_series_data()
+            self._series_model.remove_series(row)
+            self._ensure_selection()
+            self._save_current_series_data(removed_name=selected_name)
 
     def reject(self):
         # Sovrascrivi reject per ripristinare i dati originali in caso di annullamento
-        self._series_data = self._original_series_data
-        super().reject()
\ No newline at end of file
+        self._series_model.set_series_data(self._original_series_data)
+        super().reject()
@@ -0,0 +1,140 @@
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex, QSortFilterProxyModel
+
+class SeriesTableModel(QAbstractTableModel):
+    """
+    Modello Qt per la lista delle serie mostrata in SeriesManagerDialog.
+    Mantiene per ogni riga una chiave di ricerca precalcolata (nome, percorso e URL in minuscolo),
+    così il filtro non deve ricostruire stringhe a ogni tasto premuto.
+    """
+    HEADERS = ["Nome", "Percorso", "URL Pagina Serie", "Continua", "Ep. Passati"]
+
+    def __init__(self, series_data=None, parent=None):
+        super().__init__(parent)
+        self._series_data = []
+        self._search_keys = []
+        if series_data:
+            self.set_series_data(series_data)
+
+    @staticmethod
+    def _build_search_key(series: dict) -> str:
+        return "\n".join((
+            series.get("name", ""),
+            series.get("path", ""),
+            series.get("series_page_url", "")
+        )).lower()
+
+    def set_series_data(self, series_data: list):
+        self.beginResetModel()
+        self._series_data = list(series_data)
+        self._search_keys = [self._build_search_key(s) for s in self._series_data]
+        self.endResetModel()
+
+    def series_data(self) -> list:
+        return self._series_data
+
+    def series_at(self, row: int) -> dict:
+        return self._series_data[row]
+
+    def search_key(self, row: int) -> str:
+        return self._search_keys[row]
+
+    def append_series(self, series: dict):
+        row = len(self._series_data)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._series_data.append(series)
+        self._search_keys.append(self._build_search_key(series))
+        self.endInsertRows()
+
+    def replace_series(self, row: int, series: dict):
+        self._series_data[row] = series
+        self._search_keys[row] = self._build_search_key(series)
+        self.dataChanged.emit(self.index(row, 0), self.index(row, self.columnCount() - 1))
+
+    def remove_series(self, row: int):
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self._series_data[row]
+        del self._search_keys[row]
+        self.endRemoveRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._series_data)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        series = self._series_data[index.row()]
+        column = index.column()
+
+        if role == Qt.ItemDataRole.DisplayRole:
+            if column == 0: return series.get("name", "")
+            if column == 1: return series.get("path", "")
+            if column == 2: return series.get("series_page_url", "")
+            if column == 3: return "Sì" if series.get("continue", False) else "No"
+            if column == 4: return str(series.get("passed_episodes", 0))
+        elif role == Qt.ItemDataRole.UserRole:
+            # Valori grezzi usati per l'ordinamento (es. episodi numerici e non alfabetici)
+            if column == 3: return int(bool(series.get("continue", False)))
+            if column == 4: return int(series.get("passed_episodes", 0))
+            return self.data(index, Qt.ItemDataRole.DisplayRole).lower()
+        elif role == Qt.ItemDataRole.TextAlignmentRole and column in (3, 4):
+            return Qt.AlignmentFlag.AlignCenter
+        return None
+
+
+class SeriesFilterProxyModel(QSortFilterProxyModel):
+    """
+    Proxy di filtro/ordinamento per SeriesTableModel.
+    Il filtro cerca la stringa in nome, percorso e URL. Se la nuova ricerca estende la precedente
+    (es. "dan" -> "dand") vengono ricontrollate solo le righe già corrispondenti.
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._query = ""
+        self._matching_rows = None
+        self.setSortRole(Qt.ItemDataRole.UserRole)
+
+    def setSourceModel(self, source_model):
+        super().setSourceModel(source_model)
+        # Gli indici di riga cambiano con inserimenti/rimozioni: ricalcola il risultato da zero
+        for signal in (source_model.modelReset, source_model.rowsInserted, source_model.rowsRemoved, source_model.dataChanged):
+            signal.connect(self._rebuild_matches)
+
+    def query(self) -> str:
+        return self._query
+
+    def set_query(self, text: str):
+        query = text.strip().lower()
+        if query == self._query:
+            return
+
+        if self._matching_rows is not None and self._query and query.startswith(self._query):
+            candidate_rows = self._matching_rows
+        else:
+            candidate_rows = range(self.sourceModel().rowCount())
+
+        self._query = query
+        self._matching_rows = self._match_rows(candidate_rows)
+        self.invalidateFilter()
+
+    def _match_rows(self, candidate_rows):
+        if not self._query:
+            return None
+        source_model = self.sourceModel()
+        return {row for row in candidate_rows if self._query in source_model.search_key(row)}
+
+    def _rebuild_matches(self, *args):
+        if not self._query:
+            return
+        self._matching_rows = self._match_rows(range(self.sourceModel().rowCount()))
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        return self._matching_rows is None or source_row in self._matching_rows
@@ -4,15 +4,21 @@ from pathlib import Path
 project_root = Path(__file__).parent.parent
 sys.path.append(str(project_root))
 
-from PyQt6.QtWidgets import QApplication
-from PyQt6.QtCore import Qt
-from gui.main_window import AniDownloaderGUI
+# Con forkserver/spawn questo file viene rieseguito come __mp_main__ nei processi di supporto:
+# PyQt6 e la GUI vanno importati solo nel processo principale.
+
+def main():
+    from PyQt6.QtWidgets import QApplication
+    from PyQt6.QtCore import Qt
+    from gui.main_window import AniDownloaderGUI
 
-if __name__ == '__main__':
-    mp.freeze_support() # Aggiunta la chiamata a freeze_support()
     QApplication.setHighDpiScaleFactorRoundingPolicy(Qt.HighDpiScaleFactorRoundingPolicy.PassThrough)
     app = QApplication(sys.argv)
     app.setStyle("Fusion")
     window = AniDownloaderGUI()
     window.show()
     sys.exit(app.exec())
+
+if __name__ == '__main__':
+    mp.freeze_support() # Aggiunta la chiamata a freeze_support()
+    main()
@@ -1,23 +1,40 @@
+import os
 import json
 from pathlib import Path
-from PyQt6.QtWidgets import QMessageBox
-from anidownloader_config.defaults import DEFAULT_APP_CONFIG_PATH, DEFAULT_SERIES_JSON_PATH, DEFAULT_OUTPUT_DIR, DEFAULT_LOG_FILE
+from anidownloader_config.defaults import DEFAULT_APP_CONFIG_PATH, DEFAULT_SERIES_JSON_PATH, DEFAULT_OUTPUT_DIR, DEFAULT_LOG_FILE, DEFAULT_SERIES_DB_PATH, DEFAULT_ENCODER_SETTINGS
 
 class AppConfigManager:
-    def __init__(self, config_path: Path = DEFAULT_APP_CONFIG_PATH):
+    def __init__(self, config_path: Path = DEFAULT_APP_CONFIG_PATH, read_only: bool = False):
+        # read_only: solo lettura (demone), il file non viene mai creato né riscritto;
+        # un file illeggibile solleva json.JSONDecodeError invece di essere sostituito dai default
         self._config_path = config_path
+        self._read_only = read_only
+        self._load_warning = None
         self._config = self._load_config()
 
     def _load_config(self) -> dict:
         """Carica la configurazione dell'applicazione dal file o crea un default."""
-        self._config_path.parent.mkdir(parents=True, exist_ok=True) # Assicura che la directory esista
+        if not self._read_only: self._config_path.parent.mkdir(parents=True, exist_ok=True) # Assicura che la directory esista
 
         default_config = {
             "json_file_path": str(DEFAULT_SERIES_JSON_PATH),
             "output_dir": str(DEFAULT_OUTPUT_DIR),
             "log_file_path": str(DEFAULT_LOG_FILE),
             "is_json_path_customized": False,
-            "convert_to_h265": True # Default value for the new setting
+            "convert_to_h265": True, # Default value for the new setting
+            "series_backend": "json", # "json" oppure "sqlite"
+            "series_db_path": str(DEFAULT_SERIES_DB_PATH),
+            "daemon_interval_minutes": 15, # Intervallo tra i controlli in modalità 'daemon'
+            "adaptive_schedule": True, # Controlla ogni serie in base alla sua finestra di uscita appresa
+            "metrics_textfile_path": "", # File per il textfile collector di node_exporter (vuoto: cartella dei log)
+            "encoder": dict(DEFAULT_ENCODER_SETTINGS), # crf, preset e threads di libx265
+            "worker_processes": 0, # Episodi elaborati in parallelo (0: numero di CPU), vedi bench_encode.py
+            "profile_mode": "off", # "off", "cprofile" o "sampling" (vedi anidownloader_core/profiling.py)
+            "history_detail_days": 90, # Giorni di dettaglio per episodio nello storico, poi riassunto per giorno
+            "remote_encoders": [], # Agenti di conversione remota: [{"url", "mode": "stream"|"path", "path_map", "token"}]
+            "local_encode_slots": 0, # Conversioni locali contemporanee considerate nel bilanciamento (0: automatico)
+            "lease_dir": "", # Cartella condivisa tra più macchine per spartirsi le serie (vuoto: solo questa macchina)
+            "lease_ttl_seconds": 120 # Dopo questo tempo senza rinnovo i lease di un nodo possono essere ripresi
         }
 
         if self._config_path.exists():
@@ -30,19 +47,26 @@ class AppConfigManager:
                         config[key] = value
                 return config
             except json.JSONDecodeError:
-                QMessageBox.warning(None, "File di Configurazione Corrotto",
-                                    f"Il file di configurazione '{self._config_path}' è corrotto o vuoto. Verrà ricreato con le impostazioni di default.")
+                if self._read_only: raise
+                # Nessuna dipendenza da Qt qui: la GUI mostra l'avviso tramite load_warning()
+                self._load_warning = f"Il file di configurazione '{self._config_path}' è corrotto o vuoto. Verrà ricreato con le impostazioni di default."
                 self._save_config(default_config)
                 return default_config
         else:
-            self._save_config(default_config)
+            if not self._read_only: self._save_config(default_config)
             return default_config
 
     def _save_config(self, config_data: dict):
-        """Salva la configurazione dell'applicazione nel file."""
+        """Salva la configurazione dell'applicazione nel file (in modo atomico: chi legge non vede mai un file a metà)."""
         self._config_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(self._config_path, 'w', encoding='utf-8') as f:
+        tmp = self._config_path.with_name(f".{self._config_path.name}.{os.getpid()}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
             json.dump(config_data, f, indent=4, ensure_ascii=False)
+        os.replace(tmp, self._config_path)
+
+    def load_warning(self):
+        """Restituisce l'eventuale avviso generato durante il caricamento (es. file corrotto), altrimenti None."""
+        return self._load_warning
 
     def get(self, key: str, default=None):
         """Restituisce un valore dalla configurazione."""
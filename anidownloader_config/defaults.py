@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 from platformdirs import user_videos_dir, user_config_dir, user_log_dir
 
@@ -22,11 +23,35 @@ DEFAULT_LOG_FILE = Path(user_log_dir(appname=APP_NAME)) / 'serie_critical_errors
 DEFAULT_SERIES_JSON_PATH = DEFAULT_CONFIG_DIR / "series_data.json"
 DEFAULT_APP_CONFIG_PATH = DEFAULT_CONFIG_DIR / "config.json"
 
+# Database SQLite usato quando "series_backend" è impostato a "sqlite"
+DEFAULT_SERIES_DB_PATH = DEFAULT_CONFIG_DIR / "series_data.db"
 
-# --- Verifica e Creazione delle Directory (Opzionale ma consigliato) ---
-# È buona norma assicurarsi che le directory esistano prima di usarle.
-DEFAULT_CONFIG_DIR.mkdir(parents=True, exist_ok=True)
-DEFAULT_LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
+# Storico delle uscite usato dalla pianificazione adattiva dei controlli
+DEFAULT_RELEASE_SCHEDULE_PATH = DEFAULT_CONFIG_DIR / "release_schedule.json"
+
+# Lease delle esecuzioni su questa macchina (GUI, CLI del timer, demone), se "lease_dir" non è impostato
+DEFAULT_LEASE_DIR = DEFAULT_LOG_FILE.parent / "leases"
+
+
+# Impostazioni di libx265 usate dalla conversione H.265 (chiave "encoder" di config.json).
+# anidownloader_utils/bench_encode.py misura le alternative e può scrivere quella consigliata.
+DEFAULT_ENCODER_SETTINGS = {"crf": 23, "preset": "veryfast", "threads": 12}
+
+def worker_processes(config: dict) -> int:
+    """
+    Processi del Pool di elaborazione (download e conversione), dalla chiave "worker_processes" di config.json:
+    0 o assente vale il numero di CPU. bench_encode.py --write-config vi scrive la concorrenza consigliata.
+    """
+    return int((config or {}).get("worker_processes") or 0) or os.cpu_count() or 1
+
+
+# --- Verifica e Creazione delle Directory ---
+# Non vengono create all'import: questo modulo è caricato anche dalla CLI avviata dal timer
+# e deve restare privo di effetti collaterali. Gli entry point chiamano ensure_default_dirs().
+def ensure_default_dirs():
+    """Crea le directory di configurazione e di log, se mancanti."""
+    DEFAULT_CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+    DEFAULT_LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
 
 
 # Esempio di come stampare i percorsi generati
@@ -35,4 +60,5 @@ if __name__ == "__main__":
     print(f"Directory di Configurazione: {DEFAULT_CONFIG_DIR}")
     print(f"File di Log: {DEFAULT_LOG_FILE}")
     print(f"Percorso JSON Serie: {DEFAULT_SERIES_JSON_PATH}")
-    print(f"Percorso Config App: {DEFAULT_APP_CONFIG_PATH}")
\ No newline at end of file
+    print(f"Percorso Config App: {DEFAULT_APP_CONFIG_PATH}")
+    print(f"Percorso Database Serie: {DEFAULT_SERIES_DB_PATH}")
\ No newline at end of file
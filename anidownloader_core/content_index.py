@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import hashlib
+from pathlib import Path
+
+INDEX_FILE_NAME = ".anidownloader_index.json"
+# Blocchi letti all'inizio e alla fine del file per l'impronta rapida
+BLOCK_SIZE = 1024 * 1024
+PROBE_TIMEOUT = 10
+_VIDEO_SUFFIXES = ('.mp4', '.mkv')
+_HASH_CHUNK = 4 * 1024 * 1024
+# Dopo questo tempo un episodio saltato come duplicato viene ricontrollato: il mirror può aver caricato il file giusto
+DUPLICATE_RECHECK_SECONDS = 7 * 24 * 60 * 60
+
+
+def fingerprint(size: int, head: bytes, tail: bytes) -> str:
+    """Impronta rapida: dimensione + SHA-256 del primo e dell'ultimo blocco."""
+    return f"{size}:{hashlib.sha256(head + tail).hexdigest()[:32]}"
+
+def file_fingerprint(path: Path) -> str:
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        head = f.read(BLOCK_SIZE)
+        f.seek(max(0, size - BLOCK_SIZE))
+        tail = f.read(BLOCK_SIZE) if size > BLOCK_SIZE else b""
+    return fingerprint(size, head, tail)
+
+def full_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(_HASH_CHUNK): digest.update(chunk)
+    return digest.hexdigest()
+
+def probe_remote(url: str, candidate_sizes: set, session=None):
+    """
+    Dimensione e impronta di un file remoto con una HEAD e due richieste Range (primo e ultimo blocco),
+    senza scaricarlo. Restituisce (dimensione, impronta): la dimensione è None se il server non la
+    dichiara; l'impronta è None se il server non supporta Range o se nessun file locale ha la stessa
+    dimensione (in quel caso le richieste Range non servono).
+    """
+    import requests
+    session = session or requests
+    try:
+        response = session.head(url, allow_redirects=True, timeout=PROBE_TIMEOUT)
+        size = int(response.headers.get("Content-Length") or 0)
+        if not response.ok or size <= 0: return None, None
+        if size not in candidate_sizes: return size, None
+        url = response.url # Evita di ripetere i redirect
+        head = _fetch_range(session, url, 0, min(size, BLOCK_SIZE) - 1)
+        tail = _fetch_range(session, url, size - BLOCK_SIZE, size - 1) if size > BLOCK_SIZE else b""
+        if head is None or tail is None: return size, None
+        return size, fingerprint(size, head, tail)
+    except (requests.RequestException, ValueError):
+        return None, None
+
+def _fetch_range(session, url: str, start: int, end: int):
+    response = session.get(url, headers={"Range": f"bytes={start}-{end}"}, timeout=PROBE_TIMEOUT)
+    # 200 significa che il server ignora Range e invia il file intero: si rinuncia
+    if response.status_code != 206 or len(response.content) != end - start + 1: return None
+    return response.content
+
+
+def _duplicate_valid(entry: dict, now: float) -> bool:
+    return now - entry.get("ts", 0) < DUPLICATE_RECHECK_SECONDS
+
+
+class ContentIndex:
+    """
+    Indice delle impronte dei video di una cartella serie, salvato in INDEX_FILE_NAME nella cartella stessa.
+    Per ogni file conserva l'impronta attuale e quella del file scaricato ("source"): dopo la conversione
+    H.265 il contenuto cambia, ma un mirror che ricarica lo stesso episodio va confrontato con l'originale.
+    Tiene anche gli episodi saltati perché duplicati, contati da get_next_episode_num come già presenti
+    per DUPLICATE_RECHECK_SECONDS; poi ScraperUtils.choose_episode li ripropone (prima degli episodi nuovi)
+    e il controllo viene ripetuto, finché l'episodio non viene scaricato.
+    """
+    def __init__(self, series_path):
+        self._dir = Path(series_path)
+        self._path = self._dir / INDEX_FILE_NAME
+        self._data = self._load()
+
+    def _load(self) -> dict:
+        try:
+            data = json.loads(self._path.read_text(encoding="utf-8"))
+            return {"files": data.get("files", {}), "duplicates": data.get("duplicates", {})}
+        except (OSError, ValueError):
+            return {"files": {}, "duplicates": {}}
+
+    def save(self):
+        self._dir.mkdir(parents=True, exist_ok=True)
+        tmp = self._path.with_name(f"{self._path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(self._data, ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp, self._path)
+
+    def refresh(self) -> "ContentIndex":
+        """Aggiorna le impronte dei file nuovi o modificati (due blocchi letti per file) e dimentica quelli rimossi."""
+        files = self._data["files"]
+        present = set()
+        if self._dir.exists():
+            for entry in os.scandir(self._dir):
+                if not entry.is_file() or not entry.name.endswith(_VIDEO_SUFFIXES): continue
+                if os.path.exists(os.path.join(self._dir, entry.name + ".aria2")): continue # Download in corso
+                present.add(entry.name)
+                stat = entry.stat()
+                known = files.get(entry.name)
+                if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime: continue
+                try: fp = file_fingerprint(Path(entry.path))
+                except OSError: continue
+                files[entry.name] = {"size": stat.st_size, "mtime": stat.st_mtime, "fingerprint": fp,
+                                     "source": (known or {}).get("source")}
+        for name in set(files) - present: del files[name]
+        return self
+
+    def sizes(self) -> set:
+        """Dimensioni dei file noti (attuali e originali scaricati), per filtrare i candidati."""
+        sizes = set()
+        for entry in self._data["files"].values():
+            for fp in (entry.get("fingerprint"), entry.get("source")):
+                if fp: sizes.add(int(fp.split(":", 1)[0]))
+        return sizes
+
+    def find(self, fp: str, exclude: str = None):
+        """Nome del file con impronta (attuale o originale) uguale a fp, o None."""
+        for name, entry in self._data["files"].items():
+            if name != exclude and fp in (entry.get("fingerprint"), entry.get("source")): return name
+        return None
+
+    def full_hash(self, name: str) -> str:
+        """Hash completo di un file, calcolato su richiesta e conservato finché il file non cambia."""
+        entry = self._data["files"][name]
+        if not entry.get("sha256"):
+            entry["sha256"] = full_hash(self._dir / name)
+        return entry["sha256"]
+
+    def same_content(self, name: str, path: Path, fp: str) -> bool:
+        """
+        Conferma un'impronta uguale. Se coincide con l'impronta originale di un file già convertito,
+        l'hash completo non è confrontabile e vale l'impronta; altrimenti si confrontano gli hash completi.
+        """
+        entry = self._data["files"][name]
+        if entry.get("fingerprint") != fp: return entry.get("source") == fp
+        return self.full_hash(name) == full_hash(path)
+
+    def record_download(self, name: str, episode: int = None):
+        """
+        Registra l'impronta del file appena scaricato come "source" (resta valida dopo la conversione).
+        Con 'episode' dimentica anche l'eventuale duplicato registrato per quell'episodio.
+        """
+        if episode is not None: self._data["duplicates"].pop(str(episode), None)
+        path = self._dir / name
+        stat = path.stat()
+        fp = file_fingerprint(path)
+        self._data["files"][name] = {"size": stat.st_size, "mtime": stat.st_mtime, "fingerprint": fp, "source": fp}
+
+    def record_duplicate(self, episode: int, url: str, duplicate_of: str):
+        self._data["duplicates"][str(episode)] = {"url": url, "duplicate_of": duplicate_of, "ts": time.time()}
+
+    def duplicate_episodes(self, now: float = None) -> list:
+        """Episodi saltati come duplicati negli ultimi DUPLICATE_RECHECK_SECONDS."""
+        now = time.time() if now is None else now
+        return sorted(int(ep) for ep, entry in self._data["duplicates"].items() if _duplicate_valid(entry, now))
+
+    def expired_duplicates(self, now: float = None) -> list:
+        """Episodi saltati come duplicati da più di DUPLICATE_RECHECK_SECONDS: da ricontrollare."""
+        now = time.time() if now is None else now
+        return sorted(int(ep) for ep, entry in self._data["duplicates"].items() if not _duplicate_valid(entry, now))
@@ -0,0 +1,288 @@
+import time
+import signal
+import threading
+import multiprocessing as mp
+from pathlib import Path
+
+from anidownloader_config.defaults import (
+    DEFAULT_APP_CONFIG_PATH,
+    DEFAULT_SERIES_JSON_PATH,
+    DEFAULT_SERIES_DB_PATH,
+    DEFAULT_OUTPUT_DIR,
+    DEFAULT_LOG_FILE,
+    DEFAULT_RELEASE_SCHEDULE_PATH,
+    worker_processes
+)
+from anidownloader_config.app_config_manager import AppConfigManager
+from anidownloader_core.planning_service import PlanningExecutors, construct_final_filename
+from anidownloader_core.series_repository import create_series_repository
+from anidownloader_core.release_schedule import ReleaseScheduler
+from anidownloader_core.metrics import MetricsSink
+from anidownloader_core.profiling import profile_settings, profile_section
+from anidownloader_core.process_registry import ProcessRegistry, format_shutdown_stats
+from anidownloader_core.log_service import LogListener, new_task_id
+from anidownloader_core.remote_encode import encode_targets
+from anidownloader_core.lease_store import LeaseStore, describe_holder
+
+DEFAULT_INTERVAL_MINUTES = 15
+# Con la pianificazione adattiva le serie in scadenza vengono cercate con questa frequenza
+ADAPTIVE_CHECK_SECONDS = 30
+# Tempo concesso ai worker per fermarsi da soli dopo SIGTERM, prima di terminarli
+SHUTDOWN_GRACE_SECONDS = 30
+
+def _log(message: str):
+    # flush esplicito: sotto systemd stdout non è un terminale e sarebbe bufferizzato
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}", flush=True)
+
+
+class DaemonStatusUpdater:
+    """Status updater per i worker del demone: registra solo i cambi di fase, non ogni percentuale."""
+    def __init__(self, status_dict):
+        self._status_dict = status_dict
+    def update_progress(self, series_name: str, message: str):
+        self._status_dict[series_name] = message
+    def report_error(self, series_name: str, error_message: str):
+        self._status_dict[series_name] = f"❌ Errore: {error_message}"
+
+
+class AniDownloaderDaemon:
+    """
+    Modalità residente della CLI ('AniDownloader.py daemon').
+    Con 'adaptive_schedule' controlla ogni serie quando lo decide ReleaseScheduler, altrimenti
+    pianifica tutte le serie ogni 'daemon_interval_minutes' minuti. Tra un ciclo e l'altro riusa
+    gli executor di pianificazione, le istanze degli scraper (sessioni HTTP e browser già aperti),
+    il Manager e il Pool di elaborazione. series_data.json e config.json vengono ricaricati
+    quando cambiano su disco. SIGTERM/SIGINT avviano uno spegnimento ordinato.
+    """
+    def __init__(self, config_path: Path = DEFAULT_APP_CONFIG_PATH, series_json_path: Path = DEFAULT_SERIES_JSON_PATH):
+        self._config_path = Path(config_path)
+        self._series_json_path = Path(series_json_path)
+        self._shutdown = threading.Event()
+        self._wake_up = threading.Event()
+        self._watched_mtimes = {}
+        self._config = {}
+        self._series_list = []
+        self._planning_executors = None
+        self._pool = self._manager = self._stop_event = None
+        self._process_registry = None
+        self._log_listener = None
+        self._scheduler = ReleaseScheduler(DEFAULT_RELEASE_SCHEDULE_PATH)
+
+    # --- Configurazione e ricaricamento ---
+
+    def _series_source_path(self) -> Path:
+        if self._config.get("series_backend", "json") == "sqlite":
+            return Path(self._config.get("series_db_path", str(DEFAULT_SERIES_DB_PATH)))
+        return self._series_json_path
+
+    def _mtime(self, path: Path):
+        try: return path.stat().st_mtime_ns
+        except FileNotFoundError: return None
+
+    def _reload_if_changed(self) -> bool:
+        """Ricarica config e serie se i file sono cambiati. Restituisce True se qualcosa è stato ricaricato."""
+        reloaded = False
+        config_mtime = self._mtime(self._config_path)
+        if not self._config or config_mtime != self._watched_mtimes.get("config"):
+            # Solo lettura: un file letto a metà (es. mentre la GUI salva) non viene mai sostituito dai default
+            try:
+                self._config = AppConfigManager(self._config_path, read_only=True).get_all()
+                self._watched_mtimes["config"] = config_mtime
+                _log("Configurazione caricata.")
+                reloaded = True
+            except ValueError as e:
+                _log(f"ATTENZIONE: configurazione '{self._config_path}' non leggibile ({e}): si mantiene quella precedente, nuovo tentativo al prossimo controllo.")
+
+        series_path = self._series_source_path()
+        series_mtime = self._mtime(series_path)
+        if reloaded or series_mtime != self._watched_mtimes.get("series"):
+            repository = create_series_repository(
+                self._series_json_path,
+                backend=self._config.get("series_backend", "json"),
+                db_path=Path(self._config.get("series_db_path", str(DEFAULT_SERIES_DB_PATH)))
+            )
+            try:
+                self._series_list = repository.load_series_data()
+                _log(f"Serie caricate: {len(self._series_list)}.")
+            except Exception as e:
+                _log(f"ERRORE: Impossibile caricare le serie: {e}")
+            finally:
+                if hasattr(repository, "close"): repository.close()
+            self._watched_mtimes["series"] = self._mtime(series_path)
+            reloaded = True
+        return reloaded
+
+    # --- Ciclo principale ---
+
+    def _handle_signal(self, signum, frame):
+        _log(f"Ricevuto segnale {signal.Signals(signum).name}: spegnimento in corso...")
+        self._shutdown.set()
+        self._wake_up.set()
+        if self._stop_event is not None:
+            try: self._stop_event.set()
+            except Exception: pass
+
+    def run(self):
+        _log("Avvio demone AniDownloader.")
+        self._planning_executors = PlanningExecutors()
+        self._manager = mp.Manager()
+        self._stop_event = self._manager.Event()
+        self._reload_if_changed() # Prima del Pool, che viene dimensionato con "worker_processes" (letto solo all'avvio)
+        self._pool = mp.Pool(worker_processes(self._config))
+        self._process_registry = ProcessRegistry.for_run(DEFAULT_LOG_FILE.parent)
+        # I gestori vanno installati DOPO aver creato Manager e Pool, altrimenti i processi figli
+        # li erediterebbero e ignorerebbero il SIGTERM inviato da pool.terminate().
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+
+        next_run = time.monotonic()
+        try:
+            while not self._shutdown.is_set():
+                self._reload_if_changed()
+                if not self._config: # Configurazione illeggibile già all'avvio: nessun ciclo finché non si legge
+                    self._wake_up.wait(timeout=5); self._wake_up.clear(); continue
+                if self._config.get("adaptive_schedule", True):
+                    due = self._scheduler.due_series(self._series_list)
+                    if due: self._run_cycle(due)
+                    next_run = time.monotonic() + ADAPTIVE_CHECK_SECONDS
+                elif time.monotonic() >= next_run:
+                    self._run_cycle(self._series_list)
+                    interval = float(self._config.get("daemon_interval_minutes", DEFAULT_INTERVAL_MINUTES)) * 60
+                    next_run = time.monotonic() + interval
+                    _log(f"Prossimo controllo tra {interval / 60:.0f} minuti.")
+                self._wake_up.wait(timeout=max(0, min(5, next_run - time.monotonic())))
+                self._wake_up.clear()
+        finally:
+            self._close()
+
+    def _run_cycle(self, series_list: list):
+        if not series_list:
+            _log("Nessuna serie configurata."); return
+
+        # 'profile_mode' viene riletto a ogni ciclo: "sampling" si può lasciare attivo
+        log_dir = Path(self._config.get("log_file_path", str(DEFAULT_LOG_FILE))).parent
+        profile = profile_settings(self._config.get("profile_mode"), log_dir / "profiles")
+        # Lease condivisi con le altre esecuzioni (GUI, timer, altri nodi), tenuti solo per la durata del ciclo
+        leases = LeaseStore.from_config(self._config, kind="daemon").start()
+        try:
+            holder = leases.acquire_run_lock()
+            if holder is not None:
+                _log(f"⏭️ Ciclo saltato: è già in corso un'altra esecuzione ({describe_holder(holder)})."); return
+            self._plan_and_process(series_list, profile, leases)
+        finally:
+            leases.stop()
+            if profile and Path(profile["dir"]).exists():
+                from anidownloader_core.profiling import write_report
+                _log(f"📊 Report di profilazione: {write_report(Path(profile['dir']))}")
+
+    def _plan_and_process(self, series_list: list, profile: dict, leases: LeaseStore):
+        start_time = time.time()
+        _log(f"Controllo di {len(series_list)} serie..." + (f" ({len(leases.live_nodes())} nodi attivi)" if leases.shared else ""))
+        planned_tasks = self._planning_executors.plan(series_list, profile, leases)
+        self._scheduler.record_plan_results(planned_tasks)
+        leases.claim_episodes(planned_tasks)
+        if self._shutdown.is_set(): return
+
+        to_process = [t for t in planned_tasks if t["action"] == "process"]
+        for t in planned_tasks:
+            if t["action"] == "skip": _log(f"🚫 {t['series']['name']}: {t['reason']}")
+        if not to_process:
+            self._record_metrics(planned_tasks, [], start_time)
+            _log(f"✅ Nessun nuovo episodio da scaricare ({time.time() - start_time:.1f}s)."); return
+
+        targets = encode_targets(self._config)
+        for task in to_process:
+            task["final_filename"] = construct_final_filename(task)
+            task["queued_at"] = time.time()
+            task["profile"] = profile
+            task["process_registry"] = self._process_registry.path
+            task["task_id"] = new_task_id()
+            task["encode_targets"] = targets
+            _log(f"📥 {task['series']['name']} - {task['reason']}")
+
+        with profile_section(profile, "orchestrate"):
+            self._process(planned_tasks, to_process, start_time)
+
+    def _process(self, planned_tasks: list, to_process: list, start_time: float):
+        from anidownloader_core.media_processor import process_series_task
+
+        status_dict = self._manager.dict({t['series']['name']: "In coda..." for t in to_process})
+        status_updater = DaemonStatusUpdater(status_dict)
+        output_dir = Path(self._config.get("output_dir", str(DEFAULT_OUTPUT_DIR)))
+        log_file = Path(self._config.get("log_file_path", str(DEFAULT_LOG_FILE)))
+        convert_to_h265 = self._config.get("convert_to_h265", False)
+
+        log_queue = self._log_queue(log_file)
+        for task in to_process: task["log_queue"] = log_queue
+        pool_args = [(task, output_dir, log_file, status_updater, self._stop_event, convert_to_h265, self._config.get("encoder")) for task in to_process]
+        async_results = self._pool.starmap_async(process_series_task, pool_args)
+
+        last_phase = {}
+        while not async_results.ready():
+            if self._shutdown.is_set():
+                async_results.wait(timeout=SHUTDOWN_GRACE_SECONDS)
+                break
+            # Una sola lettura del dict condiviso per ciclo; logga solo i cambi di fase
+            for name, message in status_dict.copy().items():
+                phase = message.split(" - ")[0]
+                if last_phase.get(name) != phase:
+                    last_phase[name] = phase
+                    _log(f"   {name}: {message}")
+            async_results.wait(timeout=1)
+
+        if not async_results.ready():
+            _log("Timeout di spegnimento: terminazione dei worker.")
+            stats = self._process_registry.terminate_all()
+            self._pool.terminate(); self._pool.join(); self._pool = None
+            _log(f"Worker terminati: {format_shutdown_stats(stats)}.")
+            for task in to_process: self._remove_partial_files(task)
+            return
+
+        results = async_results.get()
+        self._record_metrics(planned_tasks, results, start_time)
+        for task, r in zip(to_process, results):
+            if not r: continue
+            if r["error"] and self._shutdown.is_set(): self._remove_partial_files(task)
+            if r["error"]: _log(f"❌ {r['name']} | Errore: {r['error']}")
+            elif r.get("duplicate_of"): _log(f"⏭️ {r['name']} | Già presente come {r['duplicate_of']}")
+            else: _log(f"✅ {Path(r['episode']).name} | DL: {r['download_time']:.2f}s | Conv: {r['conversion_time']:.2f}s")
+        _log(f"Ciclo completato in {time.time() - start_time:.2f} secondi.")
+
+    def _log_queue(self, log_file: Path):
+        # Un solo listener per tutta la vita del demone; viene ricreato se 'log_file_path' cambia in config.json
+        if self._log_listener is None or self._log_listener.log_file_path != log_file:
+            if self._log_listener: self._log_listener.stop()
+            self._log_listener = LogListener(log_file, self._manager.Queue()).start()
+        return self._log_listener.queue
+
+    def _record_metrics(self, planned_tasks: list, results: list, start_time: float):
+        log_dir = Path(self._config.get("log_file_path", str(DEFAULT_LOG_FILE))).parent
+        try:
+            MetricsSink(log_dir, self._config.get("metrics_textfile_path") or None,
+                        history_detail_days=self._config.get("history_detail_days")).record_run(planned_tasks, results, start_time, mode="daemon")
+        except Exception as e:
+            _log(f"ATTENZIONE: Impossibile salvare le metriche: {e}")
+
+    def _remove_partial_files(self, task: dict):
+        series_path = Path(task["series"]["path"])
+        for partial in (series_path / task["final_filename"], series_path / f"{task['final_filename']}.aria2"):
+            try:
+                if partial.exists():
+                    partial.unlink(); _log(f" - Rimosso file parziale: {partial.name}")
+            except OSError as e:
+                _log(f"ERRORE: Impossibile rimuovere '{partial}': {e}")
+
+    def _close(self):
+        if self._process_registry:
+            stats = self._process_registry.terminate_all()
+            if stats["groups"]: _log(f"Processi residui: {format_shutdown_stats(stats)}.")
+            self._process_registry.close()
+        if self._pool:
+            self._pool.terminate(); self._pool.join()
+        if self._log_listener:
+            self._log_listener.stop()
+        if self._manager:
+            self._manager.shutdown()
+        if self._planning_executors:
+            self._planning_executors.shutdown(wait=True, cancel_futures=True)
+        _log("Demone arrestato.")
@@ -0,0 +1,283 @@
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import ipaddress
+import tempfile
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# --- Rende importabile il progetto anche avviando il file direttamente ---
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# ------------------------------------
+
+from anidownloader_core.media_processor import convert_and_verify_episode
+from anidownloader_core.metrics import TaskMetrics
+from anidownloader_core.eta import encode_profile
+
+DEFAULT_PORT = 8765
+JOB_HEADER = "X-AniDownloader-Job"
+TOKEN_HEADER = "X-AniDownloader-Token"
+EWMA_ALPHA = 0.3
+# Evento inviato durante le fasi senza avanzamento (coda, verifica): il client usa un timeout di lettura finito
+KEEPALIVE_SECONDS = 15
+_COPY_CHUNK = 1024 * 1024
+
+# Protocollo (HTTP/1.0, JSON):
+#   GET    /status              -> slot, job attivi, velocità misurate
+#   POST   /jobs                -> intestazione X-AniDownloader-Job: {"name", "encoder", "source_path"?}
+#                                  con source_path l'agente converte il file sul percorso condiviso
+#                                  (solo dentro le cartelle --root, altrimenti 403),
+#                                  altrimenti il corpo della richiesta è il file da convertire.
+#                                  La risposta è in JSON lines: eventi {"event": "progress"...},
+#                                  {"event": "keepalive"} ogni KEEPALIVE_SECONDS e infine
+#                                  {"event": "result", "ok", "job", "metrics", "error"}.
+#   GET    /jobs/<id>/output    -> file convertito (solo job senza source_path)
+#   DELETE /jobs/<id>           -> rimuove i file del job
+
+
+class _StreamStatusUpdater:
+    """Inoltra l'avanzamento della conversione al client come righe JSON."""
+    def __init__(self, write_event):
+        self._write_event = write_event
+    def update_progress(self, name: str, message: str):
+        self._write_event({"event": "progress", "message": message})
+    def report_error(self, name: str, error_message: str):
+        self._write_event({"event": "progress", "message": f"❌ Errore: {error_message}"})
+    def report_progress(self, name: str, data: dict):
+        self._write_event({"event": "progress", "data": data})
+
+
+class EncodeAgent:
+    """
+    Agente di conversione remota: esegue convert_and_verify_episode (stessa conversione e verifica
+    della macchina principale) per conto di un orchestratore in rete. Al massimo 'slots' conversioni
+    alla volta; le altre richieste attendono. Misura fps e rapporto di velocità (media mobile), che
+    l'orchestratore usa per distribuire il carico.
+    """
+    def __init__(self, work_dir: Path, slots: int = 1, encoder: dict = None, token: str = None, roots: list = None):
+        self.work_dir = Path(work_dir)
+        self.roots = [Path(root).resolve() for root in roots or []] # Cartelle convertibili sul posto (modalità "path")
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.slots = max(1, slots)
+        self.encoder = encoder
+        self.token = token
+        self._semaphore = threading.BoundedSemaphore(self.slots)
+        self._lock = threading.Lock()
+        self.active = self.waiting = self.jobs_done = self.jobs_failed = 0
+        self.speed_ratio = self.fps = None
+        self._job_counter = 0
+
+    def status(self) -> dict:
+        with self._lock:
+            return {"host": socket.gethostname(), "slots": self.slots, "active": self.active, "waiting": self.waiting,
+                    "jobs_done": self.jobs_done, "jobs_failed": self.jobs_failed, "speed_ratio": self.speed_ratio, "fps": self.fps,
+                    "profile": encode_profile(self.encoder) if self.encoder else None}
+
+    def allowed_source(self, source_path: str):
+        """Percorso risolto (link simbolici e '..' compresi) se è dentro una cartella --root, altrimenti None."""
+        source = Path(source_path).resolve()
+        return source if any(source.is_relative_to(root) for root in self.roots) else None
+
+    def new_job_dir(self) -> Path:
+        with self._lock:
+            self._job_counter += 1
+            job_id = f"{os.getpid()}-{self._job_counter}-{int(time.time())}"
+        job_dir = self.work_dir / job_id
+        job_dir.mkdir(parents=True)
+        return job_dir
+
+    def run_job(self, source: Path, job_dir: Path, name: str, encoder: dict, write_event, stop_event: threading.Event) -> dict:
+        """Converte 'source' sul posto (come in locale); i file temporanei restano in job_dir."""
+        with self._lock: self.waiting += 1
+        # In attesa di uno slot si invia un evento al secondo: così ci si accorge se il client ha chiuso
+        while not self._semaphore.acquire(timeout=1):
+            write_event({"event": "progress", "message": "In coda sull'agente remoto..."})
+            if stop_event.is_set():
+                with self._lock: self.waiting -= 1
+                return {"ok": False, "metrics": None, "error": "Conversione interrotta."}
+        with self._lock: self.waiting -= 1; self.active += 1
+        metrics = TaskMetrics(name)
+        try:
+            convert_and_verify_episode(str(source), name, job_dir / "out", _StreamStatusUpdater(write_event), stop_event,
+                                       self.work_dir / "errors.log", metrics=metrics, encoder=self.encoder or encoder)
+            self._record_speed(metrics)
+            with self._lock: self.jobs_done += 1
+            return {"ok": True, "metrics": metrics.to_dict(), "error": None}
+        except Exception as e:
+            with self._lock: self.jobs_failed += 1
+            return {"ok": False, "metrics": metrics.to_dict(), "error": str(e)}
+        finally:
+            with self._lock: self.active -= 1
+            self._semaphore.release()
+
+    def _record_speed(self, metrics: TaskMetrics):
+        encode = [s for s in metrics.stages if s["stage"] == "encode"]
+        if not encode: return
+        last = encode[-1]
+        with self._lock:
+            if last.get("speed_ratio"): self.speed_ratio = _ewma(self.speed_ratio, last["speed_ratio"])
+            if last.get("fps"): self.fps = _ewma(self.fps, last["fps"])
+
+def _ewma(current, sample: float) -> float:
+    return sample if current is None else current + EWMA_ALPHA * (sample - current)
+
+
+class _AgentHandler(BaseHTTPRequestHandler):
+    agent: EncodeAgent = None
+    server_version = "AniDownloaderEncodeAgent/1"
+
+    def log_message(self, format, *args):
+        sys.stderr.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {self.address_string()} {format % args}\n")
+
+    def _authorized(self) -> bool:
+        if self.agent.token and self.headers.get(TOKEN_HEADER) != self.agent.token:
+            self._send_json(HTTPStatus.UNAUTHORIZED, {"error": "token non valido"})
+            return False
+        return True
+
+    def _send_json(self, status, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _job_dir(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) < 2 or parts[0] != "jobs" or "/" in parts[1] or parts[1] in ("", ".", ".."): return None
+        job_dir = self.agent.work_dir / parts[1]
+        return job_dir if job_dir.is_dir() else None
+
+    def do_GET(self):
+        if not self._authorized(): return
+        if self.path == "/status":
+            self._send_json(HTTPStatus.OK, self.agent.status()); return
+        job_dir = self._job_dir()
+        output = next((p for p in job_dir.iterdir() if p.is_file()), None) if job_dir and self.path.endswith("/output") else None
+        if output is None:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "job non trovato"}); return
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(output.stat().st_size))
+        self.end_headers()
+        with open(output, "rb") as f:
+            shutil.copyfileobj(f, self.wfile, _COPY_CHUNK)
+
+    def do_DELETE(self):
+        if not self._authorized(): return
+        job_dir = self._job_dir()
+        if job_dir is None:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "job non trovato"}); return
+        shutil.rmtree(job_dir, ignore_errors=True)
+        self._send_json(HTTPStatus.OK, {"deleted": job_dir.name})
+
+    def do_POST(self):
+        if not self._authorized(): return
+        if self.path != "/jobs":
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "percorso sconosciuto"}); return
+        try:
+            job = json.loads(self.headers.get(JOB_HEADER, "{}"))
+        except ValueError:
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": "intestazione del job non valida"}); return
+
+        source = None
+        if job.get("source_path"):
+            # Il file viene sostituito sul posto: solo dentro le cartelle della libreria indicate con --root
+            source = self.agent.allowed_source(job["source_path"])
+            if source is None:
+                self._send_json(HTTPStatus.FORBIDDEN, {"error": f"percorso fuori dalle cartelle consentite: {job['source_path']}"}); return
+
+        job_dir = self.agent.new_job_dir()
+        name = job.get("name", "remote")
+        if source is not None:
+            if not source.is_file():
+                shutil.rmtree(job_dir, ignore_errors=True)
+                self._send_json(HTTPStatus.NOT_FOUND, {"error": f"file non trovato sull'agente: {source}"}); return
+        else:
+            source = job_dir / Path(job.get("file_name", "input.mp4")).name
+            remaining = int(self.headers.get("Content-Length", 0))
+            with open(source, "wb") as f:
+                while remaining > 0:
+                    chunk = self.rfile.read(min(_COPY_CHUNK, remaining))
+                    if not chunk: break
+                    f.write(chunk); remaining -= len(chunk)
+            if remaining:
+                shutil.rmtree(job_dir, ignore_errors=True)
+                self._send_json(HTTPStatus.BAD_REQUEST, {"error": "caricamento incompleto"}); return
+
+        # Risposta in streaming senza Content-Length: una riga JSON per evento, chiusura a fine job
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        stop_event = threading.Event()
+        write_lock = threading.Lock()
+
+        def write_event(event: dict):
+            with write_lock:
+                if stop_event.is_set(): return
+                try:
+                    self.wfile.write((json.dumps(event) + "\n").encode()); self.wfile.flush()
+                except OSError:
+                    stop_event.set() # Il client ha chiuso la connessione: interrompi la conversione
+
+        job_done = threading.Event()
+        def keepalive():
+            while not job_done.wait(KEEPALIVE_SECONDS): write_event({"event": "keepalive"})
+        threading.Thread(target=keepalive, daemon=True, name="agent-keepalive").start()
+        try:
+            result = self.agent.run_job(source, job_dir, name, job.get("encoder"), write_event, stop_event)
+        finally:
+            job_done.set()
+        if stop_event.is_set():
+            shutil.rmtree(job_dir, ignore_errors=True); return
+        write_event({"event": "result", "job": job_dir.name, **result})
+        if job.get("source_path") or not result["ok"]:
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost": return True
+    try: return ipaddress.ip_address(host).is_loopback
+    except ValueError: return False # Nome host o indirizzo non valido: potrebbe essere raggiungibile dalla rete
+
+def serve(agent: EncodeAgent, host: str, port: int) -> ThreadingHTTPServer:
+    handler = type("AgentHandler", (_AgentHandler,), {"agent": agent})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Agente di conversione H.265 remota per AniDownloader.")
+    parser.add_argument("--host", default="127.0.0.1", help="Indirizzo di ascolto (0.0.0.0 per la rete locale).")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Porta di ascolto.")
+    parser.add_argument("--slots", type=int, default=1, help="Conversioni contemporanee.")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "anidownloader_encode_agent"), help="Cartella per i file dei job.")
+    parser.add_argument("--root", nargs="+", required=True, help="Cartelle della libreria che i job in modalità \"path\" possono convertire sul posto.")
+    parser.add_argument("--token", default=os.environ.get("ANIDOWNLOADER_AGENT_TOKEN"), help="Token condiviso richiesto ai client (anche da ANIDOWNLOADER_AGENT_TOKEN).")
+    parser.add_argument("--encoder", type=json.loads, help="Impostazioni dell'encoder di questa macchina in JSON (predefinito: quelle inviate dall'orchestratore).")
+    args = parser.parse_args()
+
+    if not args.token and not _is_loopback(args.host):
+        print(f"❌ Per ascoltare su {args.host} serve un token (--token o ANIDOWNLOADER_AGENT_TOKEN)."); sys.exit(1)
+    if not shutil.which("ffmpeg"):
+        print("❌ ffmpeg non trovato nel PATH."); sys.exit(1)
+    agent = EncodeAgent(Path(args.work_dir), args.slots, args.encoder, args.token, args.root)
+    server = serve(agent, args.host, args.port)
+    print(f"Agente di conversione in ascolto su http://{args.host}:{args.port} ({agent.slots} slot, cartella {agent.work_dir})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
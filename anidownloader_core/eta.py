@@ -0,0 +1,193 @@
+import time
+import heapq
+import sqlite3
+from pathlib import Path
+from urllib.parse import urlparse
+
+from anidownloader_config.defaults import DEFAULT_ENCODER_SETTINGS
+
+# Valori usati finché lo storico non ha dati per host o profilo
+DEFAULT_DOWNLOAD_SPEED = 5 * 1024 ** 2      # byte/s
+DEFAULT_EPISODE_BYTES = 350 * 1024 ** 2
+DEFAULT_MEDIA_SECONDS = 24 * 60             # Durata tipica di un episodio
+DEFAULT_SPEED_RATIO = 1.5                   # Multipli del tempo reale in conversione
+EWMA_ALPHA = 0.3                            # Peso di ogni nuovo campione di velocità
+HISTORY_SAMPLES = 500                       # Fasi più recenti lette dallo storico
+
+PHASE_QUEUED, PHASE_DOWNLOAD, PHASE_ENCODE, PHASE_DONE = "queued", "download", "encode", "done"
+
+
+def download_host(url: str) -> str:
+    return urlparse(url or "").netloc.lower()
+
+def encode_profile(encoder: dict = None) -> str:
+    """Chiave del profilo di conversione (es. 'veryfast/crf23/12t') con cui si raggruppano le velocità."""
+    settings = {**DEFAULT_ENCODER_SETTINGS, **(encoder or {})}
+    return f"{settings['preset']}/crf{settings['crf']}/{settings['threads']}t"
+
+def format_duration(seconds) -> str:
+    if seconds is None: return "?"
+    seconds = int(max(0, seconds))
+    if seconds >= 3600: return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60: return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+def format_speed(bytes_per_second: float) -> str:
+    return f"{bytes_per_second / 1024 ** 2:.1f} MB/s"
+
+def _median(values: list):
+    values = sorted(v for v in values if v)
+    return values[len(values) // 2] if values else None
+
+
+class EtaPriors:
+    """Velocità attese prima dei dati dal vivo: download per host e rapporto di conversione per profilo."""
+    def __init__(self, host_speeds: dict = None, profile_ratios: dict = None, episode_bytes: float = None, media_seconds: float = None):
+        self.host_speeds = host_speeds or {}
+        self.profile_ratios = profile_ratios or {}
+        self.episode_bytes = episode_bytes or DEFAULT_EPISODE_BYTES
+        self.media_seconds = media_seconds or DEFAULT_MEDIA_SECONDS
+
+    def download_speed(self, host: str) -> float:
+        if host in self.host_speeds: return self.host_speeds[host]
+        return _median(list(self.host_speeds.values())) or DEFAULT_DOWNLOAD_SPEED
+
+    def speed_ratio(self, profile: str) -> float:
+        if profile in self.profile_ratios: return self.profile_ratios[profile]
+        return _median(list(self.profile_ratios.values())) or DEFAULT_SPEED_RATIO
+
+    @classmethod
+    def from_history(cls, db_path: Path):
+        """
+        Legge le mediane dalle fasi recenti dello storico (history.db). Non crea il database e non fallisce:
+        senza storico restituisce i valori predefiniti.
+        """
+        db_path = Path(db_path)
+        if not db_path.exists(): return cls()
+        try:
+            conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=5)
+        except sqlite3.Error:
+            return cls()
+        try:
+            downloads = conn.execute(
+                "SELECT json_extract(data, '$.host'), json_extract(data, '$.mean_speed'), json_extract(data, '$.bytes') FROM stages "
+                "WHERE stage = 'download' AND data IS NOT NULL ORDER BY rowid DESC LIMIT ?", (HISTORY_SAMPLES,)).fetchall()
+            encodes = conn.execute(
+                "SELECT json_extract(data, '$.profile'), json_extract(data, '$.speed_ratio'), duration FROM stages "
+                "WHERE stage = 'encode' AND data IS NOT NULL ORDER BY rowid DESC LIMIT ?", (HISTORY_SAMPLES,)).fetchall()
+        except sqlite3.Error:
+            return cls()
+        finally:
+            conn.close()
+
+        by_host, by_profile = {}, {}
+        for host, speed, _ in downloads:
+            if host and speed: by_host.setdefault(host, []).append(speed)
+        for profile, ratio, _ in encodes:
+            if profile and ratio: by_profile.setdefault(profile, []).append(ratio)
+        return cls({h: _median(v) for h, v in by_host.items()}, {p: _median(v) for p, v in by_profile.items()},
+                   episode_bytes=_median([b for _, _, b in downloads]),
+                   media_seconds=_median([(r or 0) * (d or 0) for _, r, d in encodes])) # Durata dell'episodio = tempo di conversione x velocità
+
+
+class _TaskEta:
+    __slots__ = ("host", "profile", "convert", "phase", "bytes_done", "bytes_total", "download_speed",
+                 "media_seconds", "media_done", "speed_ratio", "fps", "updated_at")
+
+    def __init__(self, host: str, profile: str, convert: bool):
+        self.host, self.profile, self.convert = host, profile, convert
+        self.phase = PHASE_QUEUED
+        self.bytes_done = self.bytes_total = 0
+        self.download_speed = self.speed_ratio = self.fps = None
+        self.media_seconds = self.media_done = 0.0
+        self.updated_at = time.time()
+
+
+class RunEta:
+    """
+    Stima dei tempi di un'esecuzione. Ogni task parte dalle velocità storiche del suo host e profilo di
+    conversione; ogni evento di avanzamento (report_progress dei worker) aggiorna solo lo stato di quel
+    task, con una media mobile esponenziale delle velocità osservate. Le stime si ricavano dallo stato
+    corrente senza rileggere lo storico.
+    """
+    def __init__(self, priors: EtaPriors = None, workers: int = 1):
+        self._priors = priors or EtaPriors()
+        self._workers = max(1, workers)
+        self._tasks = {}
+
+    def add_task(self, name: str, host: str = "", profile: str = None, convert: bool = True):
+        self._tasks[name] = _TaskEta(host, profile or encode_profile(), convert)
+
+    def update(self, name: str, data: dict):
+        task = self._tasks.get(name)
+        if task is None:
+            self.add_task(name, data.get("host", ""), data.get("profile"), data.get("convert", True))
+            task = self._tasks[name]
+        phase = data.get("phase")
+        if phase == PHASE_DOWNLOAD:
+            task.phase = PHASE_DOWNLOAD
+            task.bytes_done = data.get("bytes_done", task.bytes_done)
+            task.bytes_total = data.get("bytes_total") or task.bytes_total
+            if data.get("speed"): task.download_speed = _ewma(task.download_speed, data["speed"])
+        elif phase == PHASE_ENCODE:
+            if task.phase != PHASE_ENCODE: task.bytes_done = task.bytes_total # Download concluso
+            task.phase = PHASE_ENCODE
+            task.media_seconds = data.get("media_seconds") or task.media_seconds
+            task.media_done = data.get("media_done", task.media_done)
+            if data.get("speed_ratio"): task.speed_ratio = _ewma(task.speed_ratio, data["speed_ratio"])
+            task.fps = data.get("fps", task.fps)
+        elif phase == PHASE_DONE:
+            task.phase = PHASE_DONE
+        task.updated_at = time.time()
+
+    def finish(self, name: str):
+        if name in self._tasks: self._tasks[name].phase = PHASE_DONE
+
+    def _download_remaining(self, task: _TaskEta) -> float:
+        speed = task.download_speed or self._priors.download_speed(task.host)
+        total = task.bytes_total or self._priors.episode_bytes
+        return max(0, total - task.bytes_done) / speed
+
+    def _encode_remaining(self, task: _TaskEta) -> float:
+        if not task.convert: return 0.0
+        ratio = task.speed_ratio or self._priors.speed_ratio(task.profile)
+        media = task.media_seconds or self._priors.media_seconds
+        return max(0.0, media - task.media_done) / ratio
+
+    def task_eta(self, name: str):
+        """Secondi mancanti alla fine del task, o None se il task è concluso o sconosciuto."""
+        task = self._tasks.get(name)
+        if task is None or task.phase == PHASE_DONE: return None
+        if task.phase == PHASE_ENCODE: return self._encode_remaining(task)
+        return self._download_remaining(task) + self._encode_remaining(task)
+
+    def run_eta(self):
+        """Secondi alla fine dell'esecuzione: i task in coda occupano il primo processo del Pool che si libera."""
+        running = [self.task_eta(n) for n, t in self._tasks.items() if t.phase in (PHASE_DOWNLOAD, PHASE_ENCODE)]
+        queued = [self.task_eta(n) for n, t in self._tasks.items() if t.phase == PHASE_QUEUED]
+        if not running and not queued: return None
+        free_at = sorted(running)[:self._workers]
+        free_at += [0.0] * (self._workers - len(free_at))
+        heapq.heapify(free_at)
+        for remaining in queued:
+            heapq.heapreplace(free_at, free_at[0] + remaining)
+        return max(free_at)
+
+    def bandwidth(self) -> float:
+        """Banda complessiva (byte/s) dei download in corso."""
+        return sum(t.download_speed or 0 for t in self._tasks.values() if t.phase == PHASE_DOWNLOAD)
+
+    def encode_fps(self) -> float:
+        """Fotogrammi al secondo complessivi delle conversioni in corso."""
+        return sum(t.fps or 0 for t in self._tasks.values() if t.phase == PHASE_ENCODE)
+
+    def summary(self) -> str:
+        parts = []
+        if bandwidth := self.bandwidth(): parts.append(f"Banda: {format_speed(bandwidth)}")
+        if fps := self.encode_fps(): parts.append(f"Conversione: {fps:.0f} fps")
+        run_eta = self.run_eta()
+        if run_eta is not None: parts.append(f"Fine stimata tra {format_duration(run_eta)}")
+        return " | ".join(parts)
+
+def _ewma(current, sample: float) -> float:
+    return sample if current is None else current + EWMA_ALPHA * (sample - current)
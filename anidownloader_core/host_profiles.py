@@ -0,0 +1,98 @@
+import random
+import sqlite3
+from pathlib import Path
+
+from anidownloader_core.eta import HISTORY_SAMPLES, _median
+
+# Connessioni per server provate per ogni host (aria2c -x); 16 è il valore usato prima dei profili
+CONNECTION_CHOICES = (2, 4, 8, 16)
+DEFAULT_CONNECTIONS = 16
+# Frazione dei download che prova un numero di connessioni o una fonte diversi dal migliore noto
+EXPLORATION_RATE = 0.1
+# Campioni più recenti per host e numero di connessioni: i vecchi escono e il profilo si adatta
+SAMPLES_PER_CHOICE = 20
+
+
+class HostProfiles:
+    """
+    Profilo di ogni host di download costruito dalle fasi 'source' dello storico (history.db):
+    velocità misurata e tasso di errore per numero di connessioni. Il punteggio di una scelta è
+    la velocità mediana per la probabilità di successo (con smussamento: pochi campioni pesano poco),
+    così un host che taglia le connessioni oltre una soglia viene penalizzato sopra quella soglia.
+    """
+    def __init__(self, samples: dict = None, rng: random.Random = None):
+        self._samples = samples or {} # (host, connessioni) -> {"speeds": [...], "ok": n, "failed": n}
+        self._rng = rng or random.Random()
+
+    @classmethod
+    def from_history(cls, db_path: Path, rng: random.Random = None):
+        """Come EtaPriors.from_history: non crea il database e senza storico restituisce un profilo vuoto."""
+        db_path = Path(db_path)
+        if not db_path.exists(): return cls(rng=rng)
+        try:
+            conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=5)
+            rows = conn.execute(
+                "SELECT json_extract(data, '$.host'), json_extract(data, '$.connections'), json_extract(data, '$.ok'), "
+                "json_extract(data, '$.bytes'), duration FROM stages WHERE stage = 'source' AND data IS NOT NULL "
+                "ORDER BY rowid DESC LIMIT ?", (HISTORY_SAMPLES,)).fetchall()
+            conn.close()
+        except sqlite3.Error:
+            return cls(rng=rng)
+
+        samples = {}
+        for host, connections, ok, size, duration in rows:
+            if not host or not connections: continue
+            entry = samples.setdefault((host, int(connections)), {"speeds": [], "ok": 0, "failed": 0})
+            if entry["ok"] + entry["failed"] >= SAMPLES_PER_CHOICE: continue
+            if ok:
+                entry["ok"] += 1
+                if size and duration: entry["speeds"].append(size / duration)
+            else:
+                entry["failed"] += 1
+        return cls(samples, rng)
+
+    def _score(self, host: str, connections: int):
+        entry = self._samples.get((host, connections))
+        if not entry: return None
+        speed = _median(entry["speeds"])
+        if speed is None: return 0.0 if entry["failed"] else None
+        return speed * (entry["ok"] + 1) / (entry["ok"] + entry["failed"] + 2)
+
+    def host_score(self, host: str):
+        """Velocità attesa con il numero di connessioni migliore per l'host, o None se mai misurato."""
+        scores = [s for s in (self._score(host, c) for c in CONNECTION_CHOICES) if s is not None]
+        return max(scores) if scores else None
+
+    def explore(self) -> bool:
+        return self._rng.random() < EXPLORATION_RATE
+
+    def connections(self, host: str, explore: bool = False) -> int:
+        """
+        Connessioni per server da usare con l'host. Esplorando si prova la scelta con meno campioni
+        (a parità, una a caso), altrimenti quella con il punteggio migliore; senza dati DEFAULT_CONNECTIONS.
+        Se finora sull'host sono falliti tutti i tentativi si esplora comunque.
+        """
+        scored = [(s, c) for c in CONNECTION_CHOICES if (s := self._score(host, c)) is not None]
+        if explore or (scored and max(scored)[0] == 0):
+            counts = {c: sum(self._samples.get((host, c), {}).get(k, 0) for k in ("ok", "failed")) for c in CONNECTION_CHOICES}
+            fewest = min(counts.values())
+            return self._rng.choice([c for c, n in counts.items() if n == fewest])
+        return max(scored)[1] if scored else DEFAULT_CONNECTIONS
+
+    def rank(self, hosts: list, explore: bool = False) -> list:
+        """
+        Indici di 'hosts' dal più veloce atteso al più lento (stabile a parità). Un host mai misurato
+        vale quanto il migliore noto, così viene provato; esplorando l'ordine è casuale.
+        """
+        order = list(range(len(hosts)))
+        if explore: self._rng.shuffle(order); return order
+        scores = [self.host_score(host) for host in hosts]
+        known = [s for s in scores if s is not None]
+        optimistic = max(known) if known else 0.0
+        return sorted(order, key=lambda i: -(scores[i] if scores[i] is not None else optimistic))
+
+    def rows(self) -> list:
+        """Profilo leggibile per 'history --sources': una riga per host e numero di connessioni."""
+        return [{"host": host, "connections": connections, "ok": entry["ok"], "failed": entry["failed"],
+                 "median_speed": _median(entry["speeds"]), "score": self._score(host, connections)}
+                for (host, connections), entry in sorted(self._samples.items())]
@@ -0,0 +1,286 @@
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import hashlib
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from anidownloader_config.defaults import DEFAULT_LEASE_DIR
+
+# Durata di un lease senza rinnovo: oltre questo tempo il nodo che lo detiene è considerato morto
+DEFAULT_LEASE_TTL = 120
+NODE_PREFIX = "node:"
+RUN_LOCK_PREFIX = "run:"
+_NODE_FILE_PREFIX = "node-"
+_LEASE_SUFFIX = ".lease"
+
+
+def series_lease_key(series: dict) -> str:
+    return f"series:{series.get('path') or series.get('name')}"
+
+def episode_lease_key(task: dict) -> str:
+    return f"episode:{task['series'].get('path') or task['series'].get('name')}:{task['final_ep_number']}"
+
+def describe_holder(data: dict) -> str:
+    """Descrizione leggibile di chi detiene un lease, es. "gui, PID 1234 su desktop, dalle 21:05"."""
+    if not data: return "un'altra esecuzione"
+    since = datetime.fromtimestamp(data.get("acquired_at") or data.get("renewed_at", 0)).strftime("%H:%M")
+    return f"{data.get('kind') or 'esecuzione'}, PID {data.get('pid')} su {data.get('host')}, dalle {since}"
+
+
+class LeaseStore:
+    """
+    Lease con scadenza su file, in una cartella condivisa tra più macchine (es. sul mount della libreria).
+    Ogni lease è un file creato in modo esclusivo (O_EXCL) con il nodo che lo detiene e la scadenza;
+    un thread lo rinnova ogni ttl/3 finché il nodo lavora. Un lease scaduto (nodo morto o bloccato),
+    o di un processo non più attivo sulla stessa macchina, può essere ripreso da un altro nodo.
+    Gli orologi delle macchine devono essere sincronizzati (NTP) entro una frazione del ttl.
+
+    Il nodo è la macchina (node_id = hostname): GUI, CLI e demone della stessa macchina sono lo stesso nodo,
+    e tra loro si escludono con il lock di esecuzione e con i lease, che appartengono al singolo processo.
+    Ogni processo in esecuzione registra anche un lease "node:<id>:<pid>": i nodi attivi si spartiscono le serie
+    con il rendezvous hashing (preferred_node), così N nodi avviati insieme non fanno lo stesso lavoro.
+    Una serie pianificata senza nulla da scaricare resta "controllata" per un ttl (hold): i nodi che
+    partono subito dopo la saltano invece di rifare la stessa ricerca.
+    """
+    def __init__(self, lease_dir, ttl: float = DEFAULT_LEASE_TTL, node_id: str = None, kind: str = None):
+        self._dir = Path(lease_dir)
+        self._ttl = float(ttl)
+        self.host = socket.gethostname()
+        self.node_id = node_id or self.host
+        self.kind = kind # "cli", "daemon" o "gui": solo descrittivo, per i messaggi degli altri processi
+        self._acquired_at = {}
+        self._held = {} # chiave -> percorso del file
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    @classmethod
+    def from_config(cls, config: dict, kind: str = None):
+        """
+        Lease store della cartella condivisa "lease_dir" di config.json. Senza, si usa DEFAULT_LEASE_DIR:
+        coordina comunque le esecuzioni di questa macchina (GUI, timer, demone).
+        """
+        lease_dir = config.get("lease_dir") or DEFAULT_LEASE_DIR
+        return cls(Path(lease_dir).expanduser(), config.get("lease_ttl_seconds") or DEFAULT_LEASE_TTL, kind=kind)
+
+    @property
+    def shared(self) -> bool:
+        """True se la cartella è diversa da quella locale predefinita (più macchine)."""
+        return self._dir != Path(DEFAULT_LEASE_DIR)
+
+    @property
+    def path(self) -> str:
+        return str(self._dir)
+
+    def _path(self, key: str) -> Path:
+        prefix = _NODE_FILE_PREFIX if key.startswith(NODE_PREFIX) else ""
+        return self._dir / f"{prefix}{hashlib.sha1(key.encode()).hexdigest()[:20]}{_LEASE_SUFFIX}"
+
+    def _payload(self, key: str, **extra) -> bytes:
+        now = time.time()
+        acquired_at = self._acquired_at.setdefault(key, now)
+        return json.dumps({"key": key, "node": self.node_id, "host": self.host, "pid": os.getpid(), "kind": self.kind,
+                           "acquired_at": acquired_at, "renewed_at": now, "expires_at": now + self._ttl, **extra}).encode()
+
+    @staticmethod
+    def _read(path: Path):
+        try: return json.loads(path.read_bytes())
+        except (OSError, ValueError): return None
+
+    def _owns(self, data: dict) -> bool:
+        # Un lease è di questo processo, non solo del nodo: i processi della stessa macchina non se li scambiano
+        return data.get("node") == self.node_id and data.get("pid") == os.getpid()
+
+    def _expired(self, data: dict) -> bool:
+        if data.get("expires_at", 0) < time.time(): return True
+        # Sulla stessa macchina un processo terminato libera subito i suoi lease
+        return data.get("host") == self.host and not _pid_alive(data.get("pid"))
+
+    # --- Acquisizione, rinnovo e rilascio ---
+    def acquire(self, key: str) -> bool:
+        """Prende il lease 'key' se libero o scaduto. Restituisce False se è di un altro nodo attivo."""
+        self._dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        for _ in range(3):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                data = self._read(path)
+                if data is None:
+                    # File appena creato e non ancora scritto, oppure illeggibile da più di un ttl
+                    try: stale = time.time() - path.stat().st_mtime > self._ttl
+                    except FileNotFoundError: continue
+                    if not stale: return False
+                elif self._owns(data):
+                    with self._lock: self._held[key] = path
+                    return self.renew(key)
+                elif not self._expired(data):
+                    return False
+                if not self._take_over(path, data): return False
+                continue
+            with os.fdopen(fd, "wb") as f: f.write(self._payload(key))
+            with self._lock: self._held[key] = path
+            return True
+        return False
+
+    def _take_over(self, path: Path, expired: dict) -> bool:
+        # Il rename è atomico: tra più nodi che vedono lo stesso lease scaduto solo uno lo sposta.
+        # Se nel frattempo un altro nodo l'aveva già ripreso, il lease fresco viene rimesso al suo posto.
+        tomb = path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.stale")
+        try: os.rename(path, tomb)
+        except FileNotFoundError: return True # Già rimosso: si riprova a crearlo
+        moved = self._read(tomb)
+        if moved is not None and expired is not None and moved.get("renewed_at") != expired.get("renewed_at"):
+            try: os.link(tomb, path)
+            except OSError: pass
+            tomb.unlink(missing_ok=True)
+            return False
+        tomb.unlink(missing_ok=True)
+        return True
+
+    def renew(self, key: str) -> bool:
+        """Prolunga un lease detenuto. Restituisce False (e lo dimentica) se nel frattempo è stato perso."""
+        with self._lock: path = self._held.get(key)
+        if path is None: return False
+        data = self._read(path)
+        if data is None or not self._owns(data):
+            with self._lock: self._held.pop(key, None)
+            return False
+        self._write(path, self._payload(key))
+        return True
+
+    def _write(self, path: Path, payload: bytes):
+        tmp = path.with_name(f".{path.name}.{self.node_id}-{os.getpid()}.tmp")
+        tmp.write_bytes(payload)
+        os.replace(tmp, path)
+
+    def hold(self, key: str):
+        """
+        Lascia il lease detenuto 'key' come "controllato alle T" fino alla scadenza del ttl: non viene più
+        rinnovato né rilasciato, e fino ad allora gli altri nodi saltano la chiave.
+        """
+        with self._lock: path = self._held.pop(key, None)
+        if path is None: return
+        data = self._read(path)
+        if data is not None and self._owns(data):
+            self._write(path, self._payload(key, planned_at=time.time()))
+        with self._lock: self._acquired_at.pop(key, None)
+
+    def release(self, key: str):
+        with self._lock: path = self._held.pop(key, None); self._acquired_at.pop(key, None)
+        if path is None: return
+        data = self._read(path)
+        if data is not None and self._owns(data):
+            path.unlink(missing_ok=True)
+
+    def release_all(self):
+        with self._lock: keys = list(self._held)
+        for key in keys: self.release(key)
+
+    def holder(self, key: str):
+        """Dati del lease attivo su 'key' (nodo, scadenza...), o None se libero o scaduto."""
+        data = self._read(self._path(key))
+        return data if data is not None and not self._expired(data) else None
+
+    # --- Nodi attivi e ripartizione ---
+    def live_nodes(self) -> list:
+        if not self._dir.exists(): return [self.node_id]
+        nodes = {self.node_id}
+        for path in self._dir.glob(f"{_NODE_FILE_PREFIX}*{_LEASE_SUFFIX}"):
+            data = self._read(path)
+            if data is not None and not self._expired(data): nodes.add(data["node"])
+        return sorted(nodes)
+
+    @staticmethod
+    def preferred_node(key: str, nodes: list) -> str:
+        """Rendezvous hashing: ogni chiave ha un nodo preferito stabile; se un nodo esce, solo le sue chiavi si spostano."""
+        return max(nodes, key=lambda node: hashlib.sha1(f"{node}|{key}".encode()).digest())
+
+    def claim(self, key: str, nodes: list = None) -> bool:
+        """
+        Prende il lease 'key' per lavorarci. Una chiave che spetta a un altro nodo attivo non viene presa
+        (senza attese): la elabora quel nodo, e se muore il suo lease di nodo scade e la chiave si sposta.
+        """
+        if self._stop.is_set(): return False # Nodo già fermato (es. pianificazione interrotta)
+        nodes = nodes or self.live_nodes()
+        if self.preferred_node(key, nodes) != self.node_id: return False
+        return self.acquire(key)
+
+    # --- Coordinamento delle esecuzioni ---
+    def acquire_run_lock(self):
+        """
+        Lock di esecuzione della macchina: una sola esecuzione alla volta lo detiene. Restituisce None
+        se preso, altrimenti i dati di chi lo detiene. Le esecuzioni automatiche (timer, demone) che non
+        lo ottengono saltano il giro; la GUI prosegue comunque, saltando il lavoro già in corso.
+        """
+        key = RUN_LOCK_PREFIX + self.host
+        if self.acquire(key): return None
+        return self.holder(key) or {}
+
+    def claim_episodes(self, planned_tasks: list) -> list:
+        """
+        Prende il lease di ogni episodio da elaborare (chiave: cartella della serie e numero di episodio).
+        Gli episodi già in lavorazione in un'altra esecuzione diventano skip con il nome di chi li elabora.
+        Restituisce i task trasformati in skip.
+        """
+        busy = []
+        for task in planned_tasks:
+            if task["action"] != "process": continue
+            key = episode_lease_key(task)
+            if self.acquire(key): continue
+            task["action"] = "skip"
+            task["reason"] = f"Episodio {task['final_ep_number']} già in elaborazione ({describe_holder(self.holder(key))})."
+            busy.append(task)
+        return busy
+
+    # --- Ciclo di vita del nodo ---
+    def _node_key(self) -> str:
+        # Una registrazione per processo: il nodo resta attivo finché uno dei suoi processi lavora
+        return f"{NODE_PREFIX}{self.node_id}:{os.getpid()}"
+
+    def start(self):
+        """Registra il nodo e avvia il rinnovo periodico dei lease."""
+        self._stop.clear()
+        self.acquire(self._node_key())
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True, name="lease-heartbeat")
+        self._heartbeat.start()
+        return self
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self._ttl / 3):
+            with self._lock: keys = list(self._held)
+            for key in keys:
+                try: self.renew(key)
+                except OSError: pass # Mount non raggiungibile: si riprova al prossimo giro
+
+    def stop(self):
+        """Ferma il rinnovo e rilascia tutti i lease del nodo."""
+        self._stop.set()
+        if self._heartbeat is not None: self._heartbeat.join(timeout=5); self._heartbeat = None
+        self.release_all()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+
+def _pid_alive(pid) -> bool:
+    if not pid: return False
+    try:
+        import psutil # Importato solo qui: planning_service carica questo modulo anche nella CLI
+        return psutil.pid_exists(pid)
+    except ImportError:
+        pass
+    if sys.platform == 'win32': return True # Senza psutil non si può verificare: vale la scadenza
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    except PermissionError: return True
+    return True
@@ -0,0 +1,112 @@
+import json
+import time
+import uuid
+import logging
+import logging.handlers
+from pathlib import Path
+
+LOGGER_NAME = "anidownloader"
+JSON_LOG_NAME = "anidownloader.jsonl"
+MAX_LOG_BYTES = 5 * 1024 ** 2
+LOG_BACKUP_COUNT = 5
+HUMAN_FORMAT = "%(asctime)s - %(levelname)s - [%(task_id)s] %(series)s: %(message)s"
+
+# Campi di correlazione: presenti in ogni record, anche in quelli emessi fuori da un task
+_CONTEXT_FIELDS = ("task_id", "series", "episode")
+_worker_target = None # Coda (o file di ripiego) a cui è collegato il logger di questo processo
+
+
+def new_task_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+class _ContextFilter(logging.Filter):
+    def filter(self, record):
+        for field in _CONTEXT_FIELDS:
+            if not hasattr(record, field): setattr(record, field, "-")
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """Un oggetto JSON per riga, con i campi di correlazione del task."""
+    def format(self, record):
+        entry = {"ts": round(record.created, 3), "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)),
+                 "level": record.levelname, "logger": record.name, "pid": record.process, "message": record.getMessage()}
+        entry.update({f: getattr(record, f) for f in _CONTEXT_FIELDS if getattr(record, f, "-") != "-"})
+        if record.exc_text or record.exc_info:
+            entry["exception"] = record.exc_text or self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class LogListener:
+    """
+    Unico scrittore dei file di log, nel processo orchestratore. I worker del Pool inviano i record
+    su 'queue' (una coda del Manager, passata nel task); un thread li scrive su:
+      - log_file_path (serie_critical_errors.log): formato leggibile, solo errori;
+      - anidownloader.jsonl nella stessa cartella: JSON, da INFO in su.
+    Entrambi ruotano per dimensione. I file vengono aperti una volta, all'avvio del listener.
+    """
+    def __init__(self, log_file_path: Path, queue, max_bytes: int = MAX_LOG_BYTES, backup_count: int = LOG_BACKUP_COUNT):
+        log_file_path = self.log_file_path = Path(log_file_path)
+        log_file_path.parent.mkdir(parents=True, exist_ok=True)
+        human = logging.handlers.RotatingFileHandler(log_file_path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        human.setLevel(logging.ERROR)
+        human.setFormatter(logging.Formatter(HUMAN_FORMAT))
+        structured = logging.handlers.RotatingFileHandler(log_file_path.parent / JSON_LOG_NAME, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        structured.setLevel(logging.INFO)
+        structured.setFormatter(JsonFormatter())
+        for handler in (human, structured): handler.addFilter(_ContextFilter())
+        self._handlers = [human, structured]
+        self.queue = queue
+        self._listener = logging.handlers.QueueListener(queue, *self._handlers, respect_handler_level=True)
+
+    def start(self):
+        self._listener.start()
+        return self
+
+    def stop(self):
+        """Scrive i record ancora in coda e chiude i file."""
+        try: self._listener.stop()
+        finally:
+            for handler in self._handlers: handler.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+
+def configure_worker_logging(queue, fallback_path: Path = None):
+    """
+    Collega il logger dell'applicazione alla coda del listener. Va chiamata all'inizio di ogni task:
+    i processi del Pool sopravvivono tra un'esecuzione e l'altra e la coda può cambiare.
+    Senza coda (es. benchmark che chiamano direttamente la pipeline) gli errori vanno in fallback_path,
+    con un handler aperto una volta per processo.
+    """
+    global _worker_target
+    # Ogni task riceve una nuova copia del proxy della stessa coda: si confronta il riferimento nel Manager
+    token = getattr(queue, "_token", None)
+    target = (token.address, token.id) if token is not None else (id(queue) if queue is not None else str(fallback_path))
+    if target == _worker_target or (queue is None and fallback_path is None): return
+
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler); handler.close()
+    if queue is not None:
+        logger.addHandler(logging.handlers.QueueHandler(queue))
+    else:
+        handler = logging.FileHandler(fallback_path, encoding="utf-8", delay=True)
+        handler.setLevel(logging.ERROR)
+        handler.setFormatter(logging.Formatter(HUMAN_FORMAT))
+        handler.addFilter(_ContextFilter())
+        logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    _worker_target = target
+
+def task_logger(task: dict, name: str = "media") -> logging.LoggerAdapter:
+    """Logger che aggiunge a ogni record l'ID del task, la serie e l'episodio."""
+    return logging.LoggerAdapter(logging.getLogger(f"{LOGGER_NAME}.{name}"), {
+        "task_id": task.get("task_id") or "-", "series": task.get("series", {}).get("name", "-"),
+        "episode": task.get("final_ep_number") or "-"})
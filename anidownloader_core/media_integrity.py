@@ -0,0 +1,88 @@
+from pathlib import Path
+
+# Controlli strutturali sul file appena scaricato: si leggono solo le intestazioni dei box MP4 o
+# degli elementi EBML (pochi byte per elemento), mai il contenuto video.
+_MAX_BOXES = 10000
+_EBML_MAGIC = b"\x1a\x45\xdf\xa3"
+_MKV_SEGMENT_ID = b"\x18\x53\x80\x67"
+
+
+def verify_download(path: Path, expected_size: int = None):
+    """
+    Restituisce None se il file è integro, altrimenti il motivo. Controlla:
+      - che la dimensione raggiunga il Content-Length del server (se noto);
+      - il contenitore: per MP4 la catena dei box di primo livello deve coprire esattamente il file
+        e contenere 'moov' e 'mdat'; per Matroska l'intestazione EBML e la dimensione del Segment.
+    """
+    path = Path(path)
+    if not path.exists(): return "file mancante"
+    size = path.stat().st_size
+    if size == 0: return "file vuoto"
+    # Solo un file più corto è sicuramente incompleto: alcune CDN dichiarano nella HEAD una dimensione
+    # diversa dalla GET, e in quel caso decide il controllo del contenitore
+    if expected_size and size < expected_size:
+        return f"file troncato: {size} byte invece di {expected_size}"
+    with open(path, "rb") as f:
+        head = f.read(12)
+        f.seek(0)
+        if head.startswith(_EBML_MAGIC): return _check_matroska(f, size)
+        if head[4:8] in (b"ftyp", b"styp", b"moov", b"mdat", b"free", b"wide", b"skip"): return _check_mp4(f, size)
+    return "formato non riconosciuto (né MP4 né Matroska)"
+
+
+def _check_mp4(f, size: int):
+    offset, boxes = 0, set()
+    for _ in range(_MAX_BOXES):
+        if offset == size: break
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8: return f"box troncato all'offset {offset}"
+        box_size, box_type = int.from_bytes(header[:4], "big"), header[4:8]
+        if box_size == 1: # Dimensione a 64 bit subito dopo l'intestazione
+            large = f.read(8)
+            if len(large) < 8: return f"box troncato all'offset {offset}"
+            box_size = int.from_bytes(large, "big")
+        elif box_size == 0: # Il box prosegue fino alla fine del file
+            box_size = size - offset
+        if box_size < 8: return f"box '{box_type.decode('latin-1')}' non valido all'offset {offset}"
+        if offset + box_size > size:
+            return f"file troncato: il box '{box_type.decode('latin-1')}' richiede {offset + box_size - size} byte in più"
+        boxes.add(box_type)
+        offset += box_size
+    else:
+        return "troppi box di primo livello"
+    missing = [name for name in (b"moov", b"mdat") if name not in boxes]
+    if missing: return f"box mancanti: {', '.join(m.decode() for m in missing)}"
+    return None
+
+
+def _read_vint(f, strip_marker: bool = True):
+    """Intero a lunghezza variabile EBML. Restituisce (valore, lunghezza, tutti_bit_a_1)."""
+    first = f.read(1)
+    if not first: return None, 0, False
+    first = first[0]
+    length = 1
+    while length <= 8 and not first & (0x80 >> (length - 1)): length += 1
+    if length > 8: return None, 0, False
+    value = first & ((0x80 >> (length - 1)) - 1) if strip_marker else first
+    rest = f.read(length - 1)
+    if len(rest) < length - 1: return None, 0, False
+    for byte in rest: value = (value << 8) | byte
+    unknown = value == (1 << (7 * length)) - 1
+    return value, length, unknown
+
+
+def _check_matroska(f, size: int):
+    f.seek(4)
+    header_size, length, _ = _read_vint(f)
+    if header_size is None: return "intestazione EBML troncata"
+    segment_offset = 4 + length + header_size
+    if segment_offset + 5 > size: return "file troncato dopo l'intestazione EBML"
+    f.seek(segment_offset)
+    if f.read(4) != _MKV_SEGMENT_ID: return "elemento Segment mancante"
+    segment_size, length, unknown = _read_vint(f)
+    if segment_size is None: return "dimensione del Segment troncata"
+    if unknown: return None # Segment a dimensione ignota (scrittura in streaming): non verificabile
+    missing = segment_offset + 4 + length + segment_size - size
+    if missing > 0: return f"file troncato: mancano {missing} byte al Segment"
+    return None
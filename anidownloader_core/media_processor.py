@@ -1,100 +1,239 @@
 import os
 import re
 import subprocess
-import sys
 import shutil
 import time
-import logging
 from pathlib import Path
 
-def _log_critical_error(log_file_path, message):
-    handler = logging.FileHandler(log_file_path)
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    logger = logging.getLogger(str(log_file_path))
-    logger.setLevel(logging.ERROR)
-    if not logger.handlers:
-        logger.addHandler(handler)
-    logger.error(message)
-    handler.close()
-    logger.removeHandler(handler)
-
-def download_episode(task: dict, status_updater, stop_event, log_file_path: Path):
+from anidownloader_core.metrics import HISTORY_DB_NAME, TaskMetrics, parse_size
+from anidownloader_core.profiling import profile_section
+from anidownloader_core.process_registry import ProcessRegistry
+from anidownloader_core.log_service import configure_worker_logging, task_logger
+from anidownloader_core.eta import PHASE_DOWNLOAD, PHASE_ENCODE, PHASE_DONE, download_host, encode_profile
+from anidownloader_core.content_index import ContentIndex, file_fingerprint, probe_remote
+from anidownloader_core.media_integrity import verify_download
+from anidownloader_core.host_profiles import HostProfiles
+from anidownloader_config.defaults import DEFAULT_ENCODER_SETTINGS
+
+def _report_progress(status_updater, name: str, data: dict):
+    # Dati di avanzamento strutturati per la stima dei tempi (ETA); non tutti gli updater li gestiscono
+    if hasattr(status_updater, 'report_progress'):
+        status_updater.report_progress(name, data)
+
+# Tentativi di download quando il file scaricato non supera la verifica di integrità
+DOWNLOAD_ATTEMPTS = 3
+
+def download_episode(task: dict, status_updater, stop_event, log_file_path: Path, metrics: TaskMetrics = None):
+    """
+    Scarica l'episodio con aria2c e verifica subito il file (dimensione rispetto al Content-Length,
+    struttura MP4/Matroska, vedi media_integrity.py). Se la verifica fallisce il download riparte
+    prima di occupare uno slot di conversione: un file troncato viene completato (aria2c -c),
+    uno corrotto riscaricato da capo.
+
+    Con più fonti (task["mirrors"], vedi planning_service.merge_source_tasks) gli URL con la stessa
+    dimensione dell'URL principale sono lo stesso file: aria2c li riceve insieme e ne scarica segmenti
+    in parallelo, passando agli altri se uno fallisce. Gli URL con dimensione diversa (altra codifica)
+    restano fonti di riserva, usate una alla volta se il download dal gruppo precedente fallisce.
+
+    Fonti e connessioni per server (aria2c -x) seguono il profilo di ogni host (host_profiles.py):
+    prima la fonte più veloce nello storico, con il numero di connessioni che su quell'host ha reso
+    di più. Una parte dei download (EXPLORATION_RATE) prova un'altra scelta, così il profilo si aggiorna.
+    """
     name = task["series"]["name"]
     path = task["series"]["path"]
-    download_url = task["download_url"]
     final_ep_number = task["final_ep_number"]
     final_filename = task["final_filename"]
+    log = task_logger(task)
     
     status_updater.update_progress(name, f"Download Ep. {final_ep_number}")
     output_file_path = Path(path) / final_filename
     
-    cmd = ["aria2c", "-x", "16", "-s", "16", "--summary-interval=1", "-o", str(output_file_path.name), download_url]
-    
     start_time = time.time()
-    creationflags = subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
-    process = subprocess.Popen(cmd, cwd=path, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, creationflags=creationflags)
+    profiles = HostProfiles.from_history(Path(log_file_path).parent / HISTORY_DB_NAME)
+    explore = profiles.explore()
+    groups = _source_groups(task, profiles, explore)
+    for position, (urls, expected_size) in enumerate(groups):
+        group_start = time.time()
+        connections = profiles.connections(download_host(urls[0]), explore)
+        try:
+            peak_speed = _download_verified(task, urls, connections, expected_size, output_file_path, status_updater, stop_event, metrics, log)
+        except Exception as e:
+            if metrics is not None:
+                metrics.add_stage("source", time.time() - group_start, host=download_host(urls[0]), urls=len(urls), connections=connections,
+                                  explored=explore, ok=False, error=str(e)[:200])
+            if stop_event.is_set() or position == len(groups) - 1: raise
+            log.warning(f"Download da {download_host(urls[0])} fallito, si passa alla fonte successiva: {e}")
+            if metrics is not None: metrics.incr("source_failovers")
+            output_file_path.unlink(missing_ok=True)
+            output_file_path.with_name(output_file_path.name + ".aria2").unlink(missing_ok=True)
+            status_updater.update_progress(name, f"Download Ep. {final_ep_number} - fonte alternativa")
+            continue
+        if metrics is not None:
+            metrics.add_stage("source", time.time() - group_start, host=download_host(urls[0]), urls=len(urls), connections=connections,
+                              explored=explore, ok=True, bytes=output_file_path.stat().st_size)
+        break
+
+    download_time = time.time() - start_time
+    if metrics is not None:
+        size = output_file_path.stat().st_size if output_file_path.exists() else 0
+        metrics.add_stage("download", download_time, host=download_host(urls[0]), bytes=size, mean_speed=size / download_time if download_time else 0.0,
+                          peak_speed=peak_speed, connections=connections, urls=len(urls))
+    return str(output_file_path), download_time
+
+def _source_groups(task: dict, profiles: HostProfiles, explore: bool) -> list:
+    """
+    Gruppi di URL da provare in ordine, come coppie (urls, dimensione attesa). Un gruppo contiene l'URL
+    principale e i mirror con la sua stessa dimensione (HEAD); ogni altro mirror è un gruppo a sé.
+    Gli URL di un gruppo e i gruppi sono ordinati dall'host più veloce atteso (vedi HostProfiles.rank).
+    """
+    expected_size = task.get("expected_size")
+    primary, fallbacks = [task["download_url"]], []
+    for url in task.get("mirrors") or []:
+        size, _ = probe_remote(url, set())
+        if expected_size and size == expected_size: primary.append(url)
+        else: fallbacks.append(([url], size))
+    groups = [([primary[i] for i in profiles.rank([download_host(u) for u in primary], explore)], expected_size)] + fallbacks
+    return [groups[i] for i in profiles.rank([download_host(urls[0]) for urls, _ in groups], explore)]
+
+def _download_verified(task: dict, urls: list, connections: int, expected_size, output_file_path: Path, status_updater, stop_event, metrics: TaskMetrics, log) -> float:
+    """Scarica da 'urls' con aria2c e verifica il file, riprovando fino a DOWNLOAD_ATTEMPTS volte. Restituisce la velocità di picco."""
+    name, final_ep_number = task["series"]["name"], task["final_ep_number"]
+    peak_speed, resume = 0.0, False
+    for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+        if metrics is not None and attempt > 1: metrics.incr("download_retries")
+        peak_speed = max(peak_speed, _run_aria2c(task, urls, connections, output_file_path, resume, status_updater, stop_event, log))
+        check_start = time.time()
+        problem = verify_download(output_file_path, expected_size)
+        if metrics is not None:
+            metrics.add_stage("integrity", time.time() - check_start, attempt=attempt, ok=problem is None, **({"problem": problem} if problem else {}))
+        if problem is None: return peak_speed
+
+        log.warning(f"Download non valido (tentativo {attempt}): {problem}")
+        if metrics is not None: metrics.incr("integrity_failures")
+        if attempt == DOWNLOAD_ATTEMPTS:
+            raise Exception(f"File scaricato non valido dopo {DOWNLOAD_ATTEMPTS} tentativi: {problem}")
+        # Più corto del previsto: si scarica solo la parte mancante; altrimenti si riparte da zero
+        resume = bool(expected_size) and output_file_path.exists() and output_file_path.stat().st_size < expected_size
+        if not resume:
+            output_file_path.unlink(missing_ok=True)
+            output_file_path.with_name(output_file_path.name + ".aria2").unlink(missing_ok=True)
+        status_updater.update_progress(name, f"Download Ep. {final_ep_number} - file non valido, {'completamento' if resume else 'nuovo download'}")
+
+def _run_aria2c(task: dict, urls: list, connections: int, output_file_path: Path, resume: bool, status_updater, stop_event, log) -> float:
+    """
+    Esegue aria2c e restituisce la velocità di picco. Con resume riprende il file esistente.
+    Più URL sono mirror dello stesso file: aria2c ne scarica segmenti diversi in parallelo,
+    con al più 'connections' connessioni per server.
+    """
+    name = task["series"]["name"]
+    download_url = urls[0]
+    final_ep_number = task["final_ep_number"]
+    cmd = ["aria2c", "-x", str(connections), "-s", str(connections * len(urls)), "--summary-interval=1", "-o", str(output_file_path.name), *urls]
+    if resume: cmd.insert(1, "-c")
+    
+    peak_speed = 0.0
+    host = download_host(download_url)
+    registry = ProcessRegistry(task.get("process_registry"))
+    process = registry.popen(cmd, cwd=output_file_path.parent, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
     
     try:
         while not stop_event.is_set():
             line = process.stdout.readline()
             if not line: break
+            speed = None
+            if match_speed := re.search(r'DL:([\d.]+)([KMGT]?)i?B', line):
+                speed = parse_size(*match_speed.groups())
+                peak_speed = max(peak_speed, speed)
             if match := re.search(r'\((\d+)%\)', line):
                 status_updater.update_progress(name, f"Download Ep. {final_ep_number} - {match.group(1)}%")
+            if match_sizes := re.search(r'([\d.]+)([KMGT]?)i?B/([\d.]+)([KMGT]?)i?B', line):
+                done_value, done_unit, total_value, total_unit = match_sizes.groups()
+                _report_progress(status_updater, name, {"phase": PHASE_DOWNLOAD, "host": host, "bytes_done": parse_size(done_value, done_unit),
+                                                        "bytes_total": parse_size(total_value, total_unit), "speed": speed})
         
         if stop_event.is_set(): process.kill(); raise Exception("Download interrotto.")
             
     except Exception as e:
-        process.kill()
-        _log_critical_error(log_file_path, f"{name}: Errore durante il download: {e}")
+        process.kill(); process.wait(); registry.release(process)
+        log.error(f"Errore durante il download: {e}")
         raise Exception(f"Errore durante il download: {e}")
         
-    process.wait()
+    process.wait(); registry.release(process)
     if process.returncode != 0:
-        _log_critical_error(log_file_path, f"{name}: aria2c ha fallito con codice {process.returncode}")
+        log.error(f"aria2c ha fallito con codice {process.returncode}")
         raise Exception("aria2c ha fallito.")
-        
-    return str(output_file_path), time.time() - start_time
+    return peak_speed
+
+def build_encode_command(input_path: Path, output_path: Path, encoder: dict = None) -> list:
+    """Comando ffmpeg della conversione H.265. Le chiavi mancanti in 'encoder' usano DEFAULT_ENCODER_SETTINGS."""
+    settings = {**DEFAULT_ENCODER_SETTINGS, **(encoder or {})}
+    return ["ffmpeg", "-y", "-i", str(input_path), "-c:v", "libx265", "-crf", str(settings["crf"]), "-preset", str(settings["preset"]),
+            "-threads", str(settings["threads"]), "-x265-params", "hist-scenecut=1", "-c:a", "copy", str(output_path)]
 
-def convert_and_verify_episode(file_path: str, name: str, output_dir: Path, status_updater, stop_event, log_file_path: Path, max_retries=3):
+def convert_and_verify_episode(file_path: str, name: str, output_dir: Path, status_updater, stop_event, log_file_path: Path, max_retries=3, metrics: TaskMetrics = None, encoder: dict = None, process_registry: str = None, log=None):
+    registry = ProcessRegistry(process_registry)
+    log = log or task_logger({"series": {"name": name}})
     output_dir_path = Path(output_dir)
     input_file_path = Path(file_path)
     output_dir_path.mkdir(parents=True, exist_ok=True)
     output_path = output_dir_path / input_file_path.name
+    profile = encode_profile(encoder)
     
     for attempt in range(1, max_retries + 1):
         if stop_event.is_set(): raise Exception("Conversione interrotta.")
             
         status_updater.update_progress(name, f"Conversione - tentativo {attempt}")
         start_time = time.time()
+        if metrics is not None and attempt > 1: metrics.incr("encode_retries")
         
         try:
-            cmd = ["ffmpeg", "-y", "-i", str(input_file_path), "-c:v", "libx265", "-crf", "23", "-preset", "veryfast", "-threads", "12", "-x265-params", "hist-scenecut=1", "-c:a", "copy", str(output_path)]
-            creationflags = subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
-            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, creationflags=creationflags)
+            cmd = build_encode_command(input_file_path, output_path, encoder)
+            proc = registry.popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
             
             total_duration = None
+            fps, speed_ratio, frames = None, None, 0 # ffmpeg riporta medie cumulative: conta l'ultimo valore
             while not stop_event.is_set():
                 line = proc.stdout.readline()
                 if not line: break
+                if match_fps := re.search(r'fps=\s*([\d.]+)', line):
+                    fps = float(match_fps.group(1))
+                if match_frame := re.search(r'frame=\s*(\d+)', line):
+                    frames = int(match_frame.group(1))
+                if match_speed := re.search(r'speed=\s*([\d.]+)x', line):
+                    speed_ratio = float(match_speed.group(1))
                 if total_duration is None:
                     if match_dur := re.search(r'Duration: (\d+):(\d+):(\d+).(\d+)', line):
                         h, m, s, ms = map(int, match_dur.groups()); total_duration = h * 3600 + m * 60 + s + ms / 100
                 if total_duration and (match_time := re.search(r'time=(\d+):(\d+):(\d+).(\d+)', line)):
-                    h, m, s, ms = map(int, match_time.groups()); percent = min(100, int(((h * 3600 + m * 60 + s + ms / 100) / total_duration) * 100)); status_updater.update_progress(name, f"Conversione - {percent}%")
+                    h, m, s, ms = map(int, match_time.groups()); media_done = h * 3600 + m * 60 + s + ms / 100
+                    percent = min(100, int((media_done / total_duration) * 100)); status_updater.update_progress(name, f"Conversione - {percent}%")
+                    _report_progress(status_updater, name, {"phase": PHASE_ENCODE, "profile": profile, "media_seconds": total_duration,
+                                                            "media_done": media_done, "speed_ratio": speed_ratio, "fps": fps})
             
-            if stop_event.is_set(): proc.kill(); raise Exception("Conversione interrotta.")
+            if stop_event.is_set(): proc.kill(); proc.wait(); registry.release(proc); raise Exception("Conversione interrotta.")
                 
-            proc.wait()
+            proc.wait(); registry.release(proc)
+            encode_time = time.time() - start_time
+            if not fps and frames and encode_time: fps = round(frames / encode_time, 2) # Conversioni brevi: ffmpeg riporta fps=0.0
+            if metrics is not None:
+                metrics.add_stage("encode", encode_time, attempt=attempt, profile=profile,
+                                  fps=fps, speed_ratio=speed_ratio, frames=frames,
+                                  input_bytes=input_file_path.stat().st_size,
+                                  output_bytes=output_path.stat().st_size if output_path.exists() else 0)
             
             log_file = output_path.with_suffix(output_path.suffix + ".log")
+            verify_start = time.time()
             with open(log_file, "w") as log_f:
-                subprocess.run(["ffmpeg", "-y", "-v", "error", "-i", str(output_path), "-f", "null", "-"], stderr=log_f)
+                registry.run(["ffmpeg", "-y", "-v", "error", "-i", str(output_path), "-f", "null", "-"], stderr=log_f)
+            verified = log_file.stat().st_size == 0
+            if metrics is not None: metrics.add_stage("verify", time.time() - verify_start, ok=verified)
             
-            if log_file.stat().st_size == 0:
+            if verified:
+                move_start = time.time()
                 log_file.unlink()
                 input_file_path.unlink()
                 shutil.move(str(output_path), str(input_file_path))
+                if metrics is not None: metrics.add_stage("move", time.time() - move_start)
                 return True, time.time() - start_time
             else:
                 output_path.unlink()
@@ -102,21 +241,93 @@ def convert_and_verify_episode(file_path: str, name: str, output_dir: Path, stat
                 continue
                 
         except Exception as e:
-            _log_critical_error(log_file_path, f"{name}: Errore durante la conversione (tentativo {attempt}): {e}")
+            log.error(f"Errore durante la conversione (tentativo {attempt}): {e}")
             continue
             
-    _log_critical_error(log_file_path, f"{name}: Conversione fallita dopo {max_retries} tentativi.")
+    log.error(f"Conversione fallita dopo {max_retries} tentativi.")
+    if metrics is not None: metrics.incr("encode_failures")
     raise Exception("Errore conversione dopo vari tentativi.")
 
-def process_series_task(task: dict, output_dir: Path, log_file_path: Path, status_updater, stop_event, convert_to_h265: bool):
+def _convert_remotely(task: dict, episode_path: str, status_updater, stop_event, log_file_path: Path, metrics: TaskMetrics, encoder: dict, log):
+    """
+    Converte su un agente remoto se ce ne sono di configurati e uno risulta più rapido della macchina locale.
+    Restituisce il tempo di conversione, o None per convertire in locale (anche se l'agente fallisce).
+    """
+    if not task.get("encode_targets"): return None
+    from anidownloader_core.remote_encode import RemoteEncodeError, choose_encode_target
+    remote = choose_encode_target(task["encode_targets"], encoder, task.get("process_registry"), Path(log_file_path).parent)
+    if remote is None: return None
+    try:
+        conversion_time = remote.encode(episode_path, task["series"]["name"], status_updater, stop_event, metrics=metrics, encoder=encoder)
+        metrics.incr("remote_encodes")
+        return conversion_time
+    except RemoteEncodeError as e:
+        if stop_event.is_set(): raise Exception("Conversione interrotta.")
+        log.warning(f"Conversione remota fallita, si prosegue in locale: {e}")
+        metrics.incr("remote_encode_failures")
+        return None
+
+def _find_duplicate(task: dict, index: ContentIndex, metrics: TaskMetrics):
+    """
+    Prima del download: impronta del file remoto (HEAD + primo e ultimo blocco con Range) confrontata
+    con i video già presenti nella cartella della serie. Le richieste Range partono solo se un file
+    locale ha esattamente la stessa dimensione. Restituisce il nome del file già presente, o None.
+    Il Content-Length della HEAD resta in task["expected_size"] per la verifica del download.
+    """
+    start = time.time()
+    task["expected_size"], fp = probe_remote(task["download_url"], index.sizes())
+    duplicate_of = index.find(fp) if fp else None
+    metrics.add_stage("dedupe", time.time() - start, probed=fp is not None, duplicate=duplicate_of is not None)
+    return duplicate_of
+
+def _skip_duplicate(task: dict, index: ContentIndex, duplicate_of: str, status_updater, metrics: TaskMetrics, log) -> dict:
+    name, episode = task["series"]["name"], task["final_ep_number"]
+    # Registrato nell'indice: get_next_episode_num lo conta come presente e non lo ripropone
+    index.record_duplicate(episode, task["download_url"], duplicate_of)
+    index.save()
+    log.warning(f"Ep. {episode} saltato: stesso contenuto di {duplicate_of} ({task['download_url']})")
+    status_updater.update_progress(name, f"⏭️ Ep. {episode} già presente come {duplicate_of}")
+    metrics.incr("duplicates_skipped")
+    _report_progress(status_updater, name, {"phase": PHASE_DONE})
+    return {"name": name, "episode": None, "download_time": 0.0, "conversion_time": 0.0, "error": None,
+            "duplicate_of": duplicate_of, "metrics": metrics.to_dict()}
+
+def process_series_task(task: dict, output_dir: Path, log_file_path: Path, status_updater, stop_event, convert_to_h265: bool, encoder: dict = None):
+    # Eseguito nei processi del Pool: ogni worker salva il proprio profilo, unito poi da profiling.write_report
+    with profile_section(task.get("profile"), "task"):
+        return _process_series_task(task, output_dir, log_file_path, status_updater, stop_event, convert_to_h265, encoder)
+
+def _process_series_task(task: dict, output_dir: Path, log_file_path: Path, status_updater, stop_event, convert_to_h265: bool, encoder: dict = None):
     name = task["series"]["name"]
+    # I record vanno al listener dell'orchestratore: nessun file aperto nel worker
+    configure_worker_logging(task.get("log_queue"), log_file_path)
+    log = task_logger(task)
     episode_path, download_time, conversion_time = None, 0.0, 0.0
+    metrics = TaskMetrics(name, task.get("final_ep_number"))
+    if task.get("queued_at"):
+        metrics.add_stage("queue_wait", time.time() - task["queued_at"])
 
     try:
-        episode_path, download_time = download_episode(task, status_updater, stop_event, log_file_path)
-        print(f"{episode_path})")
+        index = ContentIndex(task["series"]["path"]).refresh()
+        duplicate_of = _find_duplicate(task, index, metrics)
+        if duplicate_of:
+            return _skip_duplicate(task, index, duplicate_of, status_updater, metrics, log)
+
+        episode_path, download_time = download_episode(task, status_updater, stop_event, log_file_path, metrics=metrics)
+        log.info(f"Download completato in {download_time:.1f}s: {episode_path}")
+        # Server senza Range: il duplicato si riconosce solo a download finito, ma si evita la conversione
+        fp = file_fingerprint(Path(episode_path))
+        duplicate_of = index.find(fp, exclude=task["final_filename"])
+        if duplicate_of and index.same_content(duplicate_of, Path(episode_path), fp):
+            os.remove(episode_path)
+            return _skip_duplicate(task, index, duplicate_of, status_updater, metrics, log)
+        index.record_download(task["final_filename"], task.get("final_ep_number")); index.save()
         if convert_to_h265:
-            _, conversion_time = convert_and_verify_episode(episode_path, name, output_dir, status_updater, stop_event, log_file_path)
+            conversion_time = _convert_remotely(task, episode_path, status_updater, stop_event, log_file_path, metrics, encoder, log)
+            if conversion_time is None:
+                _, conversion_time = convert_and_verify_episode(episode_path, name, output_dir, status_updater, stop_event, log_file_path,
+                                                                metrics=metrics, encoder=encoder, process_registry=task.get("process_registry"), log=log)
+            log.info(f"Conversione completata in {conversion_time:.1f}s")
         
         # --- MODIFICA CHIAVE ---
         # Comunica il successo alla GUI, se possibile, senza rompere la CLI.
@@ -127,10 +338,13 @@ def process_series_task(task: dict, output_dir: Path, log_file_path: Path, statu
             status_updater.report_finished(name, str(final_filepath), download_time, conversion_time)
         # --- FINE MODIFICA ---
         
-        return {"name": name, "episode": episode_path, "download_time": download_time, "conversion_time": conversion_time, "error": None}
+        _report_progress(status_updater, name, {"phase": PHASE_DONE})
+        return {"name": name, "episode": episode_path, "download_time": download_time, "conversion_time": conversion_time, "error": None, "metrics": metrics.to_dict()}
 
     except Exception as e:
         if not stop_event.is_set():
             status_updater.report_error(name, str(e))
-        _log_critical_error(log_file_path, f"{name}: {str(e)}")
-        return {"name": name, "episode": episode_path, "download_time": download_time, "conversion_time": conversion_time, "error": str(e)}
\ No newline at end of file
+        log.error(str(e))
+        metrics.incr("task_failures")
+        _report_progress(status_updater, name, {"phase": PHASE_DONE})
+        return {"name": name, "episode": episode_path, "download_time": download_time, "conversion_time": conversion_time, "error": str(e), "metrics": metrics.to_dict()}
\ No newline at end of file
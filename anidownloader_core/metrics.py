@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+from contextlib import contextmanager
+from pathlib import Path
+
+METRICS_JSONL_NAME = "metrics.jsonl"
+PROMETHEUS_FILE_NAME = "anidownloader.prom"
+HISTORY_DB_NAME = "history.db"
+# Le ultime misure di una serie restano nel textfile (e nello stato) finché la serie viene elaborata almeno una volta in questo periodo
+SERIES_GAUGE_RETENTION = 30 * 24 * 60 * 60
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(value: str, unit: str = "") -> float:
+    """Converte valori come ('12.5', 'Mi') o ('300', 'K') in byte."""
+    return float(value) * _SIZE_UNITS.get(unit[:1].upper(), 1)
+
+
+class TaskMetrics:
+    """
+    Tempi e contatori di un singolo task (serie/episodio), raccolti nel processo worker.
+    Viene restituito al processo principale come dict (to_dict) insieme al risultato del task.
+    """
+    def __init__(self, series_name: str, episode: int = None):
+        self.series_name = series_name
+        self.episode = episode
+        self.stages = []
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name: str, **fields):
+        """Misura la durata di una fase. I campi aggiunti a 'fields' dentro il blocco vengono salvati."""
+        start = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            self.add_stage(name, time.perf_counter() - start, **fields)
+
+    def add_stage(self, name: str, duration: float, **fields):
+        self.stages.append({"stage": name, "duration": round(duration, 4), **fields})
+
+    def incr(self, counter: str, amount: int = 1):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def to_dict(self) -> dict:
+        return {"series": self.series_name, "episode": self.episode, "stages": self.stages, "counters": self.counters}
+
+    @staticmethod
+    def merge(*metrics_dicts) -> dict:
+        """Unisce più dict di metriche dello stesso task (es. pianificazione + elaborazione)."""
+        merged = {"series": None, "episode": None, "stages": [], "counters": {}}
+        for m in metrics_dicts:
+            if not m: continue
+            merged["series"] = merged["series"] or m.get("series")
+            merged["episode"] = merged["episode"] or m.get("episode")
+            merged["stages"].extend(m.get("stages", []))
+            for k, v in m.get("counters", {}).items():
+                merged["counters"][k] = merged["counters"].get(k, 0) + v
+        return merged
+
+
+class MetricsSink:
+    """
+    Scrive le metriche di un'esecuzione nel processo principale:
+    - JSON lines in <log_dir>/metrics.jsonl (una riga per fase, più un riepilogo dell'esecuzione);
+    - un file per il textfile collector di node_exporter con contatori cumulativi, scritto in modo atomico;
+    - lo storico SQLite delle esecuzioni (run_history.RunHistory), interrogabile con 'AniDownloader.py history'.
+    I totali cumulativi sono conservati in un file di stato accanto al file Prometheus.
+    """
+    def __init__(self, log_dir: Path, textfile_path: Path = None, history_db_path: Path = None, history_detail_days: int = None):
+        self._jsonl_path = Path(log_dir) / METRICS_JSONL_NAME
+        self._history_db_path = Path(history_db_path) if history_db_path else Path(log_dir) / HISTORY_DB_NAME
+        self._history_detail_days = history_detail_days
+        self._textfile_path = Path(textfile_path) if textfile_path else Path(log_dir) / PROMETHEUS_FILE_NAME
+        self._state_path = self._textfile_path.with_name(self._textfile_path.stem + "_state.json")
+        self._lock_path = self._state_path.with_name(self._state_path.name + ".lock")
+
+    def record_run(self, planned_tasks: list, results: list, started_at: float, finished_at: float = None, mode: str = "cli"):
+        finished_at = time.time() if finished_at is None else finished_at
+        run_id = uuid.uuid4().hex[:12]
+        host = socket.gethostname()
+
+        # Le metriche di pianificazione sono nel task, quelle di elaborazione nel risultato: unisci per nome
+        result_metrics = {r["name"]: r.get("metrics") for r in results if r}
+        task_metrics = [TaskMetrics.merge(t.get("metrics"), result_metrics.get(t["series"]["name"])) for t in planned_tasks]
+
+        lines = []
+        for m in task_metrics:
+            for stage in m["stages"]:
+                lines.append({"ts": finished_at, "run_id": run_id, "host": host, "series": m["series"], "episode": m["episode"], **stage})
+        counters = {}
+        for m in task_metrics:
+            for k, v in m["counters"].items(): counters[k] = counters.get(k, 0) + v
+        summary = {
+            "ts": finished_at, "run_id": run_id, "host": host, "mode": mode, "stage": "run",
+            "duration": round(finished_at - started_at, 4),
+            "series_planned": len(planned_tasks),
+            "tasks_ok": sum(1 for r in results if r and not r.get("error")),
+            "tasks_failed": sum(1 for r in results if r and r.get("error")),
+            "counters": counters
+        }
+        lines.append(summary)
+
+        self._jsonl_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self._jsonl_path, 'a', encoding='utf-8') as f:
+            for line in lines:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+        self._write_prometheus(task_metrics, summary)
+        self._write_history(planned_tasks, results, started_at, finished_at, mode, run_id)
+        return run_id
+
+    def _write_history(self, planned_tasks: list, results: list, started_at: float, finished_at: float, mode: str, run_id: str):
+        from anidownloader_core.run_history import RunHistory, DEFAULT_DETAIL_DAYS
+        history = RunHistory(self._history_db_path, self._history_detail_days or DEFAULT_DETAIL_DAYS)
+        try: history.record_run(planned_tasks, results, started_at, finished_at, mode=mode, run_id=run_id)
+        finally: history.close()
+
+    # --- Prometheus textfile ---
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self._state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"stage_sum": {}, "stage_count": {}, "counters": {}, "download_bytes": 0, "tasks": {"ok": 0, "error": 0}, "runs": 0}
+
+    def _write_prometheus(self, task_metrics: list, summary: dict):
+        # Lettura, aggiornamento e scrittura dello stato sotto lock: GUI, CLI e demone possono finire insieme
+        with _file_lock(self._lock_path):
+            self._update_prometheus(task_metrics, summary)
+
+    def _update_prometheus(self, task_metrics: list, summary: dict):
+        state = self._load_state()
+        state["runs"] += 1
+        state["tasks"]["ok"] += summary["tasks_ok"]
+        state["tasks"]["error"] += summary["tasks_failed"]
+        for k, v in summary["counters"].items():
+            state["counters"][k] = state["counters"].get(k, 0) + v
+
+        # Ultime misure per serie conservate nello stato: con la pianificazione adattiva ogni esecuzione
+        # tocca poche serie, e le altre non devono sparire dal textfile (serie Prometheus intermittenti)
+        series_state = state.setdefault("series", {})
+        for m in task_metrics:
+            for stage in m["stages"]:
+                name = stage["stage"]
+                state["stage_sum"][name] = state["stage_sum"].get(name, 0) + stage["duration"]
+                state["stage_count"][name] = state["stage_count"].get(name, 0) + 1
+                state["download_bytes"] += stage.get("bytes", 0) if name == "download" else 0
+                entry = series_state.setdefault(str(m["series"]), {"stages": {}})
+                entry["ts"] = summary["ts"]
+                entry["stages"][name] = stage["duration"]
+                if name == "download" and stage.get("mean_speed"): entry["speed"] = [stage["mean_speed"], stage.get("peak_speed", 0)]
+                if name == "encode" and stage.get("fps"): entry["fps"] = stage["fps"]
+        for series in [k for k, entry in series_state.items() if summary["ts"] - entry.get("ts", 0) > SERIES_GAUGE_RETENTION]:
+            del series_state[series]
+
+        out = [
+            "# HELP anidownloader_runs_total Esecuzioni completate.",
+            "# TYPE anidownloader_runs_total counter",
+            f"anidownloader_runs_total {state['runs']}",
+            "# HELP anidownloader_last_run_timestamp_seconds Fine dell'ultima esecuzione.",
+            "# TYPE anidownloader_last_run_timestamp_seconds gauge",
+            f"anidownloader_last_run_timestamp_seconds {summary['ts']:.0f}",
+            "# HELP anidownloader_last_run_duration_seconds Durata dell'ultima esecuzione.",
+            "# TYPE anidownloader_last_run_duration_seconds gauge",
+            f"anidownloader_last_run_duration_seconds {summary['duration']}",
+            "# HELP anidownloader_tasks_total Task di download/conversione per esito.",
+            "# TYPE anidownloader_tasks_total counter",
+        ]
+        out += [f'anidownloader_tasks_total{{result="{k}"}} {v}' for k, v in state["tasks"].items()]
+        out += ["# HELP anidownloader_stage_duration_seconds Tempo speso in ogni fase.", "# TYPE anidownloader_stage_duration_seconds summary"]
+        for name in sorted(state["stage_sum"]):
+            out.append(f'anidownloader_stage_duration_seconds_sum{{stage="{name}"}} {state["stage_sum"][name]:.4f}')
+            out.append(f'anidownloader_stage_duration_seconds_count{{stage="{name}"}} {state["stage_count"][name]}')
+        out += ["# HELP anidownloader_download_bytes_total Byte scaricati.", "# TYPE anidownloader_download_bytes_total counter",
+                f"anidownloader_download_bytes_total {state['download_bytes']}"]
+        out += ["# HELP anidownloader_events_total Contatori di eventi (cache hit, retry, errori...).", "# TYPE anidownloader_events_total counter"]
+        out += [f'anidownloader_events_total{{event="{k}"}} {v}' for k, v in sorted(state["counters"].items())]
+
+        # Le serie per famiglia di metriche: ogni famiglia è un blocco contiguo con il suo HELP/TYPE
+        stage_lines, speed_lines, fps_lines = [], [], []
+        for series, entry in sorted(series_state.items()):
+            label = _escape_label(series)
+            for name, duration in sorted(entry["stages"].items()):
+                stage_lines.append(f'anidownloader_series_last_stage_seconds{{series="{label}",stage="{name}"}} {duration}')
+            if entry.get("speed"):
+                speed_lines.append(f'anidownloader_series_last_download_speed_bytes{{series="{label}",kind="mean"}} {entry["speed"][0]:.0f}')
+                speed_lines.append(f'anidownloader_series_last_download_speed_bytes{{series="{label}",kind="peak"}} {entry["speed"][1]:.0f}')
+            if entry.get("fps"):
+                fps_lines.append(f'anidownloader_series_last_encode_fps{{series="{label}"}} {entry["fps"]}')
+        out += _gauge_family("anidownloader_series_last_stage_seconds", "Durata dell'ultima esecuzione di ogni fase per serie.", stage_lines)
+        out += _gauge_family("anidownloader_series_last_download_speed_bytes", "Velocità media e di picco dell'ultimo download per serie (byte/s).", speed_lines)
+        out += _gauge_family("anidownloader_series_last_encode_fps", "Fotogrammi al secondo dell'ultima conversione per serie.", fps_lines)
+
+        self._textfile_path.parent.mkdir(parents=True, exist_ok=True)
+        _atomic_write(self._state_path, json.dumps(state))
+        _atomic_write(self._textfile_path, "\n".join(out) + "\n")
+
+
+def _gauge_family(name: str, help_text: str, samples: list) -> list:
+    if not samples: return []
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", *samples]
+
+@contextmanager
+def _file_lock(path: Path):
+    """Lock esclusivo e bloccante su un file (flock su POSIX, msvcrt su Windows)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+b") as f:
+        if sys.platform == 'win32':
+            import msvcrt
+            f.seek(0)
+            while True:
+                try: msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1); break
+                except OSError: continue # LK_LOCK rinuncia dopo circa 10 s: si riprova
+            try: yield
+            finally: f.seek(0); msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try: yield
+            finally: fcntl.flock(f, fcntl.LOCK_UN)
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _atomic_write(path: Path, content: str):
+    # node_exporter non deve mai leggere un file scritto a metà
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
@@ -1,45 +1,253 @@
-import importlib
+import os
+import re
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlparse
 
-# Mappa che associa il valore del campo "service" nel JSON al nome della Classe Scraper
-SCRAPER_CLASS_MAP = {
-    'animeW_scraper': 'animeWScraper', 
-    'animeU_scraper': 'animeUScraper'
-    # Esempio per il futuro:
-    # 'altro_sito_scraper': 'AltroSitoScraper' 
-}
+from anidownloader_core.scrapers.registry import COST_BROWSER, get_scraper_cost, get_scraper_instance, clear_instances, is_instance_cached
+from anidownloader_core.metrics import TaskMetrics
+from anidownloader_core.profiling import PROFILE_CPROFILE, profile_section, thread_profile_settings
+from anidownloader_core.lease_store import describe_holder, series_lease_key
 
-def get_scraper_instance(service_name: str):
-    """
-    Carica dinamicamente il modulo dello scraper e restituisce un'istanza della classe.
-    """
-    if service_name not in SCRAPER_CLASS_MAP:
-        raise ValueError(f"Servizio '{service_name}' non riconosciuto. Assicurati che sia definito in SCRAPER_CLASS_MAP.")
-    
-    class_name = SCRAPER_CLASS_MAP[service_name]
-    
-    try:
-        # --- MODIFICA CHIAVE ---
-        # Usiamo un import assoluto, che parte dalla radice del core.
-        module = importlib.import_module(f"anidownloader_core.scrapers.{service_name}")
-        # --- FINE MODIFICA CHIAVE ---
-        
-        ScraperClass = getattr(module, class_name)
-        return ScraperClass()
-    except (ImportError, AttributeError) as e:
-        raise ImportError(f"Impossibile caricare lo scraper '{class_name}' dal modulo '{service_name}': {e}")
+# Dimensioni predefinite degli executor di pianificazione
+DEFAULT_HTTP_WORKERS = 32
+DEFAULT_BROWSER_WORKERS = 2
 
 
 def plan_single_series(series: dict):
     """
     Funzione wrapper che sceglie lo scraper giusto e pianifica una singola serie.
-    Questa è la funzione che verrà chiamata dal Pool di multiprocessing.
+    Il task restituito contiene in "metrics" i tempi di pianificazione (vedi metrics.TaskMetrics).
     """
+    metrics = TaskMetrics(series.get("name"))
+    start = time.perf_counter()
+    task = _plan_with_scraper(series, metrics)
+
+    # Gli scraper possono misurare a parte la risoluzione dell'URL di download finale e indicare
+    # con quale percorso l'hanno ottenuto (es. "http" o "selenium" per animeU_scraper)
+    resolve_time = task.pop("resolve_time", None)
+    resolve_path = task.pop("resolve_path", None)
+    path_field = {"path": resolve_path} if resolve_path else {}
+    if resolve_time is not None: metrics.add_stage("resolve", resolve_time, **path_field)
+    if resolve_path: metrics.incr(f"resolve_{resolve_path}")
+    metrics.add_stage("plan", time.perf_counter() - start, action=task["action"], **path_field)
+    if task["action"] == "process": metrics.episode = task.get("final_ep_number")
+    elif "Errore" in task.get("reason", ""): metrics.incr("plan_errors")
+    task["metrics"] = metrics.to_dict()
+    return task
+
+def _plan_with_scraper(series: dict, metrics: TaskMetrics):
     service = series.get("service")
     if not service:
         return { "series": series, "action": "skip", "reason": "Campo 'service' non specificato nel JSON." }
-    
+
     try:
+        metrics.incr("scraper_cache_hits" if is_instance_cached(service) else "scraper_cache_misses")
         scraper = get_scraper_instance(service)
         return scraper.plan_series_task(series)
     except Exception as e:
-        return { "series": series, "action": "skip", "reason": f"Errore durante la pianificazione: {e}" }
\ No newline at end of file
+        return { "series": series, "action": "skip", "reason": f"Errore durante la pianificazione: {e}" }
+
+
+def source_variants(series: dict) -> list:
+    """
+    Una serie per ogni fonte: quella principale ('service' e 'series_page_url' della serie) seguita dalle
+    fonti alternative elencate in "sources", che possono sovrascrivere anche 'continue' e 'passed_episodes'
+    (la numerazione degli episodi può differire tra un sito e l'altro).
+    """
+    base = {k: v for k, v in series.items() if k != "sources"}
+    variants = [base] if base.get("service") else []
+    for source in series.get("sources") or []:
+        variants.append({**base, **source})
+    return variants
+
+def merge_source_tasks(series: dict, tasks: list) -> dict:
+    """
+    Unisce i task pianificati dalle fonti di una serie. Si elabora l'episodio più basso tra quelli trovati:
+    il primo URL (in ordine di fonte) è quello principale, gli altri per lo stesso episodio vanno in
+    "mirrors" (vedi media_processor.download_episode). Una fonte in errore non blocca le altre; lo skip
+    risulta un errore solo se tutte le fonti falliscono. L'esito di ogni fonte resta in "sources".
+    """
+    outcomes = [{"service": t["series"].get("service"), "host": urlparse(t["series"].get("series_page_url") or "").netloc,
+                 "ok": "Errore" not in t.get("reason", ""), "reason": t.get("reason"), "episode": t.get("final_ep_number")} for t in tasks]
+    ready = [t for t in tasks if t["action"] == "process"]
+    if ready:
+        episode = min(t["final_ep_number"] for t in ready)
+        same = [t for t in ready if t["final_ep_number"] == episode]
+        urls = list(dict.fromkeys(t["download_url"] for t in same))
+        task = {**same[0], "series": series, "download_url": urls[0], "mirrors": urls[1:]}
+    elif any(o["ok"] for o in outcomes):
+        task = {"series": series, "action": "skip", "reason": next(o["reason"] for o in outcomes if o["ok"])}
+    else:
+        task = {"series": series, "action": "skip", "reason": "Errore su tutte le fonti: " + "; ".join(f"{o['service']}: {o['reason']}" for o in outcomes)}
+    task["sources"] = outcomes
+    task["metrics"] = TaskMetrics.merge(*[t.get("metrics") for t in tasks])
+    return task
+
+
+class PlanningExecutors:
+    """
+    Esegue la pianificazione instradando ogni serie in base alla classe di costo dello scraper:
+    gli scraper con browser headless vanno su un executor piccolo e dedicato, quelli HTTP su uno ampio.
+    Un semaforo per host rispetta il 'max_concurrency_per_host' dichiarato dallo scraper.
+
+    Gli scraper usano librerie bloccanti (requests, Selenium), quindi il pool "ampio" è un pool di
+    thread: l'attesa di rete rilascia il GIL e lo stesso processo riusa le istanze in cache.
+    """
+    def __init__(self, http_workers: int = DEFAULT_HTTP_WORKERS, browser_workers: int = DEFAULT_BROWSER_WORKERS):
+        self._http_executor = ThreadPoolExecutor(max_workers=http_workers, thread_name_prefix="plan-http")
+        self._browser_executor = ThreadPoolExecutor(max_workers=browser_workers, thread_name_prefix="plan-browser")
+        self._host_semaphores = {}
+        self._lock = threading.Lock()
+
+    def _host_semaphore(self, series: dict, max_concurrency: int):
+        host = urlparse(series.get("series_page_url") or "").netloc
+        with self._lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(max_concurrency)
+            return self._host_semaphores[host]
+
+    @staticmethod
+    def _claim(series: dict, leases, nodes: list = None):
+        """True se questo nodo prende il lease della serie, altrimenti il task di skip."""
+        key = series_lease_key(series)
+        if leases.claim(key, nodes): return True
+        holder = leases.holder(key)
+        if holder is None: reason = f"Assegnata al nodo {leases.preferred_node(key, nodes or leases.live_nodes())}."
+        elif holder.get("planned_at"): reason = f"Già controllata da un'altra esecuzione ({describe_holder(holder)})."
+        else: reason = f"In carico a un'altra esecuzione ({describe_holder(holder)})."
+        return {"series": series, "action": "skip", "reason": reason}
+
+    def _plan_profiled(self, series: dict, semaphore, profile: dict, leases=None, nodes: list = None):
+        if leases is not None:
+            key = series_lease_key(series)
+            claimed = self._claim(series, leases, nodes)
+            if claimed is not True: return claimed
+        # cProfile vede solo il thread in cui è attivo: ogni pianificazione ha il suo profilo
+        with profile_section(profile, "plan"):
+            if semaphore is None:
+                task = plan_single_series(series)
+            else:
+                with semaphore:
+                    task = plan_single_series(series)
+        # Il lease resta al nodo se c'è un episodio da elaborare (rilasciato a fine esecuzione),
+        # altrimenti resta come "controllata" fino al ttl, così gli altri nodi non ripetono la ricerca
+        if leases is not None and task["action"] != "process": leases.hold(key)
+        return task
+
+    def submit(self, series: dict, profile: dict = None, leases=None, nodes: list = None):
+        """
+        Pianifica una serie in modo asincrono. Restituisce un concurrent.futures.Future.
+        Con 'profile' in modalità cProfile la pianificazione viene profilata (vedi profiling.py).
+        Con 'leases' (LeaseStore condiviso tra più macchine) la serie viene pianificata solo se
+        questo nodo riesce a prenderne il lease; altrimenti il task è uno skip.
+        Una serie con più fonti ("sources") viene pianificata su tutte in parallelo (vedi merge_source_tasks).
+        """
+        profile = thread_profile_settings(profile)
+        if profile is not None and profile.get("mode") != PROFILE_CPROFILE:
+            profile = None # Il campionamento copre già tutti i thread: lo avvia chi chiama
+        if series.get("sources"):
+            return self._submit_sources(series, profile, leases, nodes)
+        return self._submit_single(series, profile, leases, nodes)
+
+    def _submit_single(self, series: dict, profile: dict = None, leases=None, nodes: list = None):
+        service = series.get("service")
+        try:
+            cost = get_scraper_cost(service) if service else None
+        except Exception:
+            cost = None # Servizio sconosciuto: plan_single_series restituirà il motivo dello skip
+
+        if cost is None:
+            return self._http_executor.submit(self._plan_profiled, series, None, profile, leases, nodes)
+
+        executor = self._browser_executor if cost.kind == COST_BROWSER else self._http_executor
+        semaphore = self._host_semaphore(series, cost.max_concurrency_per_host)
+        return executor.submit(self._plan_profiled, series, semaphore, profile, leases, nodes)
+
+    def _submit_sources(self, series: dict, profile: dict = None, leases=None, nodes: list = None):
+        # Il Future complessivo viene completato dalle callback delle singole fonti: nessun thread
+        # dell'executor resta bloccato in attesa di altri task dello stesso executor
+        combined = Future()
+        combined.set_running_or_notify_cancel() # Come i Future degli executor già avviati: non annullabile
+        variants = source_variants(series)
+
+        def plan_variants(claim_future=None):
+            try:
+                if claim_future is not None:
+                    claimed = claim_future.result()
+                    if claimed is not True: combined.set_result(claimed); return
+                futures = [self._submit_single(variant, profile) for variant in variants]
+            except BaseException as e: # Anche CancelledError, se gli executor vengono fermati
+                combined.set_exception(e); return
+            remaining = [len(futures)]
+
+            def on_done(_):
+                with self._lock:
+                    remaining[0] -= 1
+                    if remaining[0]: return
+                try:
+                    task = merge_source_tasks(series, [future.result() for future in futures])
+                    if leases is not None and task["action"] != "process": leases.hold(series_lease_key(series))
+                    combined.set_result(task)
+                except BaseException as e:
+                    combined.set_exception(e)
+            for future in futures: future.add_done_callback(on_done)
+
+        if leases is None: plan_variants()
+        else: self._http_executor.submit(self._claim, series, leases, nodes).add_done_callback(plan_variants)
+        return combined
+
+    def submit_all(self, series_list: list, profile: dict = None, leases=None) -> list:
+        if leases is None:
+            return [self.submit(series, profile) for series in series_list]
+        # Un solo elenco dei nodi attivi per tutta la pianificazione: ogni serie ha lo stesso nodo preferito
+        nodes = leases.live_nodes()
+        return [self.submit(series, profile, leases, nodes) for series in series_list]
+
+    def plan(self, series_list: list, profile: dict = None, leases=None) -> list:
+        """Pianifica tutte le serie e restituisce i task nello stesso ordine della lista."""
+        profile = thread_profile_settings(profile)
+        if profile is not None and profile.get("mode") != PROFILE_CPROFILE:
+            with profile_section(profile, "plan"):
+                return [future.result() for future in self.submit_all(series_list, leases=leases)]
+        return [future.result() for future in self.submit_all(series_list, profile, leases)]
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False, close_scrapers: bool = True):
+        """Ferma gli executor. Con close_scrapers chiude anche sessioni HTTP e browser tenuti aperti dagli scraper."""
+        self._http_executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+        self._browser_executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+        if close_scrapers and wait:
+            clear_instances()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown(wait=True, cancel_futures=exc_type is not None)
+        return False
+
+
+def plan_all_series(series_list: list) -> list:
+    """Pianifica tutte le serie con executor temporanei."""
+    with PlanningExecutors() as executors:
+        return executors.plan(series_list)
+
+
+def construct_final_filename(task: dict) -> str:
+    """
+    Calcola il nome finale del file per un task 'process', rinumerando l'episodio
+    (serie in continuazione) e applicando l'eventuale 'filename_root' della serie.
+    """
+    series = task["series"]; download_url = task["download_url"]; final_ep_number = task["final_ep_number"]
+    url_filename = download_url.split("/")[-1].split("?")[0]
+    filename_root = series.get("filename_root")
+    if not filename_root:
+        match = re.match(r'(.*?)_Ep_', url_filename, re.IGNORECASE)
+        filename_root = match.group(1) if match else os.path.splitext(url_filename)[0]
+    suffix_match = re.search(r'(_Ep_.*)', url_filename, re.IGNORECASE)
+    if suffix_match:
+        suffix = suffix_match.group(1)
+        correct_suffix = re.sub(r'(\d+)', f'{final_ep_number:02d}', suffix, 1)
+        return filename_root + correct_suffix
+    return f"{filename_root}_Ep_{final_ep_number:02d}.mp4"
@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import time
+import signal
+import shutil
+import subprocess
+from pathlib import Path
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+PROCESSES_DIR_NAME = "processes"
+# Tempo concesso dopo SIGTERM prima di passare a SIGKILL
+TERMINATE_GRACE_SECONDS = 5.0
+_POLL_SECONDS = 0.05
+_IS_WINDOWS = sys.platform == 'win32'
+
+
+class ProcessRegistry:
+    """
+    Registro dei processi esterni (aria2c, ffmpeg) avviati dai worker. Ogni processo parte in un
+    proprio gruppo (sessione su POSIX) e il suo PID viene scritto come file in registry_dir, così
+    l'orchestratore può fermare esattamente quei gruppi anche se il worker che li ha avviati è
+    bloccato o già terminato, senza toccare altri ffmpeg/aria2c della macchina.
+    Con registry_dir None i processi partono comunque in un gruppo proprio, ma non vengono registrati.
+    """
+    def __init__(self, registry_dir=None):
+        self._dir = Path(registry_dir) if registry_dir else None
+
+    @classmethod
+    def for_run(cls, log_dir: Path):
+        """Registro dell'orchestratore corrente (una cartella per PID, i worker la ricevono nel task)."""
+        return cls(Path(log_dir) / PROCESSES_DIR_NAME / str(os.getpid()))
+
+    @property
+    def path(self):
+        return str(self._dir) if self._dir else None
+
+    def popen(self, cmd: list, **kwargs) -> subprocess.Popen:
+        if _IS_WINDOWS:
+            kwargs["creationflags"] = kwargs.get("creationflags", 0) | subprocess.CREATE_NO_WINDOW | subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs["start_new_session"] = True # Il PID del processo è anche l'ID del suo gruppo
+        proc = subprocess.Popen(cmd, **kwargs)
+        if self._dir is not None:
+            self._dir.mkdir(parents=True, exist_ok=True)
+            (self._dir / str(proc.pid)).write_text(json.dumps({"cmd": Path(cmd[0]).name, "started_at": time.time()}))
+        return proc
+
+    def release(self, proc: subprocess.Popen):
+        """Da chiamare quando il processo è terminato (anche con errore)."""
+        if self._dir is not None:
+            try: (self._dir / str(proc.pid)).unlink()
+            except FileNotFoundError: pass
+
+    def run(self, cmd: list, **kwargs) -> int:
+        """Come subprocess.run, ma con il processo registrato finché è attivo. Restituisce il codice di uscita."""
+        proc = self.popen(cmd, **kwargs)
+        try: return proc.wait()
+        finally: self.release(proc)
+
+    def _entries(self) -> list:
+        if self._dir is None or not self._dir.exists(): return []
+        entries = []
+        for entry in self._dir.iterdir():
+            try: data = json.loads(entry.read_text())
+            except (OSError, ValueError): data = {}
+            if entry.name.isdigit(): entries.append((entry, int(entry.name), data))
+        return entries
+
+    def running(self, cmd: str = None) -> int:
+        """Processi registrati e ancora attivi, eventualmente solo quelli di un comando (es. 'ffmpeg')."""
+        return sum(1 for _, pid, data in self._entries()
+                   if (cmd is None or data.get("cmd", "").split(".")[0] == cmd) and _group_alive(pid))
+
+    def terminate_all(self, grace: float = TERMINATE_GRACE_SECONDS) -> dict:
+        """
+        SIGTERM a tutti i gruppi registrati, poi SIGKILL a quelli ancora vivi allo scadere di 'grace'.
+        Restituisce quanti gruppi sono stati segnalati, quanti forzati con SIGKILL e in quanti secondi.
+        """
+        start = time.monotonic()
+        entries = [(entry, pid) for entry, pid, data in self._entries() if _is_same_process(pid, data.get("started_at"))]
+        for _, pid in entries:
+            _signal_group(pid, signal.SIGTERM)
+        alive = [pid for _, pid in entries if _group_alive(pid)]
+        deadline = start + grace
+        while alive and time.monotonic() < deadline:
+            time.sleep(_POLL_SECONDS)
+            alive = [pid for pid in alive if _group_alive(pid)]
+        for pid in alive:
+            _signal_group(pid, signal.SIGKILL if not _IS_WINDOWS else signal.SIGTERM)
+        for entry, _, _ in self._entries():
+            try: entry.unlink()
+            except FileNotFoundError: pass
+        return {"groups": len(entries), "killed": len(alive), "seconds": time.monotonic() - start}
+
+    def close(self):
+        """Rimuove la cartella del registro a fine esecuzione."""
+        if self._dir is not None: shutil.rmtree(self._dir, ignore_errors=True)
+
+
+def format_shutdown_stats(stats: dict) -> str:
+    forced = f", {stats['killed']} forzati con SIGKILL" if stats["killed"] else ""
+    return f"{stats['groups']} gruppi di processi fermati in {stats['seconds']:.2f}s{forced}"
+
+def _signal_group(pid: int, sig):
+    try:
+        if _IS_WINDOWS: os.kill(pid, signal.SIGTERM) # TerminateProcess: aria2c e ffmpeg non hanno figli
+        else: os.killpg(pid, sig)
+    except (ProcessLookupError, PermissionError, OSError):
+        pass
+
+def _group_alive(pid: int) -> bool:
+    if not _IS_WINDOWS:
+        try: os.killpg(pid, 0)
+        except ProcessLookupError: return False
+        except PermissionError: return True
+    if psutil is None:
+        return not _IS_WINDOWS # Senza psutil su Windows non si può verificare: TerminateProcess è immediato
+    try:
+        # Un processo già terminato ma non ancora raccolto dal worker resta "zombie": conta come fermo
+        return psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
+
+def _is_same_process(pid: int, started_at) -> bool:
+    # Protegge dal riuso dei PID se una voce è rimasta nel registro (es. worker terminato bruscamente)
+    if psutil is None or not started_at: return True
+    try: return psutil.Process(pid).create_time() <= started_at + 1
+    except psutil.NoSuchProcess: return False
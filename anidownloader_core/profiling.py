@@ -0,0 +1,213 @@
+# cProfile e pstats vengono importati solo quando servono: questo modulo è caricato a ogni avvio della CLI
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import threading
+import itertools
+from contextlib import contextmanager
+from pathlib import Path
+
+PROFILE_OFF = "off"
+PROFILE_CPROFILE = "cprofile"   # Deterministico: preciso ma rallenta il codice Python (da usare su richiesta)
+PROFILE_SAMPLING = "sampling"   # Campiona gli stack ~100 volte al secondo: costo trascurabile, si può lasciare attivo
+PROFILE_MODES = (PROFILE_OFF, PROFILE_CPROFILE, PROFILE_SAMPLING)
+
+SAMPLING_INTERVAL = 0.01
+# Cartelle di profili conservate in profiles/: col campionamento sempre attivo (demone, timer) ne nasce una per esecuzione
+KEEP_PROFILE_RUNS = 30
+# Da Python 3.12 cProfile usa sys.monitoring: un solo profiler attivo per processo, quindi i thread
+# di pianificazione non possono avere ciascuno il proprio (resterebbero senza profilo). Lì si campiona.
+CPROFILE_PER_THREAD = sys.version_info < (3, 12)
+REPORT_FILE_NAME = "report.txt"
+_file_counter = itertools.count()
+_enabled_profilers = {}   # id(profiler) -> (pid, profiler), per riconoscere quelli ereditati con fork
+
+
+def profile_settings(mode: str, base_dir: Path):
+    """
+    Impostazioni di profilazione per un'esecuzione, passate a orchestratore, pianificazione e worker
+    (nel task, come "queued_at"). Restituisce None se la profilazione è disattivata.
+    """
+    if mode not in (PROFILE_CPROFILE, PROFILE_SAMPLING):
+        return None
+    prune_profiles(Path(base_dir), KEEP_PROFILE_RUNS - 1)
+    return {"mode": mode, "dir": str(Path(base_dir) / time.strftime("%Y%m%d-%H%M%S"))}
+
+def prune_profiles(base_dir: Path, keep: int):
+    """Rimuove le cartelle di profili più vecchie (nomi AAAAMMGG-HHMMSS), tenendo le 'keep' più recenti."""
+    if not base_dir.is_dir(): return
+    runs = sorted(p for p in base_dir.iterdir() if p.is_dir() and p.name[:8].isdigit())
+    for old in runs[:max(0, len(runs) - keep)]:
+        shutil.rmtree(old, ignore_errors=True)
+
+def thread_profile_settings(settings: dict):
+    """
+    Impostazioni per profilare thread concorrenti (pianificazione): con cProfile da Python 3.12
+    si ripiega sul campionamento, che copre tutti i thread, invece di produrre profili vuoti.
+    """
+    if settings and settings.get("mode") == PROFILE_CPROFILE and not CPROFILE_PER_THREAD:
+        return {**settings, "mode": PROFILE_SAMPLING}
+    return settings
+
+
+class _StackSampler(threading.Thread):
+    """Legge periodicamente gli stack di tutti i thread del processo e conta le funzioni viste."""
+    def __init__(self, interval: float = SAMPLING_INTERVAL):
+        super().__init__(daemon=True, name="profile-sampler")
+        self._interval = interval
+        self._stop_event = threading.Event()
+        self.samples = 0
+        self.self_counts = {}
+        self.cumulative_counts = {}
+
+    def run(self):
+        while not self._stop_event.wait(self._interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident: continue
+                seen = set()
+                key = _frame_key(frame)
+                self.self_counts[key] = self.self_counts.get(key, 0) + 1
+                while frame is not None:
+                    key = _frame_key(frame)
+                    if key not in seen:
+                        seen.add(key)
+                        self.cumulative_counts[key] = self.cumulative_counts.get(key, 0) + 1
+                    frame = frame.f_back
+                self.samples += 1
+
+    def stop(self):
+        self._stop_event.set(); self.join()
+
+    def dump(self, path: Path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"interval": self._interval, "samples": self.samples, "self": self.self_counts, "cumulative": self.cumulative_counts}, f)
+
+def _frame_key(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+@contextmanager
+def profile_section(settings: dict, section: str):
+    """
+    Profila il blocco e salva il risultato in settings["dir"] come <section>.<pid>.<n>.prof|.samples.json.
+    In modalità cProfile viene profilato solo il thread corrente; in modalità a campionamento tutti i thread
+    del processo. Non fa nulla se settings è None.
+    """
+    mode = (settings or {}).get("mode", PROFILE_OFF)
+    if mode == PROFILE_OFF:
+        yield
+        return
+
+    out_dir = Path(settings["dir"])
+    out_dir.mkdir(parents=True, exist_ok=True)
+    base_path = out_dir / f"{section}.{os.getpid()}.{next(_file_counter)}"
+
+    if mode == PROFILE_SAMPLING:
+        sampler = _StackSampler()
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            sampler.dump(Path(f"{base_path}.samples.json"))
+        return
+
+    import cProfile
+    _disable_inherited_profilers()
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        _enabled_profilers[id(profiler)] = (os.getpid(), profiler)
+    except ValueError:
+        # Da Python 3.12 può essere attivo un solo cProfile per processo: il blocco resta non profilato
+        profiler = None
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            _enabled_profilers.pop(id(profiler), None)
+            profiler.dump_stats(f"{base_path}.prof")
+
+def _disable_inherited_profilers():
+    # Un Pool creato mentre l'orchestratore è profilato eredita il profiler attivo nei figli (fork):
+    # va spento, altrimenti rallenta il worker e (da Python 3.12) impedisce di avviarne uno nuovo.
+    for key, (pid, profiler) in list(_enabled_profilers.items()):
+        if pid != os.getpid():
+            try: profiler.disable()
+            except Exception: pass
+            del _enabled_profilers[key]
+
+
+# --- Report unificato ---
+
+def _cprofile_tables(paths: list, top: int) -> str:
+    import pstats
+    out = io.StringIO()
+    stats = pstats.Stats(*[str(p) for p in paths], stream=out)
+    stats.strip_dirs()
+    out.write("Funzioni più costose (tempo proprio):\n")
+    stats.sort_stats("tottime").print_stats(top)
+    out.write("Funzioni più costose (tempo cumulativo):\n")
+    stats.sort_stats("cumulative").print_stats(top)
+    return out.getvalue()
+
+def _sampling_tables(paths: list, top: int) -> str:
+    samples, self_counts, cumulative_counts = 0, {}, {}
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        samples += data["samples"]
+        for key, n in data["self"].items(): self_counts[key] = self_counts.get(key, 0) + n
+        for key, n in data["cumulative"].items(): cumulative_counts[key] = cumulative_counts.get(key, 0) + n
+    if not samples:
+        return "Nessun campione raccolto.\n"
+
+    lines = [f"{samples} campioni (stack di thread), intervallo {SAMPLING_INTERVAL * 1000:.0f} ms."]
+    for title, counts in (("Funzioni più frequenti in cima allo stack (tempo proprio):", self_counts),
+                          ("Funzioni più frequenti nello stack (tempo cumulativo):", cumulative_counts)):
+        lines += ["", title, f"{'campioni':>9} {'%':>6}  funzione"]
+        for key, n in sorted(counts.items(), key=lambda x: x[1], reverse=True)[:top]:
+            lines.append(f"{n:>9} {100 * n / samples:>5.1f}%  {key}")
+    return "\n".join(lines) + "\n"
+
+def write_report(profile_dir: Path, top: int = 25) -> Path:
+    """
+    Unisce i profili di tutti i processi (orchestratore e worker del Pool) in un unico report testuale,
+    una sezione per fase (plan, orchestrate, task) più il totale. Salva anche merged.prof, apribile
+    con snakeviz o pstats.
+    """
+    profile_dir = Path(profile_dir)
+    prof_files = sorted(profile_dir.glob("*.prof"))
+    prof_files = [p for p in prof_files if p.name != "merged.prof"]
+    sample_files = sorted(profile_dir.glob("*.samples.json"))
+    sections = sorted({p.name.split(".")[0] for p in prof_files + sample_files})
+
+    parts = [f"Report di profilazione: {profile_dir}", f"Processi: {len({p.name.split('.')[1] for p in prof_files + sample_files})}", ""]
+    for section in sections + ["totale"]:
+        section_prof = [p for p in prof_files if section == "totale" or p.name.startswith(f"{section}.")]
+        section_samples = [p for p in sample_files if section == "totale" or p.name.startswith(f"{section}.")]
+        parts.append(f"===== {section} =====")
+        if section_prof: parts.append(_cprofile_tables(section_prof, top))
+        if section_samples: parts.append(_sampling_tables(section_samples, top))
+
+    if prof_files:
+        import pstats
+        pstats.Stats(*[str(p) for p in prof_files]).dump_stats(str(profile_dir / "merged.prof"))
+    report_path = profile_dir / REPORT_FILE_NAME
+    with open(report_path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(parts))
+    return report_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rigenera il report unificato di una cartella di profili.")
+    parser.add_argument("profile_dir", help="Cartella con i file .prof / .samples.json di un'esecuzione.")
+    parser.add_argument("--top", type=int, default=25, help="Righe per tabella.")
+    args = parser.parse_args()
+    print(write_report(Path(args.profile_dir), args.top).read_text(encoding='utf-8'))
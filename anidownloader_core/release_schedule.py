@@ -0,0 +1,171 @@
+import os
+import json
+import time
+from pathlib import Path
+
+MINUTES_PER_WEEK = 7 * 24 * 60
+
+# Valori predefiniti (in secondi, salvo dove indicato)
+DEFAULT_INTERVAL = 15 * 60          # Finché la finestra di uscita non è nota: come il vecchio timer
+DENSE_INTERVAL = 2 * 60             # Dentro la finestra di uscita prevista
+SPARSE_INTERVAL = 6 * 60 * 60       # Fuori dalla finestra
+MAX_BACKOFF = 7 * 24 * 60 * 60      # Limite per le serie concluse
+WINDOW_BEFORE_MINUTES = 15          # Anticipo rispetto all'orario di uscita previsto
+WINDOW_AFTER_MINUTES = 60           # Ritardo minimo tollerato dopo l'orario previsto
+MAX_WINDOW_MINUTES = 12 * 60
+MIN_RELEASES_TO_LEARN = 2
+PENDING_DENSE_ATTEMPTS = 3          # Tentativi al ritmo denso per un episodio che non arriva su disco, poi l'intervallo raddoppia
+MAX_RELEASES_KEPT = 12
+
+
+def _minute_of_week(timestamp: float) -> int:
+    return int(timestamp // 60) % MINUTES_PER_WEEK
+
+def _circular_distance(a: int, b: int) -> int:
+    d = abs(a - b) % MINUTES_PER_WEEK
+    return min(d, MINUTES_PER_WEEK - d)
+
+
+class ReleaseScheduler:
+    """
+    Pianificazione adattiva dei controlli per serie.
+    Registra quando un nuovo episodio viene visto per la prima volta e ne ricava la finestra di uscita
+    settimanale. Vicino alla finestra le serie vengono controllate spesso (DENSE_INTERVAL), altrimenti
+    raramente (SPARSE_INTERVAL). Un episodio pianificato ma non ancora scaricato viene ritentato al ritmo
+    denso, rallentando se continua a fallire. Le serie con "completed": true rallentano in modo esponenziale.
+    Lo stato è salvato in un file JSON condiviso tra CLI, demone e GUI.
+    """
+    def __init__(self, state_path: Path, dense_interval: float = DENSE_INTERVAL, sparse_interval: float = SPARSE_INTERVAL,
+                 default_interval: float = DEFAULT_INTERVAL, max_backoff: float = MAX_BACKOFF):
+        self._state_path = Path(state_path)
+        self._dense_interval = dense_interval
+        self._sparse_interval = sparse_interval
+        self._default_interval = default_interval
+        self._max_backoff = max_backoff
+        self._state = self._load_state()
+
+    # --- Persistenza ---
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self._state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save(self):
+        """Salva lo stato in modo atomico (file temporaneo + rename)."""
+        self._state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._state_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._state, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self._state_path)
+
+    @staticmethod
+    def _series_key(series: dict) -> str:
+        return series.get("path") or series.get("name", "")
+
+    def _series_state(self, series: dict) -> dict:
+        return self._state.setdefault(self._series_key(series), {"releases": [], "latest_episode": None, "last_poll": None, "misses": 0})
+
+    # --- Registrazione dei controlli ---
+
+    def record_poll(self, series: dict, latest_episode: int = None, now: float = None):
+        """
+        Registra un controllo. 'latest_episode' è l'ultimo episodio disponibile sul sito (None se sconosciuto,
+        es. errore di rete). Se è maggiore dell'ultimo noto, l'istante corrente è una nuova uscita.
+        """
+        now = time.time() if now is None else now
+        state = self._series_state(series)
+        state["last_poll"] = now
+        known_latest = state.get("latest_episode")
+
+        if latest_episode is not None and (known_latest is None or latest_episode > known_latest):
+            # Alla prima osservazione non sappiamo quando l'episodio è uscito: memorizza solo il numero
+            if known_latest is not None:
+                state["releases"] = (state["releases"] + [{"episode": latest_episode, "seen_at": now}])[-MAX_RELEASES_KEPT:]
+            state["latest_episode"] = latest_episode
+            state["misses"] = 0
+        else:
+            state["misses"] = state.get("misses", 0) + 1
+
+    def record_plan_results(self, planned_tasks: list, now: float = None):
+        """Registra i risultati di una pianificazione (task con 'latest_available_episode', se presente)."""
+        self._state = self._load_state() # Riparte dallo stato su disco: GUI e CLI possono averlo aggiornato
+        for task in planned_tasks:
+            self.record_poll(task["series"], task.get("latest_available_episode"), now=now)
+            self._track_pending(task)
+        self.save()
+
+    def _track_pending(self, task: dict):
+        # Un episodio pianificato resta "in attesa" finché una pianificazione riuscita non trova più nulla
+        # da scaricare: se download o conversione falliscono la serie resta controllata spesso
+        state = self._series_state(task["series"])
+        if task["action"] == "process":
+            episode = task.get("final_ep_number")
+            state["pending_attempts"] = state.get("pending_attempts", 0) + 1 if state.get("pending_episode") == episode else 1
+            state["pending_episode"] = episode
+        elif task.get("latest_available_episode") is not None:
+            state.pop("pending_episode", None); state.pop("pending_attempts", None)
+
+    # --- Apprendimento della finestra di uscita ---
+
+    def release_window(self, series: dict):
+        """
+        Restituisce (inizio in minuti della settimana, durata in minuti) della finestra di uscita,
+        oppure None se non ci sono abbastanza uscite registrate.
+        """
+        releases = self._state.get(self._series_key(series), {}).get("releases", [])
+        if len(releases) < MIN_RELEASES_TO_LEARN:
+            return None
+        minutes = [_minute_of_week(r["seen_at"]) for r in releases]
+        # Mediana circolare: il valore che minimizza la distanza totale dagli altri
+        expected = min(minutes, key=lambda m: sum(_circular_distance(m, other) for other in minutes))
+        spread = max(_circular_distance(expected, m) for m in minutes)
+        length = min(WINDOW_BEFORE_MINUTES + max(WINDOW_AFTER_MINUTES, 2 * spread), MAX_WINDOW_MINUTES)
+        return (expected - WINDOW_BEFORE_MINUTES) % MINUTES_PER_WEEK, length
+
+    def _released_recently(self, state: dict, now: float) -> bool:
+        releases = state.get("releases", [])
+        return bool(releases) and now - releases[-1]["seen_at"] < 2 * 24 * 60 * 60
+
+    # --- Decisione ---
+
+    def next_poll_at(self, series: dict, now: float = None) -> float:
+        now = time.time() if now is None else now
+        state = self._state.get(self._series_key(series))
+        if not state or state.get("last_poll") is None:
+            return now
+        last_poll = state["last_poll"]
+
+        # Episodio nuovo non ancora su disco (download o conversione falliti): si riprova al ritmo denso,
+        # poi con intervallo doppio a ogni fallimento (al massimo SPARSE_INTERVAL)
+        if state.get("pending_episode") is not None:
+            failures = max(0, state.get("pending_attempts", 1) - PENDING_DENSE_ATTEMPTS)
+            return last_poll + min(self._dense_interval * 2 ** failures, self._sparse_interval)
+
+        if series.get("completed", False):
+            return last_poll + min(self._sparse_interval * (2 ** state.get("misses", 0)), self._max_backoff)
+
+        window = self.release_window(series)
+        if window is None:
+            return last_poll + self._default_interval
+
+        start_minute, length = window
+        minutes_into_window = (_minute_of_week(now) - start_minute) % MINUTES_PER_WEEK
+        if minutes_into_window <= length and not self._released_recently(state, now):
+            return last_poll + self._dense_interval
+
+        # Fuori finestra (o episodio della settimana già visto): controllo raro, ma mai oltre l'inizio della prossima finestra
+        next_window_start = now + ((start_minute - _minute_of_week(now)) % MINUTES_PER_WEEK) * 60
+        if minutes_into_window <= length:
+            return last_poll + self._sparse_interval
+        return min(last_poll + self._sparse_interval, next_window_start)
+
+    def is_due(self, series: dict, now: float = None) -> bool:
+        now = time.time() if now is None else now
+        return self.next_poll_at(series, now) <= now
+
+    def due_series(self, series_list: list, now: float = None) -> list:
+        now = time.time() if now is None else now
+        return [series for series in series_list if self.is_due(series, now)]
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+from pathlib import Path
+
+import requests
+
+from anidownloader_config.defaults import DEFAULT_ENCODER_SETTINGS
+from anidownloader_core.eta import EtaPriors, encode_profile
+from anidownloader_core.metrics import HISTORY_DB_NAME
+from anidownloader_core.process_registry import ProcessRegistry
+
+JOB_HEADER = "X-AniDownloader-Job"
+TOKEN_HEADER = "X-AniDownloader-Token"
+MODE_STREAM = "stream"  # Il file viene inviato all'agente e il risultato riscaricato
+MODE_PATH = "path"      # L'agente legge e sostituisce il file su un percorso condiviso (NFS/SMB)
+STATUS_TIMEOUT = 2
+CONNECT_TIMEOUT = 5
+# Silenzio massimo dell'agente durante un job: invia un keepalive ogni 15 secondi (encode_agent.KEEPALIVE_SECONDS),
+# quindi oltre questo tempo l'agente è considerato irraggiungibile e si converte in locale
+READ_TIMEOUT = 60
+_CHUNK = 1024 * 1024
+
+
+class RemoteEncodeError(Exception):
+    pass
+
+
+def encode_targets(config: dict):
+    """
+    Destinazioni di conversione da passare nel task, lette da config.json:
+      "remote_encoders": [{"url": "http://desktop:8765", "mode": "stream"|"path",
+                           "path_map": {"/srv/anime": "/mnt/anime"}, "token": "..."}],
+      "local_encode_slots": conversioni locali contemporanee (0: automatico).
+    Restituisce None se non ci sono agenti remoti: in quel caso si converte sempre in locale.
+    """
+    remotes = [r for r in (config.get("remote_encoders") or []) if r.get("url")]
+    if not remotes: return None
+    threads = int({**DEFAULT_ENCODER_SETTINGS, **(config.get("encoder") or {})}["threads"])
+    local_slots = int(config.get("local_encode_slots") or 0) or max(1, (os.cpu_count() or 1) // max(1, threads))
+    return {"remote": remotes, "local_slots": local_slots}
+
+
+class RemoteEncoder:
+    """Client di un agente di conversione (anidownloader_core/encode_agent.py)."""
+    def __init__(self, url: str, mode: str = MODE_STREAM, path_map: dict = None, token: str = None):
+        self.url = url.rstrip("/")
+        self.mode = mode
+        self._path_map = path_map or {}
+        self._headers = {TOKEN_HEADER: token} if token else {}
+
+    def status(self):
+        """Stato dell'agente, o None se non raggiungibile."""
+        try:
+            response = requests.get(f"{self.url}/status", headers=self._headers, timeout=STATUS_TIMEOUT)
+            return response.json() if response.ok else None
+        except (requests.RequestException, ValueError):
+            return None
+
+    def _remote_path(self, local_path: Path) -> str:
+        for local_prefix, remote_prefix in self._path_map.items():
+            try: return str(Path(remote_prefix) / local_path.relative_to(local_prefix))
+            except ValueError: continue
+        return str(local_path) # Stesso percorso su entrambe le macchine
+
+    def encode(self, file_path: str, name: str, status_updater, stop_event, metrics=None, encoder: dict = None) -> float:
+        """
+        Converte file_path sull'agente e lo sostituisce con il risultato, come convert_and_verify_episode.
+        Restituisce il tempo totale; solleva RemoteEncodeError se l'agente non è raggiungibile o fallisce.
+        """
+        file_path = Path(file_path)
+        start = time.time()
+        job = {"name": name, "encoder": encoder, "file_name": file_path.name}
+        if self.mode == MODE_PATH: job["source_path"] = self._remote_path(file_path)
+        headers = {**self._headers, JOB_HEADER: json.dumps(job)}
+        status_updater.update_progress(name, f"Conversione remota ({self.url})")
+
+        try:
+            if self.mode == MODE_PATH:
+                response = requests.post(f"{self.url}/jobs", headers=headers, stream=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+            else:
+                with open(file_path, "rb") as f:
+                    headers["Content-Length"] = str(file_path.stat().st_size)
+                    upload_start = time.time()
+                    response = requests.post(f"{self.url}/jobs", data=f, headers=headers, stream=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+                    if metrics is not None:
+                        metrics.add_stage("upload", time.time() - upload_start, bytes=file_path.stat().st_size, remote=self.url)
+            if not response.ok:
+                raise RemoteEncodeError(f"{self.url}: {response.status_code} {response.text[:200]}")
+            result = self._follow(response, name, status_updater, stop_event)
+        except requests.RequestException as e:
+            raise RemoteEncodeError(f"{self.url}: {e}")
+
+        if metrics is not None and result.get("metrics"):
+            for stage in result["metrics"]["stages"]:
+                metrics.add_stage(stage["stage"], stage["duration"], **{k: v for k, v in stage.items() if k not in ("stage", "duration")}, remote=self.url)
+        if not result.get("ok"):
+            raise RemoteEncodeError(f"{self.url}: {result.get('error')}")
+        if self.mode != MODE_PATH:
+            self._fetch_output(result["job"], file_path, metrics)
+        return time.time() - start
+
+    def _follow(self, response, name: str, status_updater, stop_event) -> dict:
+        # Legge gli eventi dell'agente; chiudere la connessione interrompe la conversione remota
+        try:
+            for line in response.iter_lines():
+                if stop_event.is_set(): raise Exception("Conversione interrotta.")
+                if not line: continue
+                event = json.loads(line)
+                if event.get("event") == "result": return event
+                if event.get("message"): status_updater.update_progress(name, f"{event['message']} (remoto)")
+                if event.get("data") and hasattr(status_updater, 'report_progress'): status_updater.report_progress(name, event["data"])
+        finally:
+            response.close()
+        raise RemoteEncodeError(f"{self.url}: connessione chiusa prima del risultato")
+
+    def _fetch_output(self, job_id: str, file_path: Path, metrics):
+        fetch_start = time.time()
+        tmp_path = file_path.with_name(file_path.name + ".remote")
+        try:
+            with requests.get(f"{self.url}/jobs/{job_id}/output", headers=self._headers, stream=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)) as response:
+                response.raise_for_status()
+                with open(tmp_path, "wb") as f:
+                    for chunk in response.iter_content(_CHUNK): f.write(chunk)
+            os.replace(tmp_path, file_path)
+        except (requests.RequestException, OSError) as e:
+            tmp_path.unlink(missing_ok=True)
+            raise RemoteEncodeError(f"{self.url}: download del file convertito fallito: {e}")
+        finally:
+            try: requests.delete(f"{self.url}/jobs/{job_id}", headers=self._headers, timeout=STATUS_TIMEOUT)
+            except requests.RequestException: pass
+        if metrics is not None:
+            metrics.add_stage("fetch", time.time() - fetch_start, bytes=file_path.stat().st_size, remote=self.url)
+
+
+def choose_encode_target(targets: dict, encoder: dict, registry_dir: str, log_dir: Path):
+    """
+    Sceglie dove convertire: restituisce un RemoteEncoder, oppure None per la conversione locale.
+    Per ogni destinazione stima il tempo per secondo di video: (attesa di uno slot + conversione)
+    diviso la velocità misurata (rapporto col tempo reale). In locale la velocità viene dallo storico
+    per il profilo dell'encoder e gli slot occupati sono gli ffmpeg nel registro dei processi;
+    per gli agenti entrambi arrivano da /status. Un agente non ancora misurato vale quanto il locale.
+    """
+    local_ratio = EtaPriors.from_history(Path(log_dir) / HISTORY_DB_NAME).speed_ratio(encode_profile(encoder))
+    local_busy = ProcessRegistry(registry_dir).running("ffmpeg")
+    best, best_cost = None, _cost(local_busy, targets["local_slots"], local_ratio)
+    for remote_config in targets["remote"]:
+        remote = RemoteEncoder(remote_config["url"], remote_config.get("mode", MODE_STREAM), remote_config.get("path_map"), remote_config.get("token"))
+        status = remote.status()
+        if status is None: continue
+        cost = _cost(status["active"] + status["waiting"], status["slots"], status.get("speed_ratio") or local_ratio)
+        if cost < best_cost: best, best_cost = remote, cost
+    return best
+
+def _cost(busy: int, slots: int, speed_ratio: float) -> float:
+    slots = max(1, slots)
+    return (1 + max(0, busy + 1 - slots) / slots) / max(speed_ratio, 0.01)
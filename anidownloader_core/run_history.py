@@ -0,0 +1,357 @@
+import re
+import json
+import time
+import socket
+import sqlite3
+from pathlib import Path
+
+from anidownloader_core.metrics import TaskMetrics
+
+# Dettaglio per task/fase conservato per questo numero di giorni, poi riassunto per giorno e serie
+DEFAULT_DETAIL_DAYS = 90
+# Le esecuzioni senza episodi (la maggior parte, con il timer ogni 15 minuti) vengono riassunte prima
+IDLE_RUN_DAYS = 7
+COMPACTION_INTERVAL = 24 * 60 * 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT,
+    started_at REAL NOT NULL,
+    finished_at REAL NOT NULL,
+    mode TEXT,
+    host TEXT,
+    series_planned INTEGER,
+    tasks_ok INTEGER,
+    tasks_failed INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_runs_started ON runs(started_at);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    run INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    ts REAL NOT NULL,
+    series TEXT COLLATE NOCASE,
+    episode INTEGER,
+    action TEXT,
+    ok INTEGER,
+    error TEXT,
+    error_class TEXT,
+    total_seconds REAL,
+    download_bytes INTEGER,
+    download_seconds REAL,
+    mean_speed REAL,
+    peak_speed REAL,
+    encode_seconds REAL,
+    encode_fps REAL,
+    input_bytes INTEGER,
+    output_bytes INTEGER,
+    retries INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_run ON tasks(run);
+CREATE INDEX IF NOT EXISTS idx_tasks_series ON tasks(series, ts);
+CREATE INDEX IF NOT EXISTS idx_tasks_ts ON tasks(ts);
+CREATE INDEX IF NOT EXISTS idx_tasks_total ON tasks(total_seconds);
+CREATE TABLE IF NOT EXISTS stages (
+    task INTEGER NOT NULL REFERENCES tasks(id) ON DELETE CASCADE,
+    stage TEXT NOT NULL,
+    duration REAL,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_stages_task ON stages(task);
+CREATE TABLE IF NOT EXISTS daily (
+    day TEXT NOT NULL,
+    series TEXT NOT NULL COLLATE NOCASE,
+    runs INTEGER DEFAULT 0,
+    tasks_ok INTEGER DEFAULT 0,
+    tasks_failed INTEGER DEFAULT 0,
+    download_bytes INTEGER DEFAULT 0,
+    download_seconds REAL DEFAULT 0,
+    encode_seconds REAL DEFAULT 0,
+    PRIMARY KEY (day, series)
+);
+CREATE TABLE IF NOT EXISTS sources (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    ok INTEGER DEFAULT 0,
+    failed INTEGER DEFAULT 0,
+    last_error TEXT,
+    last_ok REAL,
+    last_failed REAL,
+    PRIMARY KEY (kind, name)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Classificazione degli errori a partire dai messaggi prodotti da scraper e media_processor
+_ERROR_CLASSES = [
+    ("interrupted", r"interrott"),
+    ("network", r"errore di rete|timeout|connection"),
+    ("browser", r"selenium|webdriver"),
+    ("download", r"download|aria2c"),
+    ("encode", r"conversione|ffmpeg"),
+    ("parse", r"selettore|impossibile estrarre|link di download"),
+]
+
+def classify_error(message: str):
+    if not message:
+        return None
+    lowered = message.lower()
+    for error_class, pattern in _ERROR_CLASSES:
+        if re.search(pattern, lowered):
+            return error_class
+    return "other"
+
+def parse_since(value: str, now: float = None) -> float:
+    """Converte '7d', '12h', '30m', '2w' o una data 'AAAA-MM-GG' in un timestamp."""
+    now = time.time() if now is None else now
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([mhdw])", value.strip().lower())
+    if match:
+        return now - float(match.group(1)) * {"m": 60, "h": 3600, "d": 86400, "w": 604800}[match.group(2)]
+    return time.mktime(time.strptime(value.strip(), "%Y-%m-%d"))
+
+
+# Tipi di fonte nella tabella 'sources': servizio usato in pianificazione e host da cui si scarica
+SOURCE_SERVICE = "service"
+SOURCE_HOST = "host"
+
+def _source_outcomes(task: dict, result: dict) -> list:
+    """Esiti (tipo, nome, ok, errore) delle fonti di un task: pianificazione per servizio, download per host."""
+    outcomes = []
+    if not task.get("metrics"): return outcomes # Non pianificata (es. serie in carico a un'altra esecuzione)
+    planned = task.get("sources") or [{"service": task["series"].get("service"), "ok": "Errore" not in task.get("reason", ""), "reason": task.get("reason")}]
+    for source in planned:
+        if source.get("service"): outcomes.append((SOURCE_SERVICE, source["service"], source["ok"], None if source["ok"] else source.get("reason")))
+    for stage in ((result or {}).get("metrics") or {}).get("stages", []):
+        if stage["stage"] == "source" and stage.get("host"): outcomes.append((SOURCE_HOST, stage["host"], stage["ok"], stage.get("error")))
+    return outcomes
+
+def _stage_data(stage: dict):
+    extra = {k: v for k, v in stage.items() if k not in ("stage", "duration")}
+    return json.dumps(extra) if extra else None
+
+
+class RunHistory:
+    """
+    Storico delle esecuzioni in SQLite (WAL, come il backend delle serie): una riga per esecuzione,
+    una per ogni episodio elaborato o serie fallita in pianificazione, una per ogni fase misurata.
+    Le serie senza novità non generano righe di task, così una macchina che controlla ogni 15 minuti
+    per anni resta piccola; compact() riassume per giorno e serie i dettagli più vecchi.
+    """
+    def __init__(self, db_path: Path, detail_days: int = DEFAULT_DETAIL_DAYS):
+        self._db_path = Path(db_path)
+        self._detail_days = detail_days
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self._db_path, timeout=15, isolation_level=None)
+            # auto_vacuum ha effetto solo su un database nuovo: va impostato prima di creare le tabelle
+            self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    @property
+    def path(self) -> Path:
+        return self._db_path
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # --- Scrittura ---
+
+    def record_run(self, planned_tasks: list, results: list, started_at: float, finished_at: float = None,
+                   mode: str = "cli", run_id: str = None):
+        finished_at = time.time() if finished_at is None else finished_at
+        results_by_name = {r["name"]: r for r in results if r}
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            run = conn.execute(
+                "INSERT INTO runs (run_id, started_at, finished_at, mode, host, series_planned, tasks_ok, tasks_failed) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_id, started_at, finished_at, mode, socket.gethostname(), len(planned_tasks),
+                 sum(1 for r in results_by_name.values() if not r.get("error")), sum(1 for r in results_by_name.values() if r.get("error")))
+            ).lastrowid
+            for task in planned_tasks:
+                result = results_by_name.get(task["series"]["name"])
+                self._record_sources(conn, finished_at, task, result)
+                plan_error = task["action"] == "skip" and "Errore" in task.get("reason", "")
+                if task["action"] != "process" and not plan_error:
+                    continue # Nessun nuovo episodio: basta la riga dell'esecuzione
+                self._insert_task(conn, run, finished_at, task, result)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._compact_if_due()
+
+    @staticmethod
+    def _insert_task(conn, run: int, ts: float, task: dict, result: dict):
+        metrics = TaskMetrics.merge(task.get("metrics"), (result or {}).get("metrics"))
+        stages = {}
+        for stage in metrics["stages"]:
+            stages.setdefault(stage["stage"], stage) # In caso di più tentativi conta il primo
+        download, encode = stages.get("download", {}), [s for s in metrics["stages"] if s["stage"] == "encode"]
+        last_encode = encode[-1] if encode else {}
+        error = (result or {}).get("error") or (task.get("reason") if task["action"] == "skip" else None)
+
+        task_id = conn.execute(
+            "INSERT INTO tasks (run, ts, series, episode, action, ok, error, error_class, total_seconds, download_bytes, download_seconds, "
+            "mean_speed, peak_speed, encode_seconds, encode_fps, input_bytes, output_bytes, retries) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (run, ts, task["series"]["name"], task.get("final_ep_number"), task["action"], 0 if error else 1, error, classify_error(error),
+             sum(s["duration"] for s in metrics["stages"] if s["stage"] != "queue_wait"), download.get("bytes"), download.get("duration"),
+             download.get("mean_speed"), download.get("peak_speed"),
+             sum(s["duration"] for s in encode) if encode else None, last_encode.get("fps"),
+             last_encode.get("input_bytes"), last_encode.get("output_bytes"), metrics["counters"].get("encode_retries", 0))
+        ).lastrowid
+        conn.executemany(
+            "INSERT INTO stages (task, stage, duration, data) VALUES (?, ?, ?, ?)",
+            [(task_id, s["stage"], s["duration"], _stage_data(s)) for s in metrics["stages"]]
+        )
+
+    @staticmethod
+    def _record_sources(conn, ts: float, task: dict, result: dict):
+        # Contatori cumulativi per fonte: pochi record, aggiornati anche per le serie senza novità
+        for kind, name, ok, error in _source_outcomes(task, result):
+            conn.execute(
+                "INSERT INTO sources (kind, name, ok, failed, last_error, last_ok, last_failed) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(kind, name) DO UPDATE SET ok = ok + excluded.ok, failed = failed + excluded.failed, "
+                "last_error = COALESCE(excluded.last_error, last_error), last_ok = COALESCE(excluded.last_ok, last_ok), "
+                "last_failed = COALESCE(excluded.last_failed, last_failed)",
+                (kind, name, int(ok), int(not ok), error, ts if ok else None, None if ok else ts))
+
+    # --- Conservazione ---
+
+    def _compact_if_due(self):
+        row = self._connection().execute("SELECT value FROM meta WHERE key = 'last_compaction'").fetchone()
+        if row is None or time.time() - float(row[0]) >= COMPACTION_INTERVAL:
+            self.compact()
+
+    def compact(self, now: float = None):
+        """
+        Riassume nella tabella 'daily' (per giorno e serie) e rimuove i dettagli più vecchi di detail_days,
+        e le esecuzioni senza task più vecchie di IDLE_RUN_DAYS. Poi restituisce lo spazio al filesystem.
+        """
+        now = time.time() if now is None else now
+        detail_cutoff = now - self._detail_days * 86400
+        idle_cutoff = now - IDLE_RUN_DAYS * 86400
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO daily (day, series, tasks_ok, tasks_failed, download_bytes, download_seconds, encode_seconds) "
+                "SELECT date(ts, 'unixepoch', 'localtime'), series, SUM(ok), SUM(1 - ok), COALESCE(SUM(download_bytes), 0), "
+                "COALESCE(SUM(download_seconds), 0), COALESCE(SUM(encode_seconds), 0) FROM tasks WHERE ts < ? GROUP BY 1, 2 "
+                "ON CONFLICT(day, series) DO UPDATE SET tasks_ok = tasks_ok + excluded.tasks_ok, tasks_failed = tasks_failed + excluded.tasks_failed, "
+                "download_bytes = download_bytes + excluded.download_bytes, download_seconds = download_seconds + excluded.download_seconds, "
+                "encode_seconds = encode_seconds + excluded.encode_seconds",
+                (detail_cutoff,))
+            # Le esecuzioni sono contate sotto la serie '' (l'intera installazione)
+            run_filter = "finished_at < ? OR (finished_at < ? AND NOT EXISTS (SELECT 1 FROM tasks WHERE tasks.run = runs.id))"
+            conn.execute(
+                f"INSERT INTO daily (day, series, runs) SELECT date(finished_at, 'unixepoch', 'localtime'), '', COUNT(*) FROM runs WHERE {run_filter} GROUP BY 1 "
+                "ON CONFLICT(day, series) DO UPDATE SET runs = runs + excluded.runs",
+                (detail_cutoff, idle_cutoff))
+            conn.execute(f"DELETE FROM runs WHERE {run_filter}", (detail_cutoff, idle_cutoff)) # Task e fasi seguono con ON DELETE CASCADE
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_compaction', ?)", (str(now),))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("PRAGMA incremental_vacuum")
+
+    # --- Interrogazione ---
+
+    def query_tasks(self, series: str = None, since: float = None, slowest: bool = False, limit: int = 20) -> list:
+        """Task elaborati, dal più recente (o dal più lento con slowest). 'series' cerca per prefisso, senza maiuscole."""
+        clauses, params = [], []
+        if series:
+            clauses.append("series LIKE ? ESCAPE '\\'"); params.append(series.replace("%", r"\%").replace("_", r"\_") + "%")
+        if since is not None:
+            clauses.append("ts >= ?"); params.append(since)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        order = "total_seconds DESC" if slowest else "ts DESC"
+        conn = self._connection()
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = conn.execute(f"SELECT * FROM tasks {where} ORDER BY {order} LIMIT ?", (*params, limit)).fetchall()
+            return [dict(row) for row in rows]
+        finally:
+            conn.row_factory = None
+
+    def source_stats(self) -> list:
+        """Esiti cumulativi per fonte (servizio in pianificazione, host in download) con il tasso di successo."""
+        conn = self._connection()
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = [dict(row) for row in conn.execute("SELECT * FROM sources ORDER BY kind DESC, ok + failed DESC").fetchall()]
+        finally:
+            conn.row_factory = None
+        for row in rows: row["success_rate"] = row["ok"] / (row["ok"] + row["failed"]) if row["ok"] + row["failed"] else None
+        return rows
+
+    def summary(self, since: float = None) -> dict:
+        """Totali dal dettaglio ancora presente più, senza filtro temporale, i giorni già compattati."""
+        conn = self._connection()
+        since = since or 0
+        runs = conn.execute("SELECT COUNT(*) FROM runs WHERE finished_at >= ?", (since,)).fetchone()[0]
+        ok, failed, downloaded = conn.execute(
+            "SELECT COALESCE(SUM(ok), 0), COALESCE(SUM(1 - ok), 0), COALESCE(SUM(download_bytes), 0) FROM tasks WHERE ts >= ?", (since,)).fetchone()
+        since_day = time.strftime("%Y-%m-%d", time.localtime(since))
+        compacted = conn.execute(
+            "SELECT COALESCE(SUM(runs), 0), COALESCE(SUM(tasks_ok), 0), COALESCE(SUM(tasks_failed), 0), COALESCE(SUM(download_bytes), 0) FROM daily WHERE day >= ?",
+            (since_day,)).fetchone()
+        return {"runs": runs + compacted[0], "tasks_ok": ok + compacted[1], "tasks_failed": failed + compacted[2], "download_bytes": downloaded + compacted[3]}
+
+
+def print_history(history: RunHistory, series: str = None, since: str = None, slowest: bool = False, limit: int = 20, as_json: bool = False):
+    """Stampa lo storico per il sottocomando 'history' della CLI."""
+    since_ts = parse_since(since) if since else None
+    rows = history.query_tasks(series=series, since=since_ts, slowest=slowest, limit=limit)
+    if as_json:
+        print(json.dumps({"summary": history.summary(since_ts), "tasks": rows}, indent=2, ensure_ascii=False))
+        return
+
+    print(f"{'data':<16} {'serie':<30} {'ep':>4} {'esito':<9} {'MB':>8} {'DL s':>7} {'MB/s':>6} {'fps':>6} {'totale':>8}")
+    for r in rows:
+        mb = (r["download_bytes"] or 0) / 1024 ** 2
+        speed = (r["mean_speed"] or 0) / 1024 ** 2
+        outcome = "ok" if r["ok"] else (r["error_class"] or "errore")
+        print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(r['ts'])):<16} {r['series'][:30]:<30} {r['episode'] or '':>4} {outcome:<9} "
+              f"{mb:>8.1f} {r['download_seconds'] or 0:>7.1f} {speed:>6.1f} {r['encode_fps'] or 0:>6.1f} {r['total_seconds'] or 0:>7.1f}s")
+    if not rows:
+        print("Nessun episodio registrato con questi filtri.")
+
+    totals = history.summary(since_ts)
+    print(f"\nEsecuzioni: {totals['runs']} | Episodi: {totals['tasks_ok']} ok, {totals['tasks_failed']} falliti | "
+          f"Scaricati: {totals['download_bytes'] / 1024 ** 3:.2f} GB")
+
+
+def print_source_stats(history: RunHistory, as_json: bool = False):
+    """Stampa il tasso di successo delle fonti e il profilo degli host di download per 'history --sources'."""
+    from anidownloader_core.host_profiles import HostProfiles
+    rows = history.source_stats()
+    profile = HostProfiles.from_history(history.path).rows()
+    if as_json:
+        print(json.dumps({"sources": rows, "host_profiles": profile}, indent=2, ensure_ascii=False))
+        return
+    print(f"{'tipo':<8} {'fonte':<36} {'ok':>6} {'falliti':>7} {'successo':>8}  ultimo errore")
+    for r in rows:
+        rate = f"{r['success_rate'] * 100:.1f}%" if r["success_rate"] is not None else "-"
+        print(f"{r['kind']:<8} {r['name'][:36]:<36} {r['ok']:>6} {r['failed']:>7} {rate:>8}  {(r['last_error'] or '')[:60]}")
+    if not rows:
+        print("Nessuna fonte registrata.")
+    if profile:
+        print(f"\n{'host':<36} {'conn.':>5} {'ok':>4} {'falliti':>7} {'MB/s':>7} {'punteggio':>9}")
+        for r in profile:
+            speed = f"{r['median_speed'] / 1024 ** 2:.1f}" if r["median_speed"] else "-"
+            score = f"{r['score'] / 1024 ** 2:.1f}" if r["score"] is not None else "-"
+            print(f"{r['host'][:36]:<36} {r['connections']:>5} {r['ok']:>4} {r['failed']:>7} {speed:>7} {score:>9}")
@@ -1,24 +1,85 @@
-import os
 import re
 import time
-from urllib.parse import urljoin
+import threading
 import traceback
-
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+from urllib.parse import urljoin
 
 from .base_scraper import BaseScraper
-from bs4 import BeautifulSoup
+from .registry import register_scraper, ScraperCost, COST_BROWSER
 from .scraper_utils import ScraperUtils
+from .html_parsing import css_path, element_text, select
+
+# Selenium viene importato nei metodi: caricarlo costa centinaia di millisecondi
+# e serve solo quando una serie usa effettivamente questo servizio.
 
+# Percorso con cui è stato risolto il task (task["resolve_path"], registrato nelle metriche)
+RESOLVE_HTTP = "http"
+RESOLVE_SELENIUM = "selenium"
+_DOWNLOAD_URL_RE = re.compile(r"""window\.downloadUrl\s*=\s*(["'])(.*?)\1""")
+_QUOTED_URL_RE = re.compile(r"""(["'])((?:https?:)?/[^"'\s]*)\1""")
+# Attributi in cui il pulsante di un episodio può portare l'URL del player
+_EMBED_ATTRIBUTES = ("data-embed", "data-src", "data-url", "data-link")
+
+@register_scraper("animeU_scraper", cost=ScraperCost(kind=COST_BROWSER, expected_latency=25.0, max_concurrency_per_host=2))
 class animeUScraper(BaseScraper):
     EPISODE_LIST_SELECTOR = "div.episode-wrapper div.episode-item a"
+    EPISODE_LIST_XPATH = css_path(("div", "episode-wrapper"), ("div", "episode-item"), ("a",))
+    HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+    # Pagine intermedie seguite dal percorso HTTP prima di arrivare a quella con window.downloadUrl
+    MAX_EMBED_HOPS = 2
+
+    def __init__(self):
+        # Un driver per thread di pianificazione, riusato tra una serie e l'altra finché l'istanza è in cache
+        self._local = threading.local()
+        self._drivers = []
+        self._drivers_lock = threading.Lock()
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    def _get_session(self):
+        if self._session is None:
+            import requests
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    session.headers.update(self.HEADERS)
+                    session.verify = False
+                    self._session = session
+        return self._session
+
+    def _get_driver(self):
+        driver = getattr(self._local, "driver", None)
+        if driver is None:
+            driver = self._setup_driver()
+            self._local.driver = driver
+            with self._drivers_lock:
+                self._drivers.append(driver)
+        return driver
+
+    def _discard_driver(self):
+        driver = getattr(self._local, "driver", None)
+        if driver is None: return
+        self._local.driver = None
+        with self._drivers_lock:
+            if driver in self._drivers: self._drivers.remove(driver)
+        print("[DEBUG] Chiusura del driver.")
+        try: driver.quit()
+        except Exception: pass
+
+    def close(self):
+        with self._drivers_lock:
+            drivers, self._drivers = self._drivers, []
+        for driver in drivers:
+            try: driver.quit()
+            except Exception: pass
+        if self._session is not None:
+            self._session.close()
+            self._session = None
 
     def _setup_driver(self):
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+
         print("[DEBUG] Configurando il driver di Selenium...")
         chrome_options = Options()
         chrome_options.add_argument("--headless")
@@ -32,13 +93,99 @@ class animeUScraper(BaseScraper):
         print("[DEBUG] Driver di Selenium configurato.")
         return driver
 
+    @staticmethod
+    def _choose_episode(series: dict, found_episodes: list, task: dict):
+        """Primo episodio non ancora su disco (con la rinumerazione delle serie in continuazione), o (None, 0)."""
+        found_episodes.sort(key=lambda x: x['number'])
+        task["latest_available_episode"] = found_episodes[-1]['number'] # Usato dalla pianificazione adattiva
+        return ScraperUtils.choose_episode(series, found_episodes)
+
     def plan_series_task(self, series: dict) -> dict:
+        """
+        Prima il percorso HTTP (pagina della serie e pagina del player lette con requests, senza browser);
+        se fallisce, il flusso Selenium che clicca l'episodio e legge window.downloadUrl nell'iframe.
+        """
+        task = self._plan_with_http(series)
+        if task is not None:
+            task["resolve_path"] = RESOLVE_HTTP
+            return task
+        task = self._plan_with_browser(series)
+        task["resolve_path"] = RESOLVE_SELENIUM
+        return task
+
+    def _plan_with_http(self, series: dict):
+        """Restituisce il task, o None se la pagina non permette di risolverlo senza eseguire JavaScript."""
+        import requests
+        task = { "series": series, "action": "skip", "reason": "Nessun nuovo episodio trovato." }
+        series_page_url = series.get("series_page_url")
+        try:
+            session = self._get_session()
+            response = session.get(series_page_url, timeout=15)
+            response.raise_for_status()
+            found_episodes = []
+            for element in select(response.text, self.EPISODE_LIST_XPATH):
+                match = re.search(r'(\d+)', element_text(element))
+                if match: found_episodes.append({"number": int(match.group(1)), "embed_url": self._embed_url(element, series_page_url)})
+            # Lista generata da JavaScript: serve il browser
+            if not found_episodes: return self._fast_path_failed(series, "lista episodi assente nell'HTML")
+
+            episode_to_process, final_ep_num = self._choose_episode(series, found_episodes, task)
+            if not episode_to_process: return task
+
+            resolve_start = time.perf_counter()
+            if not episode_to_process["embed_url"]: return self._fast_path_failed(series, "URL del player non presente nel pulsante")
+            download_url = self._resolve_download_url(session, episode_to_process["embed_url"])
+            if not download_url: return self._fast_path_failed(series, "window.downloadUrl non trovato nella pagina del player")
+            task["resolve_time"] = time.perf_counter() - resolve_start
+            task.update({
+                "action": "process", "reason": f"Pronto per scaricare Ep. {final_ep_num}",
+                "download_url": download_url, "final_ep_number": final_ep_num
+            })
+            return task
+        except (requests.RequestException, ValueError) as e:
+            return self._fast_path_failed(series, str(e))
+
+    @staticmethod
+    def _fast_path_failed(series: dict, reason: str):
+        print(f"[DEBUG] Percorso HTTP non riuscito per '{series['name']}' ({reason}): si usa Selenium.")
+        return None
+
+    @staticmethod
+    def _embed_url(element, page_url: str):
+        """URL del player portato dal pulsante dell'episodio: attributi data-*, onclick o href."""
+        for attribute in _EMBED_ATTRIBUTES:
+            if element.get(attribute): return urljoin(page_url, element.get(attribute))
+        onclick = element.get("onclick") or ""
+        if match := _QUOTED_URL_RE.search(onclick): return urljoin(page_url, match.group(2))
+        href = (element.get("href") or "").strip()
+        if href and not href.startswith(("#", "javascript:")): return urljoin(page_url, href)
+        return None
+
+    def _resolve_download_url(self, session, url: str):
+        """Legge window.downloadUrl dalla pagina del player, seguendo al più MAX_EMBED_HOPS iframe #embed."""
+        for _ in range(self.MAX_EMBED_HOPS + 1):
+            response = session.get(url, timeout=15)
+            response.raise_for_status()
+            if match := _DOWNLOAD_URL_RE.search(response.text):
+                download_url = match.group(2).replace("\\/", "/")
+                return download_url if download_url.startswith('http') else None
+            iframes = select(response.text, "//iframe[@id='embed'][@src]")
+            if not iframes: return None
+            url = urljoin(url, iframes[0].get("src"))
+        return None
+
+    def _plan_with_browser(self, series: dict) -> dict:
         print(f"\n--- [DEBUG] Inizio pianificazione per: {series['name']} (AnimeU Scraper) ---")
         task = { "series": series, "action": "skip", "reason": "Nessun nuovo episodio trovato." }
         driver = None
 
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+
         try:
-            driver = self._setup_driver()
+            driver = self._get_driver()
+            driver.switch_to.default_content()
             
             series_page_url = series.get("series_page_url")
             print(f"[DEBUG] Navigazione alla pagina principale: {series_page_url}")
@@ -54,21 +201,12 @@ class animeUScraper(BaseScraper):
 
             if not found_episodes: return {**task, "reason": "Nessun episodio trovato."}
             
-            is_continuation = series.get("continue", False); passed_episodes = series.get("passed_episodes", 0)
-            next_episode_on_disk = ScraperUtils.get_next_episode_num(series.get("path"))
-            found_episodes.sort(key=lambda x: x['number'])
-            
-            episode_to_process, final_ep_num = None, 0
-            for ep in found_episodes:
-                local_equivalent = ep['number'] + passed_episodes if is_continuation else ep['number']
-                if local_equivalent >= next_episode_on_disk:
-                    episode_to_process, final_ep_num = ep, local_equivalent
-                    break
-            
+            episode_to_process, final_ep_num = self._choose_episode(series, found_episodes, task)
             if not episode_to_process: return task
 
             print(f"[DEBUG] Nuovo episodio trovato: N.{final_ep_num}. Tento di cliccare sul pulsante.")
 
+            resolve_start = time.perf_counter()
             initial_iframe_src = driver.find_element(By.ID, "embed").get_attribute("src")
             
             # --- MODIFICA CHIAVE: Esegui il click tramite JavaScript ---
@@ -91,6 +229,7 @@ class animeUScraper(BaseScraper):
             print("[DEBUG] Tento di leggere la variabile 'window.downloadUrl'...")
             download_url = driver.execute_script("return window.downloadUrl;")
             print(f"[DEBUG] Valore estratto: {download_url}")
+            task["resolve_time"] = time.perf_counter() - resolve_start
 
             if download_url and isinstance(download_url, str) and download_url.startswith('http'):
                 print("[DEBUG] URL valido trovato! Preparazione del task.")
@@ -104,11 +243,10 @@ class animeUScraper(BaseScraper):
         except Exception as e:
             print(f"\n[DEBUG] ERRORE CRITICO DURANTE LO SCRAPING DI '{series['name']}':\n{traceback.format_exc()}")
             task["reason"] = f"Errore Selenium: {e}"
+            # Il driver potrebbe essere in uno stato incoerente: alla prossima serie ne verrà creato uno nuovo
+            if driver: self._discard_driver()
 
         finally:
-            if driver:
-                print("[DEBUG] Chiusura del driver.")
-                driver.quit()
             print(f"--- [DEBUG] Fine pianificazione per: {series['name']}. Risultato: {task['reason']} ---\n")
         
         return task
\ No newline at end of file
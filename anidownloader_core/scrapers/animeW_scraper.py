@@ -1,83 +1,97 @@
 import re
-import requests
-from bs4 import BeautifulSoup
+import time
+import threading
 from urllib.parse import urljoin
 from .base_scraper import BaseScraper
+from .registry import register_scraper, ScraperCost, COST_HTTP
 from .scraper_utils import ScraperUtils
+from .html_parsing import css_path, first_href, links
 
 
+@register_scraper("animeW_scraper", cost=ScraperCost(kind=COST_HTTP, expected_latency=2.0, max_concurrency_per_host=4))
 class animeWScraper(BaseScraper):
     """Scraper specializzato per il sito 'AnimeW'."""
 
     # I selettori sono ora hardcoded qui, specifici per questo scraper.
     EPISODE_LIST_SELECTOR = "div.server.active ul.episodes.active li.episode a"
     DOWNLOAD_LINK_SELECTOR = "#alternativeDownloadLink"
+    # Stessi selettori in XPath per html_parsing (lxml senza BeautifulSoup)
+    EPISODE_LIST_XPATH = css_path(("div", "server", "active"), ("ul", "episodes", "active"), ("li", "episode"), ("a",))
+    DOWNLOAD_LINK_ID = "alternativeDownloadLink"
+    HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+
+    def __init__(self):
+        # L'istanza è riusata dal registro: la sessione mantiene le connessioni aperte tra una serie e l'altra
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    def _get_session(self):
+        if self._session is None:
+            import requests
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    session.headers.update(self.HEADERS)
+                    session.verify = False
+                    self._session = session
+        return self._session
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
 
     def plan_series_task(self, series: dict) -> dict:
         name = series["name"]
-        path = series["path"]
         series_page_url = series.get("series_page_url")
 
         task = { "series": series, "action": "skip", "reason": "Nessun nuovo episodio trovato." }
 
+        # Import ritardati: requests/lxml vengono caricati solo se una serie usa questo servizio
+        import requests
+
         try:
-            
-            headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-            response_main = requests.get(series_page_url, timeout=15, headers=headers, verify=False)
+            session = self._get_session()
+            response_main = session.get(series_page_url, timeout=15)
             response_main.raise_for_status()
-            soup_main = BeautifulSoup(response_main.text, 'lxml')
-            
-            episode_page_links = soup_main.select(self.EPISODE_LIST_SELECTOR)
+            # Solo numero e href dei link della lista episodi: sulle serie lunghe l'albero BeautifulSoup
+            # completo dominava il tempo di CPU della pianificazione
+            episode_page_links = links(response_main.text, self.EPISODE_LIST_XPATH, attribute='data-episode-num')
             if not episode_page_links:
                 task["reason"] = "Selettore lista episodi non ha trovato link."
                 return task
 
             found_episodes = []
-            for link in episode_page_links:
-                ep_num_str = link.get('data-episode-num') or link.get_text(strip=True)
+            for ep_num_str, href in episode_page_links:
                 match = re.search(r'(\d+)', ep_num_str)
                 if match:
                     ep_num = int(match.group(1))
-                    ep_page_url = urljoin(series_page_url, link.get('href'))
+                    ep_page_url = urljoin(series_page_url, href)
                     found_episodes.append({"number": ep_num, "page_url": ep_page_url})
             
             if not found_episodes:
                 task["reason"] = "Impossibile estrarre i numeri degli episodi dai link."
                 return task
 
-            is_continuation = series.get("continue", False)
-            passed_episodes = series.get("passed_episodes", 0)
-            next_episode_on_disk = ScraperUtils.get_next_episode_num(path)
-            
             found_episodes.sort(key=lambda x: x['number'])
-            
-            episode_to_process, final_ep_num = None, 0
-            for ep in found_episodes:
-                local_equivalent = ep['number'] + passed_episodes if is_continuation else ep['number']
-                if local_equivalent >= next_episode_on_disk:
-                    episode_to_process, final_ep_num = ep, local_equivalent
-                    break
+            task["latest_available_episode"] = found_episodes[-1]['number'] # Usato dalla pianificazione adattiva
+            episode_to_process, final_ep_num = ScraperUtils.choose_episode(series, found_episodes)
             
             if not episode_to_process:
                 return task
 
             # FASE 2: Trova il link di download finale
-            response_ep = requests.get(episode_to_process['page_url'], timeout=15, headers=headers, verify=False)
+            resolve_start = time.perf_counter()
+            response_ep = session.get(episode_to_process['page_url'], timeout=15)
             response_ep.raise_for_status()
-            soup_ep = BeautifulSoup(response_ep.text, 'lxml')
-            
-            final_link_element = soup_ep.select_one(self.DOWNLOAD_LINK_SELECTOR)
-            if not final_link_element:
-                for link in soup_ep.find_all('a', href=True):
-                    if "download alternativo" in link.get_text(strip=True).lower():
-                        final_link_element = link
-                        break
+            final_href = first_href(response_ep.text, self.DOWNLOAD_LINK_ID, text_fallback="download alternativo")
             
-            if final_link_element:
+            task["resolve_time"] = time.perf_counter() - resolve_start
+            if final_href:
                 task.update({
                     "action": "process",
                     "reason": f"Pronto per scaricare Ep. {final_ep_num}",
-                    "download_url": urljoin(episode_to_process['page_url'], final_link_element.get('href')),
+                    "download_url": urljoin(episode_to_process['page_url'], final_href),
                     "final_ep_number": final_ep_num
                 })
             else:
@@ -4,6 +4,8 @@ class BaseScraper(ABC):
     """
     Classe base astratta per tutti gli scraper.
     Definisce l'interfaccia che ogni scraper di sito deve implementare.
+    Le sottoclassi si registrano con @register_scraper (vedi registry.py), che imposta
+    anche SERVICE_NAME e la classe di costo COST usata dal pianificatore.
     """
     
     @abstractmethod
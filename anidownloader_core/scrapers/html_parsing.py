@@ -0,0 +1,62 @@
+import re
+
+# Estrazione diretta con lxml e XPath per le pagine lunghe: niente albero BeautifulSoup (oggetti Python
+# per ogni nodo), solo l'albero C di lxml e i pochi attributi che servono agli scraper.
+# bench_parsing.py (anidownloader_utils) confronta questi parser con BeautifulSoup e ne verifica i risultati.
+
+_XML_DECLARATION = re.compile(r"^\s*<\?xml[^>]*\?>")
+
+
+def has_class(name: str) -> str:
+    """Condizione XPath equivalente al selettore CSS '.name'."""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+def css_path(*steps) -> str:
+    """
+    XPath per una catena di discendenti come 'div.server.active ul.episodes.active li.episode a'.
+    Ogni passo è (tag, classe, classe...): css_path(("div", "server", "active"), ("a",)).
+    """
+    parts = []
+    for tag, *classes in steps:
+        parts.append(tag + "".join(f"[{has_class(c)}]" for c in classes))
+    return "//" + "//".join(parts)
+
+def parse_document(html: str):
+    """Albero lxml della pagina, o None se vuota. Accetta anche pagine con dichiarazione XML."""
+    import lxml.html
+    from lxml.etree import ParserError
+    html = _XML_DECLARATION.sub("", html, count=1) # lxml rifiuta le stringhe unicode con dichiarazione di encoding
+    try: return lxml.html.document_fromstring(html)
+    except ParserError: return None
+
+def element_text(element) -> str:
+    """Come get_text(strip=True) di BeautifulSoup: i frammenti di testo ripuliti e uniti senza spazi."""
+    return "".join(t.strip() for t in element.itertext())
+
+def select(html: str, xpath: str) -> list:
+    """Elementi lxml trovati da xpath (lista vuota se la pagina è vuota)."""
+    document = parse_document(html)
+    return document.xpath(xpath) if document is not None else []
+
+def links(html: str, xpath: str, attribute: str = None) -> list:
+    """
+    Coppie (etichetta, href) degli elementi trovati da xpath. L'etichetta è l'attributo 'attribute'
+    se presente, altrimenti il testo dell'elemento (calcolato solo quando serve).
+    """
+    document = parse_document(html)
+    if document is None: return []
+    return [((attribute and element.get(attribute)) or element_text(element), element.get("href")) for element in document.xpath(xpath)]
+
+def first_href(html: str, element_id: str, text_fallback: str = None):
+    """
+    href dell'elemento con id 'element_id'; se manca, del primo link il cui testo contiene
+    'text_fallback' (senza distinzione tra maiuscole e minuscole). None se non trovato.
+    """
+    document = parse_document(html)
+    if document is None: return None
+    found = document.xpath(f"//*[@id='{element_id}']")
+    if found: return found[0].get("href")
+    if text_fallback:
+        for element in document.xpath("//a[@href]"):
+            if text_fallback in element_text(element).lower(): return element.get("href")
+    return None
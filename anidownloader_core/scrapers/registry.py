@@ -0,0 +1,95 @@
+import importlib
+import importlib.util
+import threading
+from dataclasses import dataclass
+
+# Classi di costo dichiarate dagli scraper
+COST_HTTP = "http"          # Solo richieste HTTP: economico, si può parallelizzare molto
+COST_BROWSER = "browser"    # Avvia un browser headless: costoso in CPU/RAM
+
+# Gruppo di entry point per scraper forniti da pacchetti esterni
+ENTRY_POINT_GROUP = "anidownloader.scrapers"
+
+@dataclass(frozen=True)
+class ScraperCost:
+    kind: str = COST_HTTP
+    expected_latency: float = 2.0       # Secondi attesi per pianificare una serie
+    max_concurrency_per_host: int = 4   # Richieste contemporanee sicure verso lo stesso sito
+
+_registry = {}      # service -> classe scraper
+_instances = {}     # service -> istanza (cache per processo/worker)
+_lock = threading.Lock()
+
+def register_scraper(service_name: str, cost: ScraperCost = ScraperCost()):
+    """
+    Decoratore che registra una classe scraper sotto il nome di servizio usato nel campo "service" del JSON.
+
+    Esempio:
+        @register_scraper("altro_sito_scraper", cost=ScraperCost(kind=COST_HTTP))
+        class AltroSitoScraper(BaseScraper): ...
+    """
+    def decorator(cls):
+        cls.SERVICE_NAME = service_name
+        cls.COST = cost
+        _registry[service_name] = cls
+        return cls
+    return decorator
+
+def _import_service_module(service_name: str):
+    """
+    Importa il modulo che registra il servizio: prima per convenzione
+    (anidownloader_core.scrapers.<service>), poi tramite gli entry point installati.
+    """
+    module_name = f"anidownloader_core.scrapers.{service_name}"
+    if importlib.util.find_spec(module_name) is not None:
+        importlib.import_module(module_name)
+        return
+
+    from importlib.metadata import entry_points
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        if entry_point.name == service_name:
+            scraper_class = entry_point.load()
+            # Gli scraper esterni possono non usare il decoratore: registrali comunque
+            if service_name not in _registry:
+                register_scraper(service_name, getattr(scraper_class, "COST", ScraperCost()))(scraper_class)
+            return
+
+def get_scraper_class(service_name: str):
+    """Restituisce la classe scraper registrata per il servizio, importandone il modulo se necessario."""
+    if service_name not in _registry:
+        with _lock:
+            if service_name not in _registry:
+                try:
+                    _import_service_module(service_name)
+                except ImportError as e:
+                    raise ImportError(f"Impossibile caricare lo scraper per il servizio '{service_name}': {e}")
+    if service_name not in _registry:
+        raise ValueError(f"Servizio '{service_name}' non riconosciuto. Nessuno scraper registrato con questo nome.")
+    return _registry[service_name]
+
+def get_scraper_cost(service_name: str) -> ScraperCost:
+    return get_scraper_class(service_name).COST
+
+def is_instance_cached(service_name: str) -> bool:
+    return service_name in _instances
+
+def get_scraper_instance(service_name: str):
+    """Restituisce l'istanza dello scraper, creata una sola volta per processo."""
+    instance = _instances.get(service_name)
+    if instance is None:
+        scraper_class = get_scraper_class(service_name)
+        with _lock:
+            instance = _instances.get(service_name)
+            if instance is None:
+                instance = _instances[service_name] = scraper_class()
+    return instance
+
+def clear_instances():
+    """Chiude e dimentica le istanze in cache (es. alla chiusura del processo o al ricaricamento)."""
+    with _lock:
+        for instance in _instances.values():
+            close = getattr(instance, "close", None)
+            if close:
+                try: close()
+                except Exception: pass
+        _instances.clear()
@@ -1,13 +1,42 @@
 import os
 import re
+
+from anidownloader_core.content_index import ContentIndex
+
 class ScraperUtils:
 
-    # Utility function to determine the next episode number to download
-    def get_next_episode_num(series_path):
+    # Numeri degli episodi presenti nella cartella della serie (nomi come "Serie_Ep_05.mkv")
+    def episodes_on_disk(series_path):
         if not os.path.exists(series_path): os.makedirs(series_path)
-        max_ep = 0
+        episodes = set()
         for filename in os.listdir(series_path):
             if filename.endswith(('.mp4', '.mkv')):
                 match = re.search(r'[._-]Ep[._-]?(\d+)', filename, re.IGNORECASE)
-                if match: max_ep = max(max_ep, int(match.group(1)))
-        return max_ep + 1
\ No newline at end of file
+                if match: episodes.add(int(match.group(1)))
+        return episodes
+
+    # Utility function to determine the next episode number to download
+    def get_next_episode_num(series_path):
+        max_ep = max([0, *ScraperUtils.episodes_on_disk(series_path)])
+        # Episodi saltati perché identici a un file già presente (mirror che ricaricano lo stesso video)
+        max_ep = max([max_ep, *ContentIndex(series_path).duplicate_episodes()])
+        return max_ep + 1
+
+    def choose_episode(series: dict, found_episodes: list):
+        """
+        Episodio da scaricare tra quelli trovati sul sito ({"number", ...}), come (episodio, numero locale)
+        o (None, 0). Prima il più basso tra i duplicati scaduti ancora elencati sul sito (ContentIndex:
+        il mirror può aver caricato il file giusto), poi il primo non ancora su disco.
+        La numerazione locale tiene conto di 'continue' e 'passed_episodes'.
+        """
+        path = series.get("path")
+        offset = series.get("passed_episodes", 0) if series.get("continue", False) else 0
+        candidates = sorted((ep['number'] + offset, i) for i, ep in enumerate(found_episodes))
+        on_disk = ScraperUtils.episodes_on_disk(path)
+        recheck = set(ContentIndex(path).expired_duplicates()) - on_disk
+        for local_equivalent, i in candidates:
+            if local_equivalent in recheck: return found_episodes[i], local_equivalent
+        next_episode_on_disk = ScraperUtils.get_next_episode_num(path)
+        for local_equivalent, i in candidates:
+            if local_equivalent >= next_episode_on_disk: return found_episodes[i], local_equivalent
+        return None, 0
@@ -30,3 +30,14 @@ class SeriesRepository:
                 json.dump(series_data, f, indent=4, ensure_ascii=False)
         except Exception as e:
             raise Exception(f"Errore durante il salvataggio del file '{self._json_file_path}': {e}")
+
+
+def create_series_repository(json_file_path: Path, backend: str = "json", db_path: Path = None):
+    """
+    Restituisce il repository delle serie per il backend configurato.
+    Con "sqlite" il file JSON viene importato automaticamente al primo utilizzo.
+    """
+    if backend == "sqlite":
+        from anidownloader_core.sqlite_series_repository import SQLiteSeriesRepository
+        return SQLiteSeriesRepository(db_path, json_import_path=json_file_path)
+    return SeriesRepository(json_file_path)
@@ -0,0 +1,210 @@
+import json
+import sqlite3
+from pathlib import Path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS series (
+    name TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    service TEXT,
+    path TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_series_position ON series(position);
+CREATE INDEX IF NOT EXISTS idx_series_service ON series(service);
+CREATE INDEX IF NOT EXISTS idx_series_path ON series(path);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+class SQLiteSeriesRepository:
+    """
+    Backend SQLite alternativo a SeriesRepository.
+    Ogni serie è una riga (chiave: nome) con il dizionario originale serializzato in 'data';
+    service e path sono colonne indicizzate per le ricerche. Il database è in modalità WAL,
+    così la CLI lanciata dal timer e la GUI possono leggere e scrivere contemporaneamente.
+    """
+    def __init__(self, db_path: Path, json_import_path: Path = None):
+        self._db_path = Path(db_path)
+        self._json_import_path = Path(json_import_path) if json_import_path else None
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._db_path.parent.mkdir(parents=True, exist_ok=True)
+            # isolation_level=None: le transazioni sono gestite esplicitamente in _transaction()
+            self._conn = sqlite3.connect(self._db_path, timeout=15, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+            try:
+                self._import_json_once()
+            except Exception:
+                # Importazione fallita (es. nomi duplicati): si riprova alla prossima apertura invece di partire vuoti
+                self.close(); raise
+        return self._conn
+
+    def _transaction(self):
+        conn = self._connection()
+        return _Transaction(conn)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # --- Facciata compatibile con SeriesRepository ---
+
+    def load_series_data(self) -> list:
+        """Carica tutte le serie nell'ordine in cui sono state salvate."""
+        try:
+            rows = self._connection().execute("SELECT data FROM series ORDER BY position").fetchall()
+            return [json.loads(data) for (data,) in rows]
+        except (sqlite3.Error, json.JSONDecodeError) as e:
+            raise Exception(f"Errore durante il caricamento del database '{self._db_path}': {e}")
+
+    def save_series_data(self, series_data: list):
+        """
+        Salva l'intera lista, scrivendo però solo le righe effettivamente cambiate.
+        Le serie sono identificate dal nome: una lista con nomi duplicati viene rifiutata (se ne perderebbe una).
+        """
+        names = [series.get("name", "") for series in series_data]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise Exception(f"Impossibile salvare in '{self._db_path}': nomi di serie duplicati ({', '.join(repr(n) for n in duplicates)}).")
+        try:
+            with self._transaction() as conn:
+                current = {name: (position, data) for name, position, data in conn.execute("SELECT name, position, data FROM series")}
+                wanted_names = set()
+                for position, series in enumerate(series_data):
+                    name = series.get("name", "")
+                    wanted_names.add(name)
+                    data = json.dumps(series, ensure_ascii=False)
+                    if current.get(name) != (position, data):
+                        self._upsert_row(conn, series, position, data)
+                removed = [(name,) for name in current if name not in wanted_names]
+                if removed:
+                    conn.executemany("DELETE FROM series WHERE name = ?", removed)
+        except sqlite3.Error as e:
+            raise Exception(f"Errore durante il salvataggio del database '{self._db_path}': {e}")
+
+    # --- Operazioni per singola serie ---
+
+    def get_series(self, name: str):
+        row = self._connection().execute("SELECT data FROM series WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find_series_by_service(self, service: str) -> list:
+        rows = self._connection().execute("SELECT data FROM series WHERE service = ? ORDER BY position", (service,)).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def find_series_by_path(self, path: str) -> list:
+        rows = self._connection().execute("SELECT data FROM series WHERE path = ? ORDER BY position", (path,)).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def upsert_series(self, series: dict, previous_name: str = None):
+        """
+        Inserisce o aggiorna una singola serie. Se 'previous_name' è diverso dal nome attuale
+        la serie è stata rinominata: la riga esistente viene aggiornata mantenendo la posizione.
+        Senza 'previous_name' è una serie nuova. Un inserimento o una rinomina verso il nome di un'altra
+        serie esistente vengono rifiutati (il nome è la chiave).
+        """
+        name = series.get("name", "")
+        lookup_name = previous_name if previous_name is not None else name
+        try:
+            with self._transaction() as conn:
+                if (previous_name is None or lookup_name != name) and conn.execute("SELECT 1 FROM series WHERE name = ?", (name,)).fetchone():
+                    raise ValueError(f"Esiste già una serie chiamata '{name}'.")
+                row = conn.execute("SELECT position FROM series WHERE name = ?", (lookup_name,)).fetchone()
+                if row:
+                    position = row[0]
+                    if lookup_name != name:
+                        conn.execute("DELETE FROM series WHERE name = ?", (lookup_name,))
+                else:
+                    position = conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM series").fetchone()[0]
+                self._upsert_row(conn, series, position, json.dumps(series, ensure_ascii=False))
+        except ValueError as e:
+            raise Exception(f"Impossibile aggiungere '{name}': {e}" if previous_name is None else f"Impossibile rinominare '{lookup_name}': {e}")
+        except sqlite3.Error as e:
+            raise Exception(f"Errore durante il salvataggio di '{series.get('name')}': {e}")
+
+    def delete_series(self, name: str):
+        try:
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM series WHERE name = ?", (name,))
+        except sqlite3.Error as e:
+            raise Exception(f"Errore durante la rimozione di '{name}': {e}")
+
+    @staticmethod
+    def _upsert_row(conn, series: dict, position: int, data: str):
+        conn.execute(
+            "INSERT INTO series (name, position, service, path, data) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET position = excluded.position, service = excluded.service, "
+            "path = excluded.path, data = excluded.data",
+            (series.get("name", ""), position, series.get("service"), series.get("path"), data)
+        )
+
+    # --- Importazione / esportazione del formato JSON ---
+
+    def _import_json_once(self):
+        """Al primo utilizzo importa il vecchio series_data.json, se presente."""
+        if not self._json_import_path or not self._json_import_path.exists():
+            return
+        if self._conn.execute("SELECT 1 FROM meta WHERE key = 'json_imported'").fetchone():
+            return
+        self.import_from_json(self._json_import_path)
+
+    def import_from_json(self, json_path: Path):
+        """Importa un file nel formato di series_data.json, sostituendo il contenuto attuale."""
+        json_path = Path(json_path)
+        with open(json_path, 'r', encoding='utf-8') as f:
+            series_data = json.load(f)
+        self.save_series_data(series_data)
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_imported', ?)", (str(json_path),))
+        return len(series_data)
+
+    def export_to_json(self, json_path: Path):
+        """Esporta il database nel formato di series_data.json."""
+        json_path = Path(json_path)
+        series_data = self.load_series_data()
+        json_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(series_data, f, indent=4, ensure_ascii=False)
+        return len(series_data)
+
+
+class _Transaction:
+    """Context manager minimale: BEGIN IMMEDIATE evita deadlock tra scrittori concorrenti."""
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __enter__(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self._conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        return False
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    sys.path.append(str(Path(__file__).resolve().parent.parent))
+    from anidownloader_config.defaults import DEFAULT_SERIES_JSON_PATH, DEFAULT_SERIES_DB_PATH
+
+    parser = argparse.ArgumentParser(description="Importa/esporta le serie tra series_data.json e il database SQLite.")
+    parser.add_argument("action", choices=["import", "export"])
+    parser.add_argument("--json", type=Path, default=DEFAULT_SERIES_JSON_PATH)
+    parser.add_argument("--db", type=Path, default=DEFAULT_SERIES_DB_PATH)
+    args = parser.parse_args()
+
+    repository = SQLiteSeriesRepository(args.db)
+    if args.action == "import":
+        print(f"Importate {repository.import_from_json(args.json)} serie da '{args.json}' in '{args.db}'.")
+    else:
+        print(f"Esportate {repository.export_to_json(args.json)} serie da '{args.db}' in '{args.json}'.")
+    repository.close()
@@ -0,0 +1,86 @@
+import re
+import sys
+import json
+import time
+import shutil
+
+from anidownloader_core.eta import format_duration
+
+_PERCENT_RE = re.compile(r"\s*-\s*\d+%")
+
+
+def status_state(message: str) -> str:
+    """Stato di un task senza la percentuale: 'Download Ep. 5 - 42%' -> 'Download Ep. 5'."""
+    return _PERCENT_RE.sub("", message or "")
+
+
+class StatusRenderer:
+    """
+    Stato dei task della CLI. Riceve a ogni ciclo un'istantanea già copiata del dizionario condiviso
+    (una sola chiamata al Manager invece di una per serie).
+    Su un terminale ridisegna solo le righe cambiate; altrimenti (systemd, pipe, file) scrive una riga
+    JSON per ogni cambio di stato di un task, senza sequenze di escape.
+    """
+    def __init__(self, names: list, stream=None, json_mode: bool = None):
+        self._names = list(names)
+        self._stream = stream or sys.stdout
+        self._json_mode = (not self._stream.isatty()) if json_mode is None else json_mode
+        self._lines = []   # Righe attualmente a schermo (modalità terminale)
+        self._states = {}  # Ultimo stato emesso per serie (modalità JSON)
+
+    def render(self, snapshot: dict, start_time: float, eta=None):
+        if self._json_mode: self._emit_changes(snapshot, eta)
+        else: self._redraw(self._build_lines(snapshot, start_time, eta))
+        self._stream.flush()
+
+    def close(self, snapshot: dict, start_time: float):
+        """Ultimo aggiornamento: stato finale dei task e, in modalità JSON, un evento di fine esecuzione."""
+        self.render(snapshot, start_time)
+        if self._json_mode:
+            self._write_event({"event": "run_finished", "elapsed": round(time.time() - start_time, 1)})
+            self._stream.flush()
+
+    # --- Terminale ---
+
+    def _build_lines(self, snapshot: dict, start_time: float, eta) -> list:
+        lines = [f"--- Stato Attività (Tempo: {time.time() - start_time:.0f}s) ---"]
+        for name in self._names:
+            task_eta = eta.task_eta(name) if eta else None
+            suffix = f" (ETA {format_duration(task_eta)})" if task_eta is not None else ""
+            lines.append(f"- {name:<35} : {snapshot.get(name, '...')}{suffix}")
+        summary = eta.summary() if eta else ""
+        lines += ["", summary or "Lavori in corso..."]
+        # Le righe che vanno a capo sfaserebbero gli spostamenti del cursore
+        width = shutil.get_terminal_size().columns - 1
+        return [line[:width] for line in lines]
+
+    def _redraw(self, lines: list):
+        if len(lines) != len(self._lines):
+            self._stream.write("\n".join(lines) + "\n")
+            self._lines = lines
+            return
+        out = []
+        for i, (old, new) in enumerate(zip(self._lines, lines)):
+            if old == new: continue
+            up = len(lines) - i
+            # Sale alla riga, la cancella, la riscrive e torna sotto il blocco
+            out.append(f"\033[{up}F\033[2K{new}\033[{up}E")
+        self._stream.write("".join(out))
+        self._lines = lines
+
+    # --- JSON lines ---
+
+    def _emit_changes(self, snapshot: dict, eta):
+        for name in self._names:
+            message = snapshot.get(name)
+            if message is None: continue
+            state = status_state(message)
+            if self._states.get(name) == state: continue
+            self._states[name] = state
+            event = {"event": "status", "series": name, "status": state}
+            task_eta = eta.task_eta(name) if eta else None
+            if task_eta is not None: event["eta"] = round(task_eta)
+            self._write_event(event)
+
+    def _write_event(self, event: dict):
+        self._stream.write(json.dumps({"ts": round(time.time(), 3), **event}, ensure_ascii=False) + "\n")
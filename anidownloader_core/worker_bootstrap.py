@@ -0,0 +1,14 @@
+# Modulo di avvio dei worker: il forkserver lo precarica una volta sola, così ogni worker nasce con
+# la pipeline di elaborazione già importata ma senza PyQt6 né il resto della GUI.
+# Deve restare leggero: solo ciò che serve nei processi del Pool.
+from anidownloader_core.media_processor import process_series_task  # noqa: F401  (precaricato)
+
+
+class QueueStatusUpdater:
+    """Inoltra l'avanzamento dei worker alla GUI attraverso una coda del Manager."""
+    def __init__(self, queue): self._queue = queue
+    def update_progress(self, name: str, msg: str): self._queue.put(('progress', name, msg))
+    def report_error(self, name: str, err_msg: str): self._queue.put(('error', name, err_msg))
+    def report_progress(self, name: str, data: dict): self._queue.put(('eta', name, data))
+    def report_finished(self, name: str, path: str, dl_time: float, conv_time: float):
+        self._queue.put(('finished', name, path, dl_time, conv_time))
@@ -0,0 +1,199 @@
+import sys
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+import threading
+import subprocess
+import multiprocessing as mp
+from pathlib import Path
+
+# --- Rendi importabili i moduli del progetto ---
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+# ------------------------------------
+
+from anidownloader_config.defaults import DEFAULT_APP_CONFIG_PATH, DEFAULT_ENCODER_SETTINGS
+from anidownloader_core.media_processor import convert_and_verify_episode
+from anidownloader_core.metrics import TaskMetrics
+
+# --- Configurazione ---
+CLIP_FPS = 24
+DEFAULT_DURATION = 10
+DEFAULT_SIZE = "1920x1080"
+DEFAULT_PRESETS = ["veryfast", "faster", "medium"]
+# Ordine dei preset di x265, dal più veloce al più efficiente in compressione
+X265_PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow", "placebo"]
+
+# Sorgenti lavfi deterministiche: stessi fotogrammi a ogni generazione
+CONTENT_SOURCES = {
+    # Stile anime: campiture piatte, contorni netti, un soggetto che si muove su uno sfondo quasi fermo
+    "flat": ("color=c=0xf2d7b6:s={size}:r={fps}:d={duration},drawgrid=w=iw/8:h=ih/6:t=4:c=0x1a1a1a[bg];"
+             "color=c=0x3b6fb6:s=480x480:r={fps}:d={duration},drawbox=x=0:y=0:w=iw:h=ih:t=8:c=black[fg];"
+             "[bg][fg]overlay=x='mod(t*320,W)':y='H/3+H/6*sin(t*2)'"),
+    # Scene d'azione: tutto il quadro cambia a ogni fotogramma, più rumore temporale
+    "motion": "testsrc2=s={size}:r={fps}:d={duration},noise=alls=14:allf=t+u:all_seed=42",
+}
+AUDIO_SOURCE = "sine=frequency=440:sample_rate=48000:duration={duration}"
+# --------------------
+
+
+class _SilentStatusUpdater:
+    def update_progress(self, series_name: str, message: str): pass
+    def report_error(self, series_name: str, error_message: str): pass
+
+
+def generate_clip(content: str, size: str, duration: int, clips_dir: Path) -> Path:
+    """Genera (una sola volta) una clip H.264 + AAC simile a un episodio scaricato."""
+    clip_path = clips_dir / f"{content}_{size}_{duration}s.mp4"
+    if clip_path.exists():
+        return clip_path
+    clips_dir.mkdir(parents=True, exist_ok=True)
+    video = CONTENT_SOURCES[content].format(size=size, fps=CLIP_FPS, duration=duration)
+    tmp_path = clip_path.with_suffix(".tmp.mp4")
+    cmd = ["ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", video, "-f", "lavfi", "-i", AUDIO_SOURCE.format(duration=duration),
+           "-c:v", "libx264", "-preset", "ultrafast", "-crf", "16", "-pix_fmt", "yuv420p", "-c:a", "aac", "-b:a", "128k", "-shortest", str(tmp_path)]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Generazione della clip '{content}' fallita:\n{result.stderr[-2000:]}")
+    tmp_path.replace(clip_path)
+    return clip_path
+
+def _encode_job(clip_path: str, job_dir: str, encoder: dict) -> dict:
+    """Esegue la pipeline reale (conversione, verifica, spostamento) su una copia della clip."""
+    job_dir = Path(job_dir)
+    job_dir.mkdir(parents=True)
+    # Ogni job lavora su una copia: la pipeline sostituisce il file d'ingresso con quello convertito
+    input_path = job_dir / "Bench_Ep_01.mp4"
+    shutil.copy(clip_path, input_path)
+    metrics = TaskMetrics("bench", 1)
+
+    start = time.perf_counter()
+    try:
+        convert_and_verify_episode(str(input_path), "bench", job_dir / "out", _SilentStatusUpdater(), threading.Event(),
+                                   job_dir / "errors.log", max_retries=1, metrics=metrics, encoder=encoder)
+        ok = True
+    except Exception:
+        ok = False
+    wall = time.perf_counter() - start
+
+    encode = next((s for s in metrics.stages if s["stage"] == "encode"), {})
+    return {"ok": ok, "wall_s": wall, "encode_s": encode.get("duration", 0.0), "fps": encode.get("fps") or 0.0,
+            "speed_ratio": encode.get("speed_ratio") or 0.0, "output_bytes": encode.get("output_bytes", 0)}
+
+def run_configuration(clip_path: Path, encoder: dict, concurrency: int, frames: int, work_dir: Path) -> dict:
+    """Esegue 'concurrency' conversioni in parallelo, come il Pool dell'applicazione."""
+    run_dir = Path(tempfile.mkdtemp(prefix="run_", dir=work_dir))
+    try:
+        with mp.Pool(concurrency) as pool:
+            start = time.perf_counter()
+            jobs = pool.starmap(_encode_job, [(str(clip_path), str(run_dir / f"job_{i}"), encoder) for i in range(concurrency)])
+            wall = time.perf_counter() - start
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+    ok_jobs = [j for j in jobs if j["ok"]]
+    return {
+        "ok": len(ok_jobs) == len(jobs),
+        "wall_s": round(wall, 2),
+        "fps": round(sum(j["fps"] for j in ok_jobs) / len(ok_jobs), 1) if ok_jobs else 0.0,
+        "min_speed_ratio": min((j["speed_ratio"] for j in ok_jobs), default=0.0),
+        "throughput_fps": round(frames * len(ok_jobs) / wall, 1) if wall else 0.0, # Fotogrammi/s di tutti i job insieme
+        "output_mb": round(sum(j["output_bytes"] for j in ok_jobs) / len(ok_jobs) / 1024 ** 2, 2) if ok_jobs else 0.0,
+    }
+
+
+def recommend(rows: list, crf: int, min_speed: float):
+    """
+    Sceglie preset e thread. Per ogni combinazione conta il contenuto peggiore (di solito "motion"):
+    tra quelle che restano sopra 'min_speed' volte il tempo reale si preferisce il preset più lento
+    (file più piccoli a parità di CRF), a pari preset quella con il throughput aggregato più alto.
+    Restituisce (impostazioni, riga combinata, avviso).
+    """
+    combined = {}
+    for row in rows:
+        key = (row["preset"], row["threads"], row["concurrency"])
+        entry = combined.setdefault(key, {"preset": row["preset"], "threads": row["threads"], "concurrency": row["concurrency"],
+                                          "ok": True, "min_speed_ratio": float("inf"), "throughput_fps": [], "output_mb": []})
+        entry["ok"] &= row["ok"]
+        entry["min_speed_ratio"] = min(entry["min_speed_ratio"], row["min_speed_ratio"])
+        entry["throughput_fps"].append(row["throughput_fps"])
+        entry["output_mb"].append(row["output_mb"])
+    candidates = [dict(e, throughput_fps=sum(e["throughput_fps"]) / len(e["throughput_fps"])) for e in combined.values() if e["ok"]]
+    if not candidates:
+        return None, None, "Nessuna configurazione è stata completata con successo."
+
+    warning = None
+    eligible = [c for c in candidates if c["min_speed_ratio"] >= min_speed]
+    if not eligible:
+        eligible, warning = candidates, f"Nessuna configurazione raggiunge {min_speed}x il tempo reale: scelta quella più veloce."
+        best = max(eligible, key=lambda c: c["throughput_fps"])
+    else:
+        best = max(eligible, key=lambda c: (X265_PRESETS.index(c["preset"]) if c["preset"] in X265_PRESETS else -1, c["throughput_fps"]))
+    return {"crf": crf, "preset": best["preset"], "threads": best["threads"]}, best, warning
+
+
+def main():
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Benchmark della conversione H.265 e consiglio sulle impostazioni dell'encoder.")
+    parser.add_argument("--contents", nargs="+", default=list(CONTENT_SOURCES), choices=list(CONTENT_SOURCES), help="Tipi di clip da usare.")
+    parser.add_argument("--presets", nargs="+", default=DEFAULT_PRESETS, choices=X265_PRESETS, help="Preset di x265 da provare.")
+    parser.add_argument("--threads", type=int, nargs="+", default=sorted({cpu_count, max(1, cpu_count // 2)}, reverse=True), help="Valori di -threads da provare.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=sorted({1, min(2, cpu_count)}), help="Conversioni in parallelo da provare.")
+    parser.add_argument("--crf", type=int, default=DEFAULT_ENCODER_SETTINGS["crf"], help="CRF (qualità) usato in tutte le prove.")
+    parser.add_argument("--duration", type=int, default=DEFAULT_DURATION, help="Durata delle clip in secondi.")
+    parser.add_argument("--size", default=DEFAULT_SIZE, help="Risoluzione delle clip (LxA).")
+    parser.add_argument("--min-speed", type=float, default=1.0, help="Velocità minima richiesta (multipli del tempo reale) per ogni conversione.")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "anidownloader_bench_encode"), help="Cartella per clip generate e file temporanei.")
+    parser.add_argument("--json", dest="json_path", help="Salva risultati e consiglio in un file JSON.")
+    parser.add_argument("--write-config", action="store_true", help="Scrive le impostazioni consigliate in config.json ('encoder' e 'worker_processes').")
+    args = parser.parse_args()
+
+    if not shutil.which("ffmpeg"):
+        print("❌ ffmpeg non trovato nel PATH."); sys.exit(1)
+
+    work_dir = Path(args.work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    frames = args.duration * CLIP_FPS
+    clips = {content: generate_clip(content, args.size, args.duration, work_dir / "clips") for content in args.contents}
+
+    matrix = list(itertools.product(args.contents, args.presets, args.threads, args.concurrency))
+    print(f"--- Conversione H.265: {len(matrix)} configurazioni, clip {args.size} da {args.duration}s, CRF {args.crf} ---")
+    print(f"{'clip':>7} {'preset':>10} {'thread':>6} {'paral.':>6} {'fps':>7} {'aggreg.':>8} {'veloc.':>7} {'MB':>7} {'tempo':>8}")
+    rows = []
+    for content, preset, threads, concurrency in matrix:
+        encoder = {"crf": args.crf, "preset": preset, "threads": threads}
+        row = {"content": content, "preset": preset, "threads": threads, "concurrency": concurrency,
+               **run_configuration(clips[content], encoder, concurrency, frames, work_dir)}
+        rows.append(row)
+        status = "" if row["ok"] else "  ❌ fallita"
+        print(f"{content:>7} {preset:>10} {threads:>6} {concurrency:>6} {row['fps']:>7.1f} {row['throughput_fps']:>8.1f} "
+              f"{row['min_speed_ratio']:>6.2f}x {row['output_mb']:>7.2f} {row['wall_s']:>7.1f}s{status}")
+
+    settings, best, warning = recommend(rows, args.crf, args.min_speed)
+    print()
+    if warning: print(f"⚠️  {warning}")
+    if settings:
+        print(f"✅ Configurazione consigliata: {json.dumps(settings)}")
+        print(f"   ({best['concurrency']} conversioni in parallelo, {best['throughput_fps']:.1f} fotogrammi/s aggregati, "
+              f"almeno {best['min_speed_ratio']:.2f}x il tempo reale)")
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({"cpu_count": cpu_count, "config": {k: v for k, v in vars(args).items() if k != "json_path"},
+                       "results": rows, "recommended": settings, "warning": warning}, f, indent=4)
+
+    if args.write_config and settings:
+        from anidownloader_config.app_config_manager import AppConfigManager
+        config_manager = AppConfigManager(DEFAULT_APP_CONFIG_PATH)
+        config_manager.set("encoder", settings)
+        config_manager.set("worker_processes", best["concurrency"]) # Dimensione del Pool di elaborazione
+        print(f"💾 Impostazioni salvate in {DEFAULT_APP_CONFIG_PATH}")
+
+    sys.exit(0 if settings else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import sys
+import os
+import json
+import time
+import argparse
+import statistics
+
+# --- Rendi importabili i moduli del progetto ---
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+# ------------------------------------
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from anidownloader_core.scrapers.animeW_scraper import animeWScraper
+from anidownloader_core.scrapers.html_parsing import links
+from bench_planning import DEFAULT_PAGE_KB, SyntheticSite
+
+# --- Configurazione ---
+DEFAULT_EPISODE_COUNTS = [12, 100, 500, 2000]
+DEFAULT_REPEAT = 20
+# --------------------
+
+
+# --- Parser a confronto (lista episodi di animeWScraper) ---
+
+def parse_soup(html: str) -> list:
+    """Approccio precedente: albero BeautifulSoup completo e selettore CSS."""
+    soup = BeautifulSoup(html, 'lxml')
+    return [(a.get('data-episode-num') or a.get_text(strip=True), a.get('href')) for a in soup.select(animeWScraper.EPISODE_LIST_SELECTOR)]
+
+def parse_strainer(html: str) -> list:
+    """BeautifulSoup limitato alle liste 'ul.episodes' con SoupStrainer (il div.server.active esterno non è verificabile)."""
+    soup = BeautifulSoup(html, 'lxml', parse_only=SoupStrainer("ul", class_="episodes"))
+    return [(a.get('data-episode-num') or a.get_text(strip=True), a.get('href')) for a in soup.select("ul.episodes.active li.episode a")]
+
+def parse_lxml(html: str) -> list:
+    """Approccio attuale: albero lxml e XPath (html_parsing.links)."""
+    return links(html, animeWScraper.EPISODE_LIST_XPATH, attribute='data-episode-num')
+
+PARSERS = {"bs4": parse_soup, "bs4+strainer": parse_strainer, "lxml+xpath": parse_lxml}
+
+
+# --- Pagine ---
+
+def synthetic_pages(episode_counts: list, page_kb: int) -> list:
+    pages = []
+    for episodes in episode_counts:
+        _, _, body, _ = SyntheticSite(episodes, page_kb).resolve("/w/1", "http://127.0.0.1")
+        pages.append((f"sintetica {episodes} ep.", body.decode()))
+    return pages
+
+def recorded_pages(record_dir: str) -> list:
+    """Pagine catturate con bench_planning.py --record che contengono una lista episodi di animeW."""
+    with open(os.path.join(record_dir, "index.json"), 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    pages = []
+    for key, page in sorted(index["pages"].items()):
+        with open(os.path.join(record_dir, "pages", page["file"]), 'rb') as f:
+            html = f.read().decode("utf-8", errors="replace")
+        if parse_soup(html): pages.append((key[-40:], html))
+    return pages
+
+
+def measure(parser, html: str, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parser(html)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+def run(args) -> int:
+    pages = recorded_pages(args.pages_dir) if args.pages_dir else synthetic_pages(args.episodes, args.page_kb)
+    if not pages:
+        print("Nessuna pagina con una lista episodi da misurare.")
+        return 1
+
+    names = list(PARSERS)
+    print(f"--- Parsing della lista episodi (mediana di {args.repeat} ripetizioni, ms per pagina) ---")
+    print(f"{'pagina':<40} {'KB':>6} {'link':>5} " + " ".join(f"{n:>13}" for n in names) + f" {'speedup':>8} {'uguale':>7}")
+    rows, mismatches = [], 0
+    for label, html in pages:
+        expected = parse_soup(html)
+        timings = {name: measure(parser, html, args.repeat) for name, parser in PARSERS.items()}
+        # Il percorso lxml sostituisce bs4 nello scraper: deve dare esattamente lo stesso risultato
+        same = parse_lxml(html) == expected
+        mismatches += not same
+        speedup = timings["bs4"] / timings["lxml+xpath"] if timings["lxml+xpath"] else 0.0
+        print(f"{label:<40} {len(html) / 1024:>6.0f} {len(expected):>5} " + " ".join(f"{timings[n] * 1000:>11.2f}ms" for n in names)
+              + f" {speedup:>7.1f}x {'sì' if same else 'NO':>7}")
+        rows.append({"page": label, "bytes": len(html), "links": len(expected), "ms": {n: timings[n] * 1000 for n in names}, "same": same})
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({"python": sys.version, "config": {k: v for k, v in vars(args).items() if k != "json_path"}, "results": rows}, f, indent=4)
+    if mismatches: print(f"\n❌ {mismatches} pagine con risultati diversi tra lxml+xpath e bs4.")
+    return 1 if mismatches else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Confronto dei parser della lista episodi (BeautifulSoup, SoupStrainer, lxml+XPath).")
+    parser.add_argument("--pages", dest="pages_dir", help="Usa le pagine catturate con bench_planning.py --record invece di quelle sintetiche.")
+    parser.add_argument("--episodes", type=int, nargs="+", default=DEFAULT_EPISODE_COUNTS, help="Episodi delle pagine sintetiche.")
+    parser.add_argument("--page-kb", type=int, default=DEFAULT_PAGE_KB, help="Contenuto di contorno delle pagine sintetiche.")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Ripetizioni per pagina e parser.")
+    parser.add_argument("--json", dest="json_path", help="Salva i risultati in un file JSON per confrontarli nel tempo.")
+    sys.exit(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,391 @@
+import sys
+import os
+import json
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import math
+import multiprocessing as mp
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+# --- Rendi importabili i moduli del progetto ---
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+# ------------------------------------
+
+from anidownloader_config.defaults import DEFAULT_SERIES_JSON_PATH
+from anidownloader_core.planning_service import PlanningExecutors, plan_single_series
+from anidownloader_core.scrapers.registry import get_scraper_instance, clear_instances
+from anidownloader_core.scrapers.scraper_utils import ScraperUtils
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# --- Configurazione ---
+DEFAULT_SIZES = [10, 100, 1000]
+DEFAULT_EPISODES = 12
+DEFAULT_PAGE_KB = 64          # Le pagine reali sono piene di menu, script e commenti: il parser deve attraversarli
+MONITOR_INTERVAL = 0.05       # Campionamento di RSS e socket durante la pianificazione
+FILLER_PARAGRAPH = "<div class=\"comment\"><span class=\"user\">utente</span><p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p></div>\n"
+# --------------------
+
+
+# --- Sito locale ---
+
+class SyntheticSite:
+    """
+    Genera al volo le pagine delle serie sintetiche. La struttura HTML ricalca i selettori degli scraper:
+    - animeWScraper.EPISODE_LIST_SELECTOR ("div.server.active ul.episodes.active li.episode a")
+      e DOWNLOAD_LINK_SELECTOR ("#alternativeDownloadLink");
+    - animeUScraper.EPISODE_LIST_SELECTOR ("div.episode-wrapper div.episode-item a"), l'iframe #embed
+      e la pagina dell'iframe che definisce window.downloadUrl.
+    Se cambiano i selettori degli scraper, vanno aggiornati anche questi modelli.
+    """
+    def __init__(self, episodes: int, page_kb: int):
+        self.episodes = episodes
+        half = page_kb * 1024 // 2 # Metà prima e metà dopo il contenuto utile
+        self.filler = FILLER_PARAGRAPH * max(1, half // len(FILLER_PARAGRAPH)) # Solo blocchi interi: un tag troncato "mangerebbe" il contenuto
+
+    def _page(self, body: str) -> bytes:
+        return f"<!DOCTYPE html><html><head><title>Bench</title></head><body>{self.filler}{body}{self.filler}</body></html>".encode()
+
+    def resolve(self, path: str, origin: str):
+        parts = path.strip("/").split("/")
+        if parts[0] == "files":
+            return 200, "video/mp4", b"\0" * 1024, None
+        if len(parts) < 2:
+            return 404, "text/plain", b"not found", None
+        site, series_id, rest = parts[0], parts[1], parts[2:]
+
+        if site == "w" and not rest:
+            links = "".join(f'<li class="episode"><a data-episode-num="{n}" href="/w/{series_id}/ep/{n}">{n}</a></li>' for n in range(1, self.episodes + 1))
+            return 200, "text/html", self._page(f'<div class="server active"><ul class="episodes active">{links}</ul></div>'), None
+        if site == "w" and rest[0] == "ep":
+            href = f"/files/Bench_{series_id}_Ep_{int(rest[1]):02d}_SUB_ITA.mp4"
+            return 200, "text/html", self._page(f'<a id="alternativeDownloadLink" href="{href}">Download alternativo</a>'), None
+
+        if site == "u" and not rest:
+            links = "".join(
+                f'<div class="episode-item"><a href="#" onclick="document.getElementById(\'embed\').src=\'/u/{series_id}/embed/{n}\'; return false;">{n}</a></div>'
+                for n in range(1, self.episodes + 1))
+            return 200, "text/html", self._page(f'<div class="episode-wrapper">{links}</div><iframe id="embed" src="/u/{series_id}/embed/0"></iframe>'), None
+        if site == "u" and rest[0] == "embed":
+            n = int(rest[1])
+            script = f'<script>window.downloadUrl = "{origin}/files/Bench_{series_id}_Ep_{n:02d}_SUB_ITA.mp4";</script>' if n else ""
+            return 200, "text/html", self._page(script), None
+        return 404, "text/plain", b"not found", None
+
+
+class ReplaySite:
+    """Serve le pagine catturate con --record, sostituendo l'origine originale con quella locale."""
+    def __init__(self, record_dir: str):
+        self.record_dir = record_dir
+        with open(os.path.join(record_dir, "index.json"), 'r', encoding='utf-8') as f:
+            self.pages = json.load(f)["pages"]
+        self.origins = sorted({page["origin"] for page in self.pages.values()})
+
+    def resolve(self, path: str, origin: str):
+        page = self.pages.get(path)
+        if page is None:
+            return 404, "text/plain", b"not recorded", None
+        with open(os.path.join(self.record_dir, "pages", page["file"]), 'rb') as f:
+            body = f.read()
+        for recorded_origin in self.origins:
+            body = body.replace(recorded_origin.encode(), origin.encode())
+        location = page.get("location")
+        for recorded_origin in self.origins:
+            if location: location = location.replace(recorded_origin, origin)
+        return page["status"], page["content_type"], body, location
+
+
+class _BenchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, come i siti reali: le sessioni degli scraper riusano le connessioni
+
+    def do_GET(self):
+        server = self.server
+        delay = server.latency + server.rng.uniform(-server.jitter, server.jitter)
+        if delay > 0: time.sleep(delay)
+        status, content_type, body, location = server.site.resolve(self.path, f"http://127.0.0.1:{server.server_port}")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if location: self.send_header("Location", location)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _serve(site, hosts: int, latency: float, jitter: float, seed: int, conn):
+    """Processo del sito locale: un server per "host" (porte diverse = semafori per host diversi nel pianificatore)."""
+    servers = []
+    for i in range(hosts):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _BenchHandler)
+        server.daemon_threads = True
+        server.site, server.latency, server.jitter, server.rng = site, latency, jitter, random.Random(seed + i)
+        servers.append(server)
+    conn.send([f"http://127.0.0.1:{server.server_port}" for server in servers])
+    threads = [threading.Thread(target=server.serve_forever, daemon=True) for server in servers]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+def start_site(site, hosts: int = 1, latency: float = 0.0, jitter: float = 0.0, seed: int = 0):
+    """
+    Avvia il sito in un processo separato, così socket e memoria del server non finiscono
+    nelle misure del pianificatore. Restituisce (processo, lista delle origini).
+    """
+    parent_conn, child_conn = mp.Pipe()
+    process = mp.Process(target=_serve, args=(site, hosts, latency, jitter, seed, child_conn), daemon=True)
+    process.start()
+    return process, parent_conn.recv()
+
+
+# --- Misure ---
+
+def _rss_bytes() -> int:
+    if psutil: return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+def _open_sockets() -> int:
+    fd_dir, count = "/proc/self/fd", 0
+    try: fds = os.listdir(fd_dir)
+    except OSError: return 0
+    for fd in fds:
+        try:
+            if os.readlink(os.path.join(fd_dir, fd)).startswith("socket:"): count += 1
+        except OSError:
+            pass # Descrittore chiuso nel frattempo
+    return count
+
+class ResourceMonitor(threading.Thread):
+    """Campiona RSS e socket aperti in background e ne conserva il picco."""
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak_rss = self.peak_sockets = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.peak_rss = max(self.peak_rss, _rss_bytes())
+            self.peak_sockets = max(self.peak_sockets, _open_sockets())
+            self._stop_event.wait(MONITOR_INTERVAL)
+
+    def stop(self):
+        self._stop_event.set(); self.join()
+
+def _percentile(values: list, p: float) -> float:
+    if not values: return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)] # Nearest-rank
+
+def _plan_durations(tasks: list) -> list:
+    return [stage["duration"] for t in tasks for stage in t.get("metrics", {}).get("stages", []) if stage["stage"] == "plan"]
+
+def plan_and_measure(series_list: list):
+    """Pianifica come la CLI (PlanningExecutors, scraper a freddo) e misura tempo, latenze, RSS e socket."""
+    clear_instances()
+    baseline_sockets = _open_sockets() # Es. la pipe verso il processo del sito
+    monitor = ResourceMonitor(); monitor.start()
+    start = time.perf_counter()
+    with PlanningExecutors() as executors:
+        tasks = executors.plan(series_list)
+        sockets_kept = _open_sockets() - baseline_sockets # Connessioni keep-alive ancora aperte prima di chiudere gli scraper
+    wall = time.perf_counter() - start
+    monitor.stop()
+
+    durations = _plan_durations(tasks)
+    return tasks, {
+        "series": len(series_list),
+        "wall_s": round(wall, 3),
+        "series_per_s": round(len(series_list) / wall, 1) if wall else 0,
+        "p50_ms": round(_percentile(durations, 50) * 1000, 1),
+        "p95_ms": round(_percentile(durations, 95) * 1000, 1),
+        "max_ms": round(max(durations, default=0) * 1000, 1),
+        "peak_rss_mb": round(monitor.peak_rss / 1024 ** 2, 1),
+        "peak_sockets": max(0, monitor.peak_sockets - baseline_sockets),
+        "sockets_kept": sockets_kept,
+        "process": sum(1 for t in tasks if t["action"] == "process"),
+        "skip": sum(1 for t in tasks if t["action"] == "skip" and "Errore" not in t["reason"]),
+        "errors": sum(1 for t in tasks if "Errore" in t.get("reason", "")),
+    }
+
+
+# --- Modalità benchmark ---
+
+def make_series(count: int, service: str, origins: list, base_dir: str, episodes: int, up_to_date_ratio: float, rng: random.Random) -> list:
+    site = "u" if service == "animeU_scraper" else "w"
+    series_list = []
+    for i in range(count):
+        path = os.path.join(base_dir, f"series_{i}")
+        os.makedirs(path)
+        if rng.random() < up_to_date_ratio:
+            # Ultimo episodio già su disco: lo scraper si ferma dopo la pagina della serie
+            open(os.path.join(path, f"Bench_{i}_Ep_{episodes:02d}.mp4"), 'w').close()
+        series_list.append({
+            "name": f"Bench {i}", "path": path, "service": service,
+            "series_page_url": f"{origins[i % len(origins)]}/{site}/{i}/",
+            "continue": False, "passed_episodes": 0
+        })
+    return series_list
+
+def run_benchmark(args):
+    site = SyntheticSite(args.episodes, args.page_kb)
+    server_process, origins = start_site(site, args.hosts, args.latency_ms / 1000, args.jitter_ms / 1000, args.seed)
+    rng = random.Random(args.seed)
+    rows = []
+    try:
+        for size in args.sizes:
+            base_dir = tempfile.mkdtemp(prefix="anidownloader_bench_")
+            try:
+                series_list = make_series(size, args.scraper, origins, base_dir, args.episodes, args.up_to_date_ratio, rng)
+                _, row = plan_and_measure(series_list)
+                rows.append(row)
+            finally:
+                shutil.rmtree(base_dir, ignore_errors=True)
+    finally:
+        server_process.terminate()
+
+    print(f"--- Pianificazione: {args.scraper}, {args.hosts} host, latenza {args.latency_ms:.0f}±{args.jitter_ms:.0f} ms, pagine da {args.page_kb} KB ---")
+    print(f"{'serie':>6} {'tempo':>8} {'serie/s':>8} {'p50':>8} {'p95':>8} {'max':>8} {'RSS':>8} {'socket':>7} {'aperti':>7} {'ok':>5} {'skip':>5} {'err':>5}")
+    for r in rows:
+        print(f"{r['series']:>6} {r['wall_s']:>7.2f}s {r['series_per_s']:>8.1f} {r['p50_ms']:>6.1f}ms {r['p95_ms']:>6.1f}ms {r['max_ms']:>6.1f}ms "
+              f"{r['peak_rss_mb']:>6.1f}MB {r['peak_sockets']:>7} {r['sockets_kept']:>7} {r['process']:>5} {r['skip']:>5} {r['errors']:>5}")
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({"python": sys.version, "config": {k: v for k, v in vars(args).items() if k != "json_path"}, "results": rows}, f, indent=4)
+    return 1 if any(r["errors"] for r in rows) else 0
+
+
+# --- Registrazione e riproduzione di pagine reali ---
+
+def _path_key(url: str) -> str:
+    parsed = urlparse(url)
+    return parsed.path + (f"?{parsed.query}" if parsed.query else "")
+
+def _comparable(task: dict) -> dict:
+    """Campi del task che non dipendono dall'host: il nome del file scaricato, non l'URL completo."""
+    download_url = task.get("download_url")
+    return {
+        "action": task["action"],
+        "final_ep_number": task.get("final_ep_number"),
+        "latest_available_episode": task.get("latest_available_episode"),
+        "download_file": urlparse(download_url).path.rsplit("/", 1)[-1] if download_url else None
+    }
+
+def record(args):
+    """
+    Pianifica le serie reali salvando ogni risposta HTTP ricevuta dagli scraper, insieme al risultato atteso.
+    Funziona con gli scraper HTTP che espongono una sessione requests; gli scraper con browser vengono saltati.
+    """
+    with open(args.series_file, 'r', encoding='utf-8') as f:
+        series_list = json.load(f)
+    pages_dir = os.path.join(args.record_dir, "pages")
+    os.makedirs(pages_dir, exist_ok=True)
+    index = {"recorded_at": time.time(), "pages": {}, "series": []}
+
+    def save_response(response, *args, **kwargs):
+        key = _path_key(response.url)
+        filename = hashlib.sha1(key.encode()).hexdigest() + ".html"
+        with open(os.path.join(pages_dir, filename), 'wb') as f:
+            f.write(response.content)
+        parsed = urlparse(response.url)
+        index["pages"][key] = {
+            "origin": f"{parsed.scheme}://{parsed.netloc}", "file": filename, "status": response.status_code,
+            "content_type": response.headers.get("Content-Type", "text/html"), "location": response.headers.get("Location")
+        }
+
+    for series in series_list:
+        scraper = get_scraper_instance(series.get("service", ""))
+        if not hasattr(scraper, "_get_session"):
+            print(f"⏭️  {series.get('name')}: scraper '{series.get('service')}' non HTTP, saltato.")
+            continue
+        session = scraper._get_session()
+        session.hooks["response"].append(save_response)
+        try:
+            next_episode = ScraperUtils.get_next_episode_num(series["path"])
+            task = plan_single_series(series)
+        finally:
+            session.hooks["response"].remove(save_response)
+        recorded = {k: series.get(k) for k in ("name", "service", "series_page_url", "continue", "passed_episodes")}
+        index["series"].append({"series": recorded, "next_episode_on_disk": next_episode, "expected": _comparable(task)})
+        print(f"⏺️  {series['name']}: {task['reason']}")
+    clear_instances()
+
+    with open(os.path.join(args.record_dir, "index.json"), 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=4, ensure_ascii=False)
+    print(f"\nRegistrate {len(index['series'])} serie e {len(index['pages'])} pagine in {args.record_dir}")
+    return 0
+
+def replay(args):
+    """Ripianifica le serie registrate contro le pagine salvate e confronta con i risultati attesi."""
+    site = ReplaySite(args.replay_dir)
+    with open(os.path.join(args.replay_dir, "index.json"), 'r', encoding='utf-8') as f:
+        recorded_series = json.load(f)["series"]
+    server_process, origins = start_site(site, 1, args.latency_ms / 1000, args.jitter_ms / 1000, args.seed)
+    base_dir = tempfile.mkdtemp(prefix="anidownloader_replay_")
+    try:
+        series_list = []
+        for i, entry in enumerate(recorded_series):
+            path = os.path.join(base_dir, f"series_{i}")
+            os.makedirs(path)
+            if entry["next_episode_on_disk"] > 1:
+                # Ricrea lo stato del disco al momento della registrazione
+                open(os.path.join(path, f"Replay_Ep_{entry['next_episode_on_disk'] - 1:02d}.mp4"), 'w').close()
+            series_list.append({**entry["series"], "path": path, "series_page_url": origins[0] + _path_key(entry["series"]["series_page_url"])})
+        tasks, row = plan_and_measure(series_list)
+    finally:
+        server_process.terminate()
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+    failures = 0
+    for entry, task in zip(recorded_series, tasks):
+        actual = _comparable(task)
+        if actual == entry["expected"]:
+            print(f"✅ {entry['series']['name']}")
+        else:
+            failures += 1
+            print(f"❌ {entry['series']['name']}: atteso {entry['expected']}, ottenuto {actual} ({task['reason']})")
+    print(f"\n{len(tasks) - failures}/{len(tasks)} serie corrispondono. p50 {row['p50_ms']} ms, p95 {row['p95_ms']} ms.")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark della pianificazione contro un sito locale simulato.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--record", dest="record_dir", help="Cattura le pagine reali delle serie in questa cartella.")
+    mode.add_argument("--replay", dest="replay_dir", help="Riproduce le pagine catturate e verifica i risultati (test di regressione dei parser).")
+    parser.add_argument("--series-file", default=str(DEFAULT_SERIES_JSON_PATH), help="Serie da catturare con --record.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Numero di serie sintetiche per ogni misura.")
+    parser.add_argument("--scraper", default="animeW_scraper", choices=["animeW_scraper", "animeU_scraper"], help="Scraper da misurare (animeU usa Chrome solo se il percorso HTTP fallisce).")
+    parser.add_argument("--episodes", type=int, default=DEFAULT_EPISODES, help="Episodi per serie sintetica.")
+    parser.add_argument("--page-kb", type=int, default=DEFAULT_PAGE_KB, help="Dimensione approssimativa di ogni pagina.")
+    parser.add_argument("--up-to-date-ratio", type=float, default=0.5, help="Frazione di serie già aggiornate (solo la pagina della serie).")
+    parser.add_argument("--hosts", type=int, default=1, help="Numero di host simulati (porte diverse).")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Latenza di ogni risposta.")
+    parser.add_argument("--jitter-ms", type=float, default=20.0, help="Variazione casuale della latenza (±).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="json_path", help="Salva i risultati in un file JSON per confrontarli nel tempo.")
+    args = parser.parse_args()
+
+    # Le richieste verso il sito locale non devono passare da un eventuale proxy di sistema
+    os.environ["NO_PROXY"] = os.environ["no_proxy"] = "127.0.0.1,localhost"
+
+    if args.record_dir: sys.exit(record(args))
+    if args.replay_dir: sys.exit(replay(args))
+    sys.exit(run_benchmark(args))
+
+if __name__ == '__main__':
+    main()
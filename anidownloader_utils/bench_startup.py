@@ -0,0 +1,93 @@
+import sys
+import os
+import json
+import time
+import argparse
+import subprocess
+import statistics
+
+# --- Spostati nella root del progetto ---
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(project_root)
+# ------------------------------------
+
+# --- Configurazione ---
+# Moduli che la CLI non deve caricare nel percorso "nessun nuovo episodio"
+HEAVY_MODULES = ["PyQt6", "selenium", "bs4", "lxml", "requests", "anidownloader_core.media_processor"]
+
+# Codice eseguito nel processo misurato: importa la CLI e il servizio di pianificazione
+# esattamente come fa un avvio da timer, senza eseguire main().
+PROBE_CODE = f"""
+import sys, json
+sys.path.insert(0, {project_root!r})
+import AniDownloader
+from anidownloader_core.planning_service import plan_single_series
+print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))
+"""
+# --------------------
+
+def parse_importtime(stderr: str):
+    """
+    Interpreta l'output di '-X importtime'.
+    Restituisce il tempo totale (somma dei tempi 'self') e i moduli di primo livello con il loro tempo cumulativo.
+    """
+    total_us, top_level = 0, []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        total_us += int(self_us)
+        # I moduli di primo livello non hanno indentazione aggiuntiva nel nome
+        if not module.startswith("   "):
+            top_level.append((module.strip(), int(cumulative_us)))
+    return total_us, top_level
+
+def run_once():
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE_CODE], capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"Il processo di misura è fallito:\n{result.stderr[-2000:]}")
+    total_us, top_level = parse_importtime(result.stderr)
+    heavy_loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    return wall_ms, total_us, top_level, heavy_loaded
+
+def main():
+    parser = argparse.ArgumentParser(description="Misura il tempo di avvio a freddo della CLI (import graph).")
+    parser.add_argument("--runs", type=int, default=10, help="Numero di avvii da misurare.")
+    parser.add_argument("--top", type=int, default=10, help="Numero di import più lenti da mostrare.")
+    parser.add_argument("--json", dest="json_path", help="Salva i risultati in un file JSON per confrontarli nel tempo.")
+    parser.add_argument("--max-import-ms", type=float, help="Esce con codice 1 se il tempo di import mediano supera questa soglia.")
+    args = parser.parse_args()
+
+    walls, totals, last_top, heavy_loaded = [], [], [], []
+    for _ in range(args.runs):
+        wall_ms, total_us, last_top, heavy_loaded = run_once()
+        walls.append(wall_ms); totals.append(total_us / 1000)
+
+    print(f"--- Avvio CLI ({args.runs} esecuzioni, {sys.executable}) ---")
+    print(f"Tempo processo (mediana): {statistics.median(walls):.1f} ms")
+    print(f"Tempo import   (mediana): {statistics.median(totals):.1f} ms")
+    print(f"\nImport di primo livello più lenti:")
+    for module, cumulative_us in sorted(last_top, key=lambda x: x[1], reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {module}")
+
+    if heavy_loaded:
+        print(f"\n❌ Moduli pesanti caricati all'avvio: {', '.join(heavy_loaded)}")
+    else:
+        print("\n✅ Nessun modulo pesante caricato all'avvio.")
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "python": sys.version, "runs": args.runs,
+                "median_wall_ms": statistics.median(walls), "median_import_ms": statistics.median(totals),
+                "heavy_modules_loaded": heavy_loaded,
+                "top_imports": [{"module": m, "cumulative_ms": us / 1000} for m, us in sorted(last_top, key=lambda x: x[1], reverse=True)[:args.top]]
+            }, f, indent=4)
+
+    too_slow = args.max_import_ms is not None and statistics.median(totals) > args.max_import_ms
+    sys.exit(1 if heavy_loaded or too_slow else 0)
+
+if __name__ == '__main__':
+    main()
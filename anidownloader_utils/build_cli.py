@@ -64,7 +64,8 @@ def main():
         '--workpath=./build',
         '--specpath=.',
         '--hidden-import=requests',
-        '--hidden-import=bs4'
+        '--hidden-import=bs4',
+        '--hidden-import=lxml.html'  # Importato solo dentro le funzioni di scrapers/html_parsing.py
     ]
     
     # Ottieni gli argomenti specifici della piattaforma